@@ -1,16 +1,54 @@
+import functools
+import itertools
+import logging
+import os
 from typing import Any, Dict, Generic, Iterable, Iterator, Optional, Sequence, TypeVar, Union
 
+import numpy as np
+import torch.distributed
 from pie_core import Document, TaskEncoding, TaskModule
 from pytorch_lightning import LightningDataModule
 from torch.utils.data import DataLoader
 
-from pytorch_ie.dataset import IterableTaskEncodingDataset, TaskEncodingDataset
+from pytorch_ie.dataset import (
+    DocumentGroupedSampler,
+    IterableTaskEncodingDataLoader,
+    IterableTaskEncodingDataset,
+    LazyTaskEncodingDataset,
+    TaskEncodingDataset,
+    build_encoding_index,
+    get_shard_info,
+)
+from pytorch_ie.utils.compact_encoding import compact_task_encodings
+from pytorch_ie.utils.encoding_cache import (
+    CachedTaskEncodingSequence,
+    get_encoding_fingerprint,
+    is_cached,
+    save_task_encodings,
+)
+from pytorch_ie.utils.parallel_encoding import encode_in_parallel
+
+logger = logging.getLogger(__name__)
 
 DocumentType = TypeVar("DocumentType", bound=Document)
 InputEncoding = TypeVar("InputEncoding")
 TargetEncoding = TypeVar("TargetEncoding")
 
 
+def _encode_document_shard(
+    taskmodule: TaskModule,
+    documents: Iterable[Document],
+    show_progress: bool = False,
+    shard: bool = True,
+) -> Iterator[TaskEncoding]:
+    shard_index, num_shards = get_shard_info()
+    if shard and num_shards > 1:
+        documents = itertools.islice(documents, shard_index, None, num_shards)
+    return taskmodule.encode(  # type: ignore
+        documents, encode_target=True, as_iterator=True, show_progress=show_progress
+    )
+
+
 class PieDataModule(LightningDataModule, Generic[DocumentType, InputEncoding, TargetEncoding]):
     """A simple LightningDataModule for PIE document datasets.
 
@@ -26,6 +64,39 @@ class PieDataModule(LightningDataModule, Generic[DocumentType, InputEncoding, Ta
 
     Read the docs:
         https://pytorch-lightning.readthedocs.io/en/latest/extensions/datamodules.html
+
+    If cache_dir is set, prepare_data() encodes the splits once and saves the encodings to
+    cache_dir (see save_task_encodings()). The cache entries are keyed by a fingerprint of the
+    taskmodule config (including the prepared attributes) and the documents, so they are re-used
+    across runs with the same setup. setup() then just memory-maps the cached encodings on every
+    rank instead of encoding the documents again. The fingerprints are computed only on rank 0
+    and broadcast to the other ranks. Note that the splits need to be sequences (or
+    provide a _fingerprint) to be cached.
+
+    If num_encode_workers > 0, the documents are encoded by a pool of worker processes (see
+    encode_in_parallel()). This requires the splits to be sequences.
+
+    Streamed training data (an IterableTaskEncodingDataset) can not be shuffled completely, but
+    it can be shuffled with a buffer of shuffle_buffer_size encodings. If bucket_buffer_size is
+    set, bucket_buffer_size encodings are grouped into batches of similar length to reduce
+    padding (see IterableTaskEncodingDataset). The train dataloader advances the epoch of the
+    dataset each time it is iterated, so the order differs between the epochs.
+
+    By default, streamed documents are distributed over the dataloader workers and distributed
+    ranks, so the ranks can get a different number of batches, which hangs distributed training.
+    If equalize_shards is True, the task encodings are distributed instead and an incomplete last
+    round is dropped, so all ranks get the same number of batches. Then, each worker encodes all
+    documents.
+
+    If compact_encodings is True, encoded splits that are sequences are converted to compact
+    task encodings with int32 arrays and a shared document table (see compact_task_encodings()).
+    This reduces the memory per encoding and the cost of pickling them.
+
+    If lazy_encoding is True, splits that are sequences are not encoded up front. Instead, the
+    documents are encoded on demand in the dataloader workers (see LazyTaskEncodingDataset). The
+    index of the task encodings still requires to encode all documents once (with
+    num_encode_workers processes, see build_encoding_index()). If cache_dir is set, this is done
+    only once in prepare_data() and setup() loads the cached index on every rank.
     """
 
     def __init__(
@@ -37,6 +108,14 @@ class PieDataModule(LightningDataModule, Generic[DocumentType, InputEncoding, Ta
         val_split: Optional[str] = "validation",
         test_split: Optional[str] = "test",
         show_progress_for_encode: bool = False,
+        cache_dir: Optional[str] = None,
+        num_encode_workers: int = 0,
+        shuffle_buffer_size: int = 0,
+        bucket_buffer_size: int = 0,
+        seed: Optional[int] = None,
+        compact_encodings: bool = False,
+        lazy_encoding: bool = False,
+        equalize_shards: bool = False,
         **dataloader_kwargs,
     ):
         super().__init__()
@@ -48,7 +127,16 @@ class PieDataModule(LightningDataModule, Generic[DocumentType, InputEncoding, Ta
         self.val_split = val_split
         self.test_split = test_split
         self.show_progress_for_encode = show_progress_for_encode
+        self.cache_dir = cache_dir
+        self.num_encode_workers = num_encode_workers
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.bucket_buffer_size = bucket_buffer_size
+        self.seed = seed
+        self.compact_encodings = compact_encodings
+        self.lazy_encoding = lazy_encoding
+        self.equalize_shards = equalize_shards
         self.dataloader_kwargs = dataloader_kwargs
+        self._fingerprints: Dict[str, str] = {}
 
         self._data: Dict[
             str,
@@ -57,6 +145,7 @@ class PieDataModule(LightningDataModule, Generic[DocumentType, InputEncoding, Ta
                 IterableTaskEncodingDataset[
                     TaskEncoding[DocumentType, InputEncoding, TargetEncoding]
                 ],
+                LazyTaskEncodingDataset[TaskEncoding[DocumentType, InputEncoding, TargetEncoding]],
             ],
         ] = {}
 
@@ -87,22 +176,172 @@ class PieDataModule(LightningDataModule, Generic[DocumentType, InputEncoding, Ta
         return self.get_split_size(self.test_split)
 
     def encode_documents(
-        self, documents: Iterable[DocumentType]
-    ) -> Union[TaskEncodingDataset, IterableTaskEncodingDataset]:
+        self, documents: Iterable[DocumentType], index: Optional[np.ndarray] = None
+    ) -> Union[TaskEncodingDataset, IterableTaskEncodingDataset, LazyTaskEncodingDataset]:
+        if self.lazy_encoding and isinstance(documents, Sequence):
+            return LazyTaskEncodingDataset(
+                self.taskmodule, documents, encode_target=True, index=index
+            )
+        if self.num_encode_workers > 0 and isinstance(documents, Sequence):
+            task_encodings, _ = encode_in_parallel(
+                self.taskmodule,
+                documents,
+                num_workers=self.num_encode_workers,
+                encode_target=True,
+            )
+            return self._create_dataset(task_encodings, documents)
+        if not isinstance(documents, (Sequence, Iterator)):
+            # The documents can be iterated multiple times (e.g. a streamed dataset), so we
+            # encode them lazily for each epoch. Each dataloader worker and distributed rank
+            # encodes only its own shard of the documents, unless the shards of task encodings
+            # need to have the same size.
+            return IterableTaskEncodingDataset(
+                functools.partial(
+                    _encode_document_shard,
+                    self.taskmodule,
+                    documents,
+                    show_progress=self.show_progress_for_encode,
+                    shard=not self.equalize_shards,
+                ),
+                shard=self.equalize_shards,
+                equalize_shards=self.equalize_shards,
+            )
         task_encodings = self.taskmodule.encode(
             documents,
             encode_target=True,
             show_progress=self.show_progress_for_encode,
         )
         if isinstance(task_encodings, Sequence):
-            return TaskEncodingDataset(task_encodings)
+            return self._create_dataset(task_encodings, documents)
         elif isinstance(task_encodings, Iterator):
-            return IterableTaskEncodingDataset(task_encodings)
+            return IterableTaskEncodingDataset(
+                task_encodings, equalize_shards=self.equalize_shards
+            )
         else:
             raise TypeError(
                 f"task_encodings should be a Sequence or Iterator, but got {type(task_encodings)}"
             )
 
+    def _create_dataset(
+        self, task_encodings: Sequence[TaskEncoding], documents: Iterable[DocumentType]
+    ) -> TaskEncodingDataset:
+        if self.compact_encodings:
+            task_encodings = compact_task_encodings(
+                task_encodings, documents=documents if isinstance(documents, Sequence) else None
+            )
+        return TaskEncodingDataset(task_encodings)
+
+    def get_fingerprint(self, split: str) -> Optional[str]:
+        """Get the fingerprint of the encodings for the split, or None if the split can not be
+        cached because it is not a sequence."""
+        if split not in self._fingerprints:
+            documents = self.dataset[split]
+            if (
+                not isinstance(documents, Sequence)
+                and getattr(documents, "_fingerprint", None) is None
+            ):
+                logger.warning(
+                    f"can not cache the encodings of split={split} because it is not a sequence"
+                )
+                return None
+            self._fingerprints[split] = get_encoding_fingerprint(
+                self.taskmodule, documents, encode_target=True
+            )
+        return self._fingerprints[split]
+
+    def get_cache_path(self, split: str) -> Optional[str]:
+        """Get the path of the cached encodings for the split, or None if the split can not be
+        cached."""
+        if self.cache_dir is None:
+            return None
+        fingerprint = self.get_fingerprint(split)
+        if fingerprint is None:
+            return None
+        return os.path.join(self.cache_dir, f"{split}-{fingerprint}")
+
+    def get_index_path(self, split: str) -> Optional[str]:
+        """Get the path of the cached index of a lazily encoded split (see
+        LazyTaskEncodingDataset), or None if the index can not be cached."""
+        cache_path = self.get_cache_path(split)
+        if cache_path is None:
+            return None
+        return f"{cache_path}-index.npy"
+
+    def _build_encoding_index(self, documents: Sequence[DocumentType]) -> np.ndarray:
+        return build_encoding_index(
+            self.taskmodule, documents, encode_target=True, num_workers=self.num_encode_workers
+        )
+
+    def prepare_data(self) -> None:
+        """Encode the splits and save the encodings to cache_dir, if it is set and the encodings
+        are not yet cached.
+
+        This is called only once per node in distributed training, see
+        https://lightning.ai/docs/pytorch/stable/data/datamodule.html#prepare-data
+        """
+        if self.cache_dir is None:
+            return
+        for split in [self.train_split, self.val_split, self.test_split]:
+            if split is None or split not in self.dataset:
+                continue
+            cache_path = self.get_cache_path(split)
+            if cache_path is None:
+                continue
+            if is_cached(cache_path, self.get_fingerprint(split)):
+                logger.info(f"use cached encodings for split={split} from {cache_path}")
+                continue
+            documents = self.dataset[split]
+            index_path = self.get_index_path(split)
+            if self.lazy_encoding and isinstance(documents, Sequence) and index_path is not None:
+                # lazily encoded splits only need the index of the task encodings
+                if not os.path.exists(index_path):
+                    logger.info(f"save encoding index for split={split} to {index_path}")
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        np.save(f, self._build_encoding_index(documents))
+                    os.replace(tmp_path, index_path)
+                continue
+            task_encodings: Sequence[TaskEncoding]
+            if self.num_encode_workers > 0 and isinstance(documents, Sequence):
+                task_encodings, _ = encode_in_parallel(
+                    self.taskmodule,
+                    documents,
+                    num_workers=self.num_encode_workers,
+                    encode_target=True,
+                )
+            else:
+                task_encodings = self.taskmodule.encode(  # type: ignore
+                    documents,
+                    encode_target=True,
+                    as_iterator=False,
+                    show_progress=self.show_progress_for_encode,
+                )
+            logger.info(f"save encodings for split={split} to {cache_path}")
+            save_task_encodings(
+                task_encodings,
+                path=cache_path,
+                documents=documents if isinstance(documents, Sequence) else None,
+                fingerprint=self.get_fingerprint(split),
+            )
+
+    def _broadcast_fingerprints(self, split_names: Sequence[Optional[str]]) -> None:
+        """Compute the fingerprints of the splits only on rank 0 (where they are usually already
+        known from prepare_data()) and send them to the other ranks, because hashing the
+        documents can be expensive."""
+        if not (torch.distributed.is_available() and torch.distributed.is_initialized()):
+            return
+        fingerprints: Dict[str, Optional[str]] = {}
+        if torch.distributed.get_rank() == 0:
+            for split in split_names:
+                if split is not None and split in self.dataset:
+                    fingerprints[split] = self.get_fingerprint(split)
+        objects = [fingerprints]
+        torch.distributed.broadcast_object_list(objects, src=0)
+        for split, fingerprint in objects[0].items():
+            if fingerprint is not None:
+                self._fingerprints[split] = fingerprint
+
     def setup(self, stage: str) -> None:
 
         if stage == "fit":
@@ -114,15 +353,35 @@ class PieDataModule(LightningDataModule, Generic[DocumentType, InputEncoding, Ta
         else:
             raise NotImplementedError(f"not implemented for stage={stage} ")
 
+        if self.cache_dir is not None:
+            self._broadcast_fingerprints(split_names)
+
         for split in split_names:
             if split is None or split not in self.dataset:
                 continue
 
-            self._data[split] = self.encode_documents(self.dataset[split])
+            cache_path = self.get_cache_path(split)
+            if cache_path is not None and is_cached(cache_path, self.get_fingerprint(split)):
+                documents = self.dataset[split]
+                self._data[split] = TaskEncodingDataset(
+                    CachedTaskEncodingSequence(
+                        cache_path,
+                        documents=documents if isinstance(documents, Sequence) else None,
+                    )
+                )
+            else:
+                index = None
+                index_path = self.get_index_path(split) if self.lazy_encoding else None
+                if index_path is not None and os.path.exists(index_path):
+                    index = np.load(index_path)
+                elif self.lazy_encoding and isinstance(self.dataset[split], Sequence):
+                    index = self._build_encoding_index(self.dataset[split])
+                self._data[split] = self.encode_documents(self.dataset[split], index=index)
 
     def data_split(self, split: Optional[str] = None) -> Union[
         TaskEncodingDataset[TaskEncoding[DocumentType, InputEncoding, TargetEncoding]],
         IterableTaskEncodingDataset[TaskEncoding[DocumentType, InputEncoding, TargetEncoding]],
+        LazyTaskEncodingDataset[TaskEncoding[DocumentType, InputEncoding, TargetEncoding]],
     ]:
         if split is None or split not in self._data:
             raise ValueError(f"data for split={split} not available")
@@ -132,11 +391,31 @@ class PieDataModule(LightningDataModule, Generic[DocumentType, InputEncoding, Ta
         self,
     ) -> DataLoader[TaskEncoding[DocumentType, InputEncoding, TargetEncoding]]:
         ds = self.data_split(self.train_split)
+        if isinstance(ds, IterableTaskEncodingDataset):
+            ds.shuffle_buffer_size = self.shuffle_buffer_size
+            ds.bucket_buffer_size = self.bucket_buffer_size
+            ds.bucket_batch_size = self.dataloader_kwargs.get("batch_size", 1)
+            ds.seed = self.seed
+            # streamed datasets can only be shuffled with a buffer (see shuffle_buffer_size)
+            return IterableTaskEncodingDataLoader(
+                dataset=ds,
+                collate_fn=self.taskmodule.collate,
+                start_epoch=self.trainer.current_epoch if self.trainer is not None else 0,
+                **self.dataloader_kwargs,
+            )
+        if isinstance(ds, LazyTaskEncodingDataset):
+            # shuffle the documents, but keep the encodings of each document together, so that
+            # each document is encoded only once per epoch
+            return DataLoader(
+                dataset=ds,
+                collate_fn=self.taskmodule.collate,
+                sampler=DocumentGroupedSampler(ds, seed=self.seed if self.seed is not None else 0),
+                **self.dataloader_kwargs,
+            )
         return DataLoader(
             dataset=ds,
             collate_fn=self.taskmodule.collate,
-            # don't shuffle streamed datasets
-            shuffle=not isinstance(ds, IterableTaskEncodingDataset),
+            shuffle=True,
             **self.dataloader_kwargs,
         )
 
@@ -1,8 +1,17 @@
-from collections.abc import Iterator, Sequence
-from typing import TypeVar, Union, overload
+import itertools
+import random
+from collections import UserDict
+from collections.abc import Iterable, Iterator, Sequence
+from typing import Callable, List, Optional, Tuple, TypeVar, Union, overload
 
+import numpy as np
+import torch.distributed
+import torch.utils.data
 import torch.utils.data.dataset as torch_dataset
-from pie_core import TaskEncoding
+import torch.utils.data.distributed
+from pie_core import Document, TaskEncoding, TaskModule
+
+from pytorch_ie.utils.parallel_encoding import count_encodings_in_parallel
 
 TaskEncodingType = TypeVar("TaskEncodingType", bound=TaskEncoding)
 
@@ -26,9 +35,355 @@ class TaskEncodingDataset(torch_dataset.Dataset[TaskEncodingType]):
         return len(self._encodings)
 
 
+def encode_document(
+    taskmodule: TaskModule, document: Document, encode_target: bool = False
+) -> List[TaskEncoding]:
+    """Encode a single document as taskmodule.encode() does, but without calling the
+    on_encode_start() and on_encode_end() hooks. If encode_target is True, encodings without a
+    target are removed."""
+    task_encodings, _ = taskmodule.encode_inputs([document])
+    if encode_target:
+        task_encodings = taskmodule.encode_targets(task_encodings)
+    return list(task_encodings)
+
+
+def build_encoding_index(
+    taskmodule: TaskModule,
+    documents: Iterable[Document],
+    encode_target: bool = False,
+    num_workers: int = 0,
+) -> np.ndarray:
+    """Encode all documents once (without keeping the encodings) and create the index for a
+    LazyTaskEncodingDataset: an array with a row (document index, encoding index) for each task
+    encoding. If num_workers > 0 (and the documents are a sequence), the documents are encoded
+    by a pool of worker processes (see count_encodings_in_parallel())."""
+    if num_workers > 0 and isinstance(documents, Sequence):
+        counts = count_encodings_in_parallel(
+            taskmodule, documents, num_workers=num_workers, encode_target=encode_target
+        )
+    else:
+        counts = [
+            len(encode_document(taskmodule, document, encode_target)) for document in documents
+        ]
+    num_encodings = np.asarray(counts, dtype=np.int64)
+    document_indices = np.repeat(np.arange(len(num_encodings)), num_encodings)
+    first_encoding_positions = np.cumsum(num_encodings) - num_encodings
+    encoding_indices = np.arange(len(document_indices)) - np.repeat(
+        first_encoding_positions, num_encodings
+    )
+    return np.stack([document_indices, encoding_indices], axis=1).astype(np.int64)
+
+
+class LazyTaskEncodingDataset(torch_dataset.Dataset[TaskEncodingType]):
+    """A dataset that holds only the documents and encodes them on demand in __getitem__. When
+    used with a DataLoader, the encoding (tokenization, candidate creation, etc.) runs in the
+    dataloader workers and the full encoded dataset is never held in memory.
+
+    Since a document can result in multiple (or no) task encodings, the dataset requires an index
+    that maps each task encoding to its document and its position in the encodings of that
+    document. If not provided, the index is created by encoding all documents once (see
+    build_encoding_index()). Since this encodes all documents in the current process, the index
+    of a large dataset should be created only once and passed to all processes (as done by
+    PieDataModule with a cache_dir). The encodings of the last accessed document are cached, so
+    accessing the encodings in order encodes each document only once. With random access (e.g.
+    shuffle=True), documents with multiple encodings are encoded multiple times. To shuffle the
+    data anyway, use a DocumentGroupedSampler.
+
+    Note that the on_encode_start() and on_encode_end() hooks of the taskmodule are not called.
+    """
+
+    def __init__(
+        self,
+        taskmodule: TaskModule,
+        documents: Sequence[Document],
+        encode_target: bool = False,
+        index: Optional[Union[np.ndarray, Sequence[Tuple[int, int]]]] = None,
+    ):
+        taskmodule.assert_is_prepared()
+        self.taskmodule = taskmodule
+        self.documents = documents
+        self.encode_target = encode_target
+        if index is None:
+            index = build_encoding_index(taskmodule, documents, encode_target=encode_target)
+        self.index = np.asarray(index, dtype=np.int64).reshape(-1, 2)
+        self._cached_document_idx: Optional[int] = None
+        self._cached_encodings: List[TaskEncodingType] = []
+
+    def _get_encoding(self, index: int) -> TaskEncodingType:
+        document_idx, encoding_idx = (int(value) for value in self.index[index])
+        if document_idx != self._cached_document_idx:
+            self._cached_encodings = encode_document(  # type: ignore
+                self.taskmodule, self.documents[document_idx], encode_target=self.encode_target
+            )
+            self._cached_document_idx = document_idx
+        if encoding_idx >= len(self._cached_encodings):
+            raise ValueError(
+                f"document {document_idx} has only {len(self._cached_encodings)} task encodings, "
+                f"but the index refers to encoding {encoding_idx}. Was the index created with a "
+                f"different taskmodule or documents?"
+            )
+        return self._cached_encodings[encoding_idx]
+
+    @overload
+    def __getitem__(self, index: int) -> TaskEncodingType: ...
+
+    @overload
+    def __getitem__(self, s: slice) -> Sequence[TaskEncodingType]: ...
+
+    def __getitem__(
+        self, index: Union[int, slice]
+    ) -> Union[TaskEncodingType, Sequence[TaskEncodingType]]:
+        if isinstance(index, slice):
+            return [self._get_encoding(idx) for idx in range(*index.indices(len(self)))]
+        return self._get_encoding(index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class DocumentGroupedSampler(torch.utils.data.distributed.DistributedSampler):
+    """A sampler for a LazyTaskEncodingDataset that shuffles the documents and then the task
+    encodings of each document, but yields the encodings of a document one after another. Since
+    the dataset caches the encodings of the last accessed document, each document is encoded only
+    once per epoch (or twice, if its encodings are split over two batches that are loaded by
+    different dataloader workers), while the order of the documents still changes in each epoch
+    (see set_epoch(), called by the Lightning Trainer at the start of each epoch).
+
+    In distributed training, each rank gets a contiguous block of the shuffled encodings (instead
+    of every num_replicas-th encoding as with a DistributedSampler), so the encodings of a document
+    stay together. As for the DistributedSampler, all ranks get the same number of encodings (see
+    drop_last) and the shuffled order depends only on the seed and the epoch, so it is the same on
+    all ranks. If not given, num_replicas and rank are taken from the initialized process group
+    (or are 1 and 0, respectively).
+    """
+
+    def __init__(
+        self,
+        dataset: LazyTaskEncodingDataset,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+        shuffle: bool = True,
+        seed: int = 0,
+        drop_last: bool = False,
+    ):
+        is_distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+        if num_replicas is None:
+            num_replicas = torch.distributed.get_world_size() if is_distributed else 1
+        if rank is None:
+            rank = torch.distributed.get_rank() if is_distributed else 0
+        super().__init__(
+            dataset,
+            num_replicas=num_replicas,
+            rank=rank,
+            shuffle=shuffle,
+            seed=seed,
+            drop_last=drop_last,
+        )
+
+    def get_grouped_order(self) -> np.ndarray:
+        """Get the positions of all encodings of the dataset, grouped by document."""
+        index: np.ndarray = self.dataset.index  # type: ignore
+        if not self.shuffle:
+            # the index is already grouped by document
+            return np.arange(len(index))
+        rng = np.random.default_rng([self.seed, self.epoch])
+        document_indices = index[:, 0]
+        # the rank of each document in the shuffled order of the documents
+        document_ranks = rng.permutation(int(document_indices.max(initial=-1)) + 1)
+        # sort by the rank of the document and then randomly within the document
+        return np.lexsort((rng.random(len(index)), document_ranks[document_indices]))
+
+    def __iter__(self) -> Iterator[int]:
+        # repeat the first encodings to make it evenly divisible (or drop the last ones if
+        # drop_last is True)
+        indices = np.resize(self.get_grouped_order(), self.total_size)
+        start = self.rank * self.num_samples
+        return iter(indices[start : start + self.num_samples].tolist())
+
+
+def get_shard_info() -> Tuple[int, int]:
+    """Get the index of the current shard and the number of shards when distributing data over the
+    distributed ranks and the dataloader workers of each rank.
+
+    Returns:
+        A tuple (shard_index, num_shards).
+    """
+    rank, world_size = 0, 1
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+    worker_id, num_workers = 0, 1
+    worker_info = torch.utils.data.get_worker_info()
+    if worker_info is not None:
+        worker_id, num_workers = worker_info.id, worker_info.num_workers
+    return rank * num_workers + worker_id, world_size * num_workers
+
+
+def shard_items(
+    items: Iterable[TaskEncodingType], shard_index: int, num_shards: int, equalize: bool = False
+) -> Iterator[TaskEncodingType]:
+    """Get every num_shards-th item, starting at shard_index. If equalize is True, the items are
+    distributed in rounds of num_shards items and an incomplete last round is dropped, so all
+    shards get the same number of items (at most num_shards - 1 items are dropped in total)."""
+    if not equalize:
+        yield from itertools.islice(items, shard_index, None, num_shards)
+        return
+    iterator = iter(items)
+    while True:
+        items_of_round = list(itertools.islice(iterator, num_shards))
+        if len(items_of_round) < num_shards:
+            break
+        yield items_of_round[shard_index]
+
+
+def get_input_length(task_encoding: TaskEncoding) -> int:
+    """Get the number of input_ids of a task encoding."""
+    inputs = task_encoding.inputs
+    if not isinstance(inputs, (dict, UserDict)) or "input_ids" not in inputs:
+        raise ValueError("the length of task encodings without input_ids can not be determined")
+    return len(inputs["input_ids"])
+
+
+def shuffle_with_buffer(
+    items: Iterable[TaskEncodingType], buffer_size: int, rng: random.Random
+) -> Iterator[TaskEncodingType]:
+    """Shuffle a stream of items approximately with a buffer of buffer_size items: each new item
+    replaces a randomly selected item of the full buffer that is yielded."""
+    buffer: List[TaskEncodingType] = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        idx = rng.randrange(buffer_size)
+        yield buffer[idx]
+        buffer[idx] = item
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def bucket_by_length(
+    items: Iterable[TaskEncodingType],
+    buffer_size: int,
+    batch_size: int,
+    length_fn: Callable[[TaskEncodingType], int],
+    rng: Optional[random.Random] = None,
+) -> Iterator[TaskEncodingType]:
+    """Group items of similar length: collect buffer_size items, sort them by length and yield
+    them in groups of batch_size items. If rng is given, the order of the groups is shuffled to not
+    always yield the short items first."""
+    batch_size = max(batch_size, 1)
+    # round up to full batches, so that the batches of the dataloader match the groups
+    buffer_size = max(buffer_size // batch_size, 1) * batch_size
+    iterator = iter(items)
+    while True:
+        buffer = list(itertools.islice(iterator, buffer_size))
+        if len(buffer) == 0:
+            break
+        buffer.sort(key=length_fn)
+        groups = [
+            buffer[start : start + batch_size] for start in range(0, len(buffer), batch_size)
+        ]
+        if rng is not None:
+            rng.shuffle(groups)
+        for group in groups:
+            yield from group
+
+
 class IterableTaskEncodingDataset(torch_dataset.IterableDataset[TaskEncodingType]):
-    def __iter__(self) -> Iterator[TaskEncodingType]:
-        yield from self._encodings
+    """A dataset that streams task encodings.
+
+    The encodings can be an iterator or a callable that returns a fresh iterable on each call.
+    Only the latter can be iterated multiple times, e.g. for multiple epochs.
+
+    If shard is True, each dataloader worker and distributed rank gets a distinct part of the
+    encodings (every num_shards-th encoding, see get_shard_info()), so there are no duplicates
+    when using multiple dataloader workers or GPUs. Note that all workers still iterate over the
+    whole source, so, if possible, the source should already skip the data of the other shards
+    (and shard should be set to False).
+
+    The shards can differ in size by one encoding (or arbitrarily, if the source is sharded by
+    documents), so the distributed ranks can get a different number of batches. Then, the ranks
+    with more batches hang in collective operations (e.g. the gradient synchronization of DDP).
+    For distributed training, set equalize_shards=True: it drops the encodings of an incomplete
+    last round of num_shards encodings, so all shards have the same size (see shard_items()).
 
-    def __init__(self, encodings: Iterator[TaskEncodingType]):
+    Since the data is not materialized, it can not be shuffled completely. Instead, the encodings
+    can be shuffled with a buffer of shuffle_buffer_size encodings (see shuffle_with_buffer()).
+    To reduce padding, the encodings can also be bucketed: bucket_buffer_size encodings are
+    sorted by length and yielded in groups of bucket_batch_size encodings (which should be the
+    batch size of the dataloader) in random order (see bucket_by_length()). The randomness
+    depends on the seed, the epoch (see set_epoch()) and the shard. If no seed is given, the order
+    is different for each iteration. The epoch is kept in shared memory, so set_epoch() also
+    affects the copies of the dataset in (persistent) dataloader workers. Use an
+    IterableTaskEncodingDataLoader to advance the epoch each time the data is iterated.
+    """
+
+    def __init__(
+        self,
+        encodings: Union[Iterator[TaskEncodingType], Callable[[], Iterable[TaskEncodingType]]],
+        shard: bool = True,
+        shuffle_buffer_size: int = 0,
+        bucket_buffer_size: int = 0,
+        bucket_batch_size: int = 1,
+        length_fn: Callable[[TaskEncodingType], int] = get_input_length,
+        seed: Optional[int] = None,
+        equalize_shards: bool = False,
+    ):
         self._encodings = encodings
+        self.shard = shard
+        self.equalize_shards = equalize_shards
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.bucket_buffer_size = bucket_buffer_size
+        self.bucket_batch_size = bucket_batch_size
+        self.length_fn = length_fn
+        self.seed = seed
+        self._epoch = torch.zeros((), dtype=torch.int64).share_memory_()
+
+    @property
+    def epoch(self) -> int:
+        return int(self._epoch)
+
+    def set_epoch(self, epoch: int) -> None:
+        self._epoch.fill_(epoch)
+
+    def __iter__(self) -> Iterator[TaskEncodingType]:
+        encodings = self._encodings() if callable(self._encodings) else self._encodings
+        shard_index, num_shards = get_shard_info()
+        if self.shard and num_shards > 1:
+            encodings = shard_items(
+                encodings, shard_index, num_shards, equalize=self.equalize_shards
+            )
+        if self.shuffle_buffer_size > 0 or self.bucket_buffer_size > 0:
+            if self.seed is None:
+                rng = random.Random()
+            else:
+                rng = random.Random(f"{self.seed}-{self.epoch}-{shard_index}")
+            if self.shuffle_buffer_size > 0:
+                encodings = shuffle_with_buffer(encodings, self.shuffle_buffer_size, rng=rng)
+            if self.bucket_buffer_size > 0:
+                encodings = bucket_by_length(
+                    encodings,
+                    buffer_size=self.bucket_buffer_size,
+                    batch_size=self.bucket_batch_size,
+                    length_fn=self.length_fn,
+                    rng=rng,
+                )
+        yield from encodings
+
+
+class IterableTaskEncodingDataLoader(torch.utils.data.DataLoader):
+    """A DataLoader for an IterableTaskEncodingDataset that sets the epoch of the dataset (see
+    IterableTaskEncodingDataset.set_epoch()) each time it is iterated, i.e. at the start of each
+    epoch, so the shuffle buffer and the order of the buckets differ between the epochs. The first
+    iteration uses start_epoch.
+    """
+
+    def __init__(
+        self, dataset: IterableTaskEncodingDataset, *args, start_epoch: int = 0, **kwargs
+    ):
+        super().__init__(dataset, *args, **kwargs)
+        self.epoch = start_epoch
+
+    def __iter__(self):
+        self.dataset.set_epoch(self.epoch)  # type: ignore
+        self.epoch += 1
+        return super().__iter__()
@@ -1,4 +1,5 @@
 from .confusion_matrix import ConfusionMatrix
 from .f1 import F1Metric
+from .parallel import calculate_metric_state, evaluate_in_parallel
 
-__all__ = ["F1Metric", "ConfusionMatrix"]
+__all__ = ["F1Metric", "ConfusionMatrix", "calculate_metric_state", "evaluate_in_parallel"]
@@ -1,6 +1,9 @@
+import dataclasses
 import logging
+import operator
 from collections import defaultdict
-from typing import Callable, Dict, Optional, Tuple, Union
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Type, Union
 
 import pandas as pd
 from pie_core import Annotation, Document, DocumentMetric
@@ -10,6 +13,29 @@ from pytorch_ie.utils.hydra import resolve_target
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def get_annotation_key_function(
+    annotation_type: Type[Annotation], exclude_field: Optional[str] = None
+) -> Callable[[Annotation], Hashable]:
+    """Create a function that maps annotations of the given type to a tuple of the annotation type
+    and the values of all comparison fields except for exclude_field. Nested annotations (e.g.
+    relation arguments) are kept as they are, i.e. they are compared as a whole. Two annotations
+    have the same key iff they are equal when ignoring exclude_field (and the targets they are
+    attached to). In contrast to creating a copy with a dummy value for exclude_field, this does
+    not construct (and validate) any new annotation."""
+    field_names = [
+        field.name
+        for field in dataclasses.fields(annotation_type)
+        if field.compare and field.name != "_targets" and field.name != exclude_field
+    ]
+    if len(field_names) == 0:
+        return lambda annotation: (annotation_type,)
+    get_values = operator.attrgetter(*field_names)
+    if len(field_names) == 1:
+        return lambda annotation: (annotation_type, get_values(annotation))
+    return lambda annotation: (annotation_type,) + get_values(annotation)
+
+
 class ConfusionMatrix(DocumentMetric):
     """Computes the confusion matrix for a given annotation layer that contains labeled annotations.
 
@@ -49,6 +75,18 @@ class ConfusionMatrix(DocumentMetric):
     def reset(self):
         self.counts: Dict[Tuple[str, str], int] = defaultdict(int)
 
+    def get_state(self) -> Dict[str, Any]:
+        """Return the accumulated state as a picklable object that can be merged into another
+        metric (with the same configuration) via merge_state()."""
+        return {"counts": dict(self.counts)}
+
+    def merge_state(self, state: Dict[str, Any]) -> None:
+        """Add the counts of a state created with get_state()."""
+        self.add_counts(state["counts"])
+
+    def _get_base_key(self, annotation: Annotation) -> Hashable:
+        return get_annotation_key_function(type(annotation), self.label_field)(annotation)
+
     def calculate_counts(
         self,
         document: Document,
@@ -65,22 +103,19 @@ class ConfusionMatrix(DocumentMetric):
         gold_annotations = {
             annotation_processor(ann) for ann in document[self.layer] if annotation_filter(ann)
         }
-        base2gold = defaultdict(list)
+        # the annotations are grouped by their base key, i.e. all comparison fields except the label
+        base2gold: Dict[Hashable, List[Annotation]] = defaultdict(list)
         for ann in gold_annotations:
-            base_ann_kwargs = {self.label_field: "DUMMY_LABEL"}
-            base_ann = ann.copy(**base_ann_kwargs)
-            base2gold[base_ann].append(ann)
-        base2pred = defaultdict(list)
+            base2gold[self._get_base_key(ann)].append(ann)
+        base2pred: Dict[Hashable, List[Annotation]] = defaultdict(list)
         for ann in predicted_annotations:
-            base_ann_kwargs = {self.label_field: "DUMMY_LABEL"}
-            base_ann = ann.copy(**base_ann_kwargs)
-            base2pred[base_ann].append(ann)
+            base2pred[self._get_base_key(ann)].append(ann)
 
         # (gold_label, pred_label) -> count
         counts: Dict[Tuple[str, str], int] = defaultdict(int)
-        for base_ann in set(base2gold) | set(base2pred):
-            gold_labels = [getattr(ann, self.label_field) for ann in base2gold[base_ann]]
-            pred_labels = [getattr(ann, self.label_field) for ann in base2pred[base_ann]]
+        for base_key in set(base2gold) | set(base2pred):
+            gold_labels = [getattr(ann, self.label_field) for ann in base2gold[base_key]]
+            pred_labels = [getattr(ann, self.label_field) for ann in base2pred[base_key]]
 
             if self.undetected_label in gold_labels:
                 raise ValueError(
@@ -94,6 +129,7 @@ class ConfusionMatrix(DocumentMetric):
                 )
 
             if len(gold_labels) > 1:
+                base_ann = base2gold[base_key][0].copy(**{self.label_field: "DUMMY_LABEL"})
                 msg = f"The base annotation {base_ann} has multiple gold labels: {gold_labels}."
                 if self.strict:
                     raise ValueError(msg)
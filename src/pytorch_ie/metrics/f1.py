@@ -1,8 +1,9 @@
 import logging
+from array import array
 from collections import defaultdict
-from functools import partial
-from typing import Callable, Collection, Dict, Hashable, Optional, Tuple, Union
+from typing import Any, Callable, Collection, Dict, Hashable, Optional, Set, Tuple, Union
 
+import numpy as np
 import pandas as pd
 from pie_core import Annotation, Document, DocumentMetric
 
@@ -19,6 +20,27 @@ def has_this_label(ann: Annotation, label_field: str, label: str) -> bool:
     return getattr(ann, label_field) == label
 
 
+def _zero_counts() -> Tuple[int, int, int]:
+    # a named function (in contrast to a lambda) keeps the counts picklable
+    return 0, 0, 0
+
+
+def _empty_document_counts() -> array:
+    return array("q")
+
+
+def _calculate_scores(counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized calculation of precision, recall and F1 from counts of shape (..., 3), see
+    F1Metric._compute()."""
+    tp, fp, fn = counts[..., 0], counts[..., 1], counts[..., 2]
+    has_tp = tp > 0
+    # avoid division by zero, the results are set to 0 for tp == 0 anyway
+    p = np.where(has_tp, tp / np.maximum(tp + fp, 1), 0.0)
+    r = np.where(has_tp, tp / np.maximum(tp + fn, 1), 0.0)
+    f1 = np.where(has_tp, 2 * p * r / np.maximum(p + r, 1e-12), 0.0)
+    return p, r, f1
+
+
 class F1Metric(DocumentMetric):
     """Computes the (micro aggregated) F1 score for a given layer. If labels are provided,
     it also computes the F1 score for each label separately and the macro F1 score.
@@ -28,6 +50,8 @@ class F1Metric(DocumentMetric):
         labels: If provided, calculate F1 score for each label.
         label_field: The field to use for the label. Defaults to "label".
         show_as_markdown: If True, logs the F1 score as markdown on the console when calling compute().
+        keep_document_counts: If True, also keep the counts per document. This is required to calculate
+            bootstrap confidence intervals, see compute().
     """
 
     def __init__(
@@ -37,9 +61,11 @@ class F1Metric(DocumentMetric):
         label_field: str = "label",
         show_as_markdown: bool = False,
         annotation_processor: Optional[Union[Callable[[Annotation], Hashable], str]] = None,
+        keep_document_counts: bool = False,
     ):
         super().__init__()
         self.layer = layer
+        self.keep_document_counts = keep_document_counts
         self.label_field = label_field
         self.show_as_markdown = show_as_markdown
         self.annotation_processor: Optional[Callable[[Annotation], Hashable]]
@@ -70,9 +96,42 @@ class F1Metric(DocumentMetric):
                 self.labels = list(labels)
             else:
                 raise ValueError("labels must be a string or a collection of strings")
+        # for fast membership tests
+        self._label_set: Set[str] = set(self.labels) if self.per_label else set()
 
     def reset(self):
-        self.counts = defaultdict(lambda: (0, 0, 0))
+        self.counts = defaultdict(_zero_counts)
+        self.num_documents = 0
+        # label -> flat array of (document index, tp, fp, fn) entries for all documents with
+        # non-zero counts for that label (only filled if keep_document_counts is True)
+        self.document_counts: Dict[str, array] = defaultdict(_empty_document_counts)
+
+    def get_state(self) -> Dict[str, Any]:
+        """Return the accumulated state as a picklable object that can be merged into another
+        metric (with the same configuration) via merge_state()."""
+        state: Dict[str, Any] = {"counts": dict(self.counts)}
+        if self.infer_labels:
+            state["labels"] = list(self.labels)
+        if self.keep_document_counts:
+            state["num_documents"] = self.num_documents
+            state["document_counts"] = dict(self.document_counts)
+        return state
+
+    def merge_state(self, state: Dict[str, Any]) -> None:
+        """Add the counts (and inferred labels) of a state created with get_state()."""
+        for label in state.get("labels", []):
+            if label not in self._label_set:
+                self._label_set.add(label)
+                self.labels.append(label)
+        for label, counts in state["counts"].items():
+            self.add_counts(counts, label=label)
+        if self.keep_document_counts:
+            for label, document_counts in state["document_counts"].items():
+                entries = np.frombuffer(document_counts, dtype=np.int64).reshape(-1, 4).copy()
+                # shift the document indices behind the already added documents
+                entries[:, 0] += self.num_documents
+                self.document_counts[label].frombytes(entries.tobytes())
+            self.num_documents += state["num_documents"]
 
     def calculate_counts(
         self,
@@ -102,34 +161,184 @@ class F1Metric(DocumentMetric):
             self.counts[label][2] + counts[2],
         )
 
+    def calculate_counts_per_label(
+        self,
+        document: Document,
+        labels: Optional[Collection[str]] = None,
+        annotation_processor: Optional[Callable[[Annotation], Hashable]] = None,
+    ) -> Tuple[Tuple[int, int, int], Dict[str, Tuple[int, int, int]]]:
+        """Calculate the micro counts and the counts for each label in a single pass over the
+        annotations. If labels are provided, annotations with other labels are ignored. This gives
+        the same result as calling `calculate_counts` for the micro counts and for each label
+        separately (with respective filters).
+
+        Returns:
+            A tuple of the micro counts and a dictionary with the counts for each label that occurs
+            in the gold or predicted annotations.
+        """
+        annotation_processor = annotation_processor or (lambda ann: ann)
+        layer = document[self.layer]
+        gold_annotations: Set[Hashable] = set()
+        predicted_annotations: Set[Hashable] = set()
+        gold_annotations_per_label: Dict[str, Set[Hashable]] = defaultdict(set)
+        predicted_annotations_per_label: Dict[str, Set[Hashable]] = defaultdict(set)
+        for annotations, annotations_per_label, all_annotations in (
+            (layer, gold_annotations_per_label, gold_annotations),
+            (layer.predictions, predicted_annotations_per_label, predicted_annotations),
+        ):
+            for ann in annotations:
+                label = getattr(ann, self.label_field)
+                if labels is not None and label not in labels:
+                    continue
+                processed_annotation = annotation_processor(ann)
+                all_annotations.add(processed_annotation)
+                annotations_per_label[label].add(processed_annotation)
+
+        counts_per_label = {}
+        # keep the order of the labels as they appear in the gold and predicted annotations
+        for label in {**gold_annotations_per_label, **predicted_annotations_per_label}:
+            gold = gold_annotations_per_label.get(label, set())
+            predicted = predicted_annotations_per_label.get(label, set())
+            tp = len(predicted & gold)
+            counts_per_label[label] = (tp, len(predicted) - tp, len(gold) - tp)
+        tp = len(predicted_annotations & gold_annotations)
+        micro_counts = (tp, len(predicted_annotations) - tp, len(gold_annotations) - tp)
+        return micro_counts, counts_per_label
+
+    def _add_document_counts(self, counts: Tuple[int, int, int], label: str):
+        if counts != (0, 0, 0):
+            self.document_counts[label].extend((self.num_documents,) + tuple(counts))
+
     def _update(self, document: Document):
-        new_counts = self.calculate_counts(
+        if not self.per_label:
+            new_counts = self.calculate_counts(
+                document=document, annotation_processor=self.annotation_processor
+            )
+            self.add_counts(new_counts, label="MICRO")
+            if self.keep_document_counts:
+                self._add_document_counts(new_counts, label="MICRO")
+                self.num_documents += 1
+            return
+
+        micro_counts, counts_per_label = self.calculate_counts_per_label(
             document=document,
-            annotation_filter=(
-                partial(has_one_of_the_labels, label_field=self.label_field, labels=self.labels)
-                if self.per_label and not self.infer_labels
-                else None
-            ),
+            labels=None if self.infer_labels else self._label_set,
             annotation_processor=self.annotation_processor,
         )
-        self.add_counts(new_counts, label="MICRO")
+        self.add_counts(micro_counts, label="MICRO")
         if self.infer_labels:
-            layer = document[self.layer]
             # collect labels from gold data and predictions
-            for ann in list(layer) + list(layer.predictions):
-                label = getattr(ann, self.label_field)
-                if label not in self.labels:
+            for label in counts_per_label:
+                if label not in self._label_set:
+                    self._label_set.add(label)
                     self.labels.append(label)
-        if self.per_label:
+        for label in self.labels:
+            if label in counts_per_label:
+                self.add_counts(counts_per_label[label], label=label)
+            elif label not in self.counts:
+                # make sure that all labels are contained in the result
+                self.add_counts((0, 0, 0), label=label)
+        if self.keep_document_counts:
+            self._add_document_counts(micro_counts, label="MICRO")
             for label in self.labels:
-                new_counts = self.calculate_counts(
-                    document=document,
-                    annotation_filter=partial(
-                        has_this_label, label_field=self.label_field, label=label
-                    ),
-                    annotation_processor=self.annotation_processor,
+                if label in counts_per_label:
+                    self._add_document_counts(counts_per_label[label], label=label)
+            self.num_documents += 1
+
+    def compute(
+        self,
+        reset: bool = True,
+        bootstrap: int = 0,
+        confidence_level: float = 0.95,
+        seed: Optional[int] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        """Compute the metric values.
+
+        Args:
+            reset: If True, reset the metric afterwards.
+            bootstrap: If larger than 0, also calculate bootstrap confidence intervals from this number of
+                resamples of the documents. The intervals are added as "f1_ci", "p_ci" and "r_ci" (a tuple of
+                lower and upper bound) to the values of each label (and MICRO and MACRO). Requires
+                keep_document_counts=True.
+            confidence_level: The confidence level of the bootstrap intervals.
+            seed: The seed for drawing the bootstrap resamples.
+        """
+        metric_values = self._compute()
+        if bootstrap > 0:
+            self._add_bootstrap_intervals(
+                metric_values,
+                num_resamples=bootstrap,
+                confidence_level=confidence_level,
+                seed=seed,
+            )
+        if reset:
+            self.reset()
+        return metric_values
+
+    def _add_bootstrap_intervals(
+        self,
+        metric_values: Dict[str, Dict[str, Any]],
+        num_resamples: int,
+        confidence_level: float,
+        seed: Optional[int] = None,
+        max_weights_size: int = 10_000_000,
+    ) -> None:
+        if not self.keep_document_counts:
+            raise ValueError("bootstrap confidence intervals require keep_document_counts=True")
+        if not 0.0 < confidence_level < 1.0:
+            raise ValueError(f"confidence_level has to be in (0, 1), but it is {confidence_level}")
+        labels = list(self.counts)
+        num_documents = self.num_documents
+        if num_documents == 0:
+            return
+
+        # Sparse per-document counts: for each label, the indices of the documents with non-zero
+        # counts and their counts (of shape (num_entries, 3)). Note that float64 is exact for the
+        # counts and allows for fast (BLAS) matrix multiplication.
+        label_document_indices = []
+        label_document_counts = []
+        for label in labels:
+            entries = np.frombuffer(self.document_counts.get(label, array("q")), dtype=np.int64)
+            entries = entries.reshape(-1, 4)
+            label_document_indices.append(entries[:, 0])
+            label_document_counts.append(entries[:, 1:].astype(np.float64))
+
+        # Each resample is represented by the number of times each document is drawn, i.e. by
+        # multinomial weights. Then, the counts of all resamples are just a matrix product of the
+        # weights of the documents with counts for the label and their counts.
+        rng = np.random.default_rng(seed)
+        chunk_size = max(max_weights_size // num_documents, 1)
+        counts = np.zeros((num_resamples, len(labels), 3), dtype=np.float64)
+        for start in range(0, num_resamples, chunk_size):
+            current_chunk_size = min(chunk_size, num_resamples - start)
+            # draw the document indices for all resamples of the chunk and count them per resample
+            drawn = rng.integers(0, num_documents, size=(current_chunk_size, num_documents))
+            drawn += np.arange(current_chunk_size)[:, None] * num_documents
+            weights = np.bincount(drawn.ravel(), minlength=current_chunk_size * num_documents)
+            weights = weights.reshape(current_chunk_size, num_documents).astype(np.float64)
+            for label_idx in range(len(labels)):
+                counts[start : start + current_chunk_size, label_idx] = (
+                    weights[:, label_document_indices[label_idx]]
+                    @ label_document_counts[label_idx]
+                )
+
+        p, r, f1 = _calculate_scores(counts)
+        scores = {"f1": f1, "p": p, "r": r}
+        if self.per_label:
+            label_indices = [labels.index(label) for label in self.labels]
+            for name, values in list(scores.items()):
+                macro_values = values[:, label_indices].mean(axis=1, keepdims=True)
+                scores[name] = np.concatenate([values, macro_values], axis=1)
+            labels = labels + ["MACRO"]
+
+        alpha = (1.0 - confidence_level) / 2
+        for name, values in scores.items():
+            lower, upper = np.quantile(values, [alpha, 1.0 - alpha], axis=0)
+            for label_idx, label in enumerate(labels):
+                metric_values[label][f"{name}_ci"] = (
+                    float(lower[label_idx]),
+                    float(upper[label_idx]),
                 )
-                self.add_counts(new_counts, label=label)
 
     def _compute(self) -> Dict[str, Dict[str, float]]:
         res = dict()
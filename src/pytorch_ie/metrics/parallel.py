@@ -0,0 +1,68 @@
+import copy
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from pie_core import Document, DocumentMetric
+
+
+def calculate_metric_state(
+    metric: DocumentMetric, documents: Iterable[Document]
+) -> Dict[str, Any]:
+    """Reset the metric, update it with the documents and return its state (see
+    F1Metric.get_state()).
+
+    This is the map step of evaluate_in_parallel(), but it can also be used to calculate partial
+    states in a distributed setting that are merged afterwards with metric.merge_state().
+    """
+    metric.reset()
+    for document in documents:
+        metric._update(document)
+    return metric.get_state()  # type: ignore
+
+
+def evaluate_in_parallel(
+    metric: DocumentMetric,
+    documents: Sequence[Document],
+    num_workers: int = 2,
+    num_shards: Optional[int] = None,
+) -> Any:
+    """Update the metric with the documents by splitting them into shards that are processed by a
+    pool of worker processes. The resulting states are merged into the metric in the order of the
+    shards, so the result is the same as for calling the metric with all documents. As for calling
+    the metric with a collection, the metric is not reset before and the result of
+    compute(reset=False) is returned.
+
+    The metric has to implement get_state() and merge_state() (e.g. F1Metric and ConfusionMatrix)
+    and, as well as the documents, needs to be picklable. This means that an annotation_processor
+    has to be a module level function (or a string that references one), not a lambda.
+
+    Args:
+        metric: The metric to update.
+        documents: The documents to evaluate.
+        num_workers: The number of worker processes. If 0, the shards are processed in the current
+            process.
+        num_shards: The number of shards. Defaults to four shards per worker to balance the load.
+    """
+    if not hasattr(metric, "get_state") or not hasattr(metric, "merge_state"):
+        raise TypeError(
+            f"the metric {type(metric).__name__} does not implement get_state() and merge_state()"
+        )
+    if num_shards is None:
+        num_shards = max(num_workers, 1) * 4
+    shard_size = max(math.ceil(len(documents) / num_shards), 1)
+    shards = [
+        documents[start : start + shard_size] for start in range(0, len(documents), shard_size)
+    ]
+
+    states: List[Dict[str, Any]]
+    if num_workers == 0:
+        # work on a copy to not reset the already accumulated state of the metric
+        states = [calculate_metric_state(copy.deepcopy(metric), shard) for shard in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            states = list(executor.map(calculate_metric_state, [metric] * len(shards), shards))
+
+    for state in states:
+        metric.merge_state(state)  # type: ignore
+    return metric.compute(reset=False)
@@ -1,20 +1,262 @@
+import hashlib
 import logging
-from collections import defaultdict
-from typing import Any, Callable, Dict, List, Optional, Type, Union
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple, Type, Union
 
 from pie_core import Document, DocumentStatistic
-from transformers import AutoTokenizer, PreTrainedTokenizer
+from pie_core.utils.dictionary import flatten_dict, unflatten_dict
+from transformers import PreTrainedTokenizer
 
 from pytorch_ie.documents import TextBasedDocument
+from pytorch_ie.metrics.streaming import StreamingAggregator
+from pytorch_ie.utils.tokenizer import get_tokenizer
 
 logger = logging.getLogger(__name__)
 
+# (tokenizer and kwargs key, text hash) -> token count, shared by all TokenCountCollectors
+_TOKEN_COUNT_CACHE: "OrderedDict[Tuple[Hashable, bytes], int]" = OrderedDict()
+_TOKEN_COUNT_CACHE_LOCK = threading.Lock()
+# the default maximum number of entries, each entry takes roughly 200 bytes, so the cache needs
+# up to about 20 MB
+TOKEN_COUNT_CACHE_MAX_SIZE = 100_000
+# the file name of the persistent token count cache (in the cache_dir of TokenCountCollector)
+TOKEN_COUNT_CACHE_FILE_NAME = "token_counts.sqlite"
+# the maximum number of text hashes per query of the persistent cache
+_TOKEN_COUNT_CACHE_QUERY_SIZE = 500
 
-class TokenCountCollector(DocumentStatistic):
+
+def clear_token_count_cache() -> None:
+    with _TOKEN_COUNT_CACHE_LOCK:
+        _TOKEN_COUNT_CACHE.clear()
+
+
+def _hash_text(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def _connect_token_count_cache(cache_dir: str) -> sqlite3.Connection:
+    os.makedirs(cache_dir, exist_ok=True)
+    # the cache may be used by several processes at once (e.g. evaluate_in_parallel())
+    connection = sqlite3.connect(os.path.join(cache_dir, TOKEN_COUNT_CACHE_FILE_NAME), timeout=60)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS token_counts "
+        "(tokenizer_key TEXT, text_hash BLOB, count INTEGER, PRIMARY KEY (tokenizer_key, text_hash))"
+    )
+    return connection
+
+
+def _load_token_counts(
+    connection: sqlite3.Connection, tokenizer_key: str, text_hashes: List[bytes]
+) -> Dict[bytes, int]:
+    result: Dict[bytes, int] = {}
+    for start in range(0, len(text_hashes), _TOKEN_COUNT_CACHE_QUERY_SIZE):
+        chunk = text_hashes[start : start + _TOKEN_COUNT_CACHE_QUERY_SIZE]
+        rows = connection.execute(
+            "SELECT text_hash, count FROM token_counts WHERE tokenizer_key = ? AND text_hash IN "
+            f"({', '.join('?' * len(chunk))})",
+            [tokenizer_key, *chunk],
+        )
+        result.update(rows)
+    return result
+
+
+def _store_token_counts(
+    connection: sqlite3.Connection, tokenizer_key: str, counts: Dict[bytes, int]
+) -> None:
+    with connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO token_counts VALUES (?, ?, ?)",
+            [(tokenizer_key, text_hash, count) for text_hash, count in counts.items()],
+        )
+
+
+class StreamingDocumentStatistic(DocumentStatistic):
+    """A DocumentStatistic that can aggregate the collected values on the fly instead of keeping
+    them in memory until compute() is called.
+
+    With streaming=True, each (flattened) key of the collected values gets a StreamingAggregator
+    that calculates the moments with Welford's algorithm, quantiles (median or percentiles like
+    "p90") with a KLL sketch and, if histogram_bin_edges are given, a fixed-bin histogram. The
+    memory does not depend on the number of documents, so this can be used to profile huge
+    corpora. Only the aggregation functions in STREAMING_AGGREGATION_FUNCTIONS and percentiles are
+    supported in streaming mode. Quantiles are approximate (the rank error is about 1% for the
+    default sketch_size) and the mean and std may differ from the non-streaming results in the
+    last digits.
+
+    The state can be retrieved with get_state() and merged into another statistic with the same
+    configuration with merge_state(), e.g. to profile shards in parallel (see
+    evaluate_in_parallel()).
+
+    Args:
+        streaming: Whether to aggregate the values on the fly.
+        histogram_bin_edges: Bin edges for the "histogram" aggregation in streaming mode.
+        sketch_size: The size parameter k of the quantile sketch in streaming mode.
+    """
+
+    # If True, keys that are missing in the collected values of a document are counted as zero
+    # in streaming mode (see LabelCountCollector).
+    FILL_MISSING_WITH_ZEROS = False
+
+    def __init__(
+        self,
+        streaming: bool = False,
+        histogram_bin_edges: Optional[Sequence[float]] = None,
+        sketch_size: int = 200,
+        aggregation_functions: Optional[List[str]] = None,
+        **kwargs,
+    ):
+        # set before calling super().__init__() because that calls reset()
+        self.streaming = streaming
+        self.histogram_bin_edges = histogram_bin_edges
+        self.sketch_size = sketch_size
+        if not self.streaming:
+            super().__init__(aggregation_functions=aggregation_functions, **kwargs)
+        else:
+            super().__init__(**kwargs)
+            # the aggregation is done by the StreamingAggregator, so there is nothing to resolve
+            self.aggregation_functions = {  # type: ignore
+                name: None for name in aggregation_functions or self.DEFAULT_AGGREGATION_FUNCTIONS
+            }
+            # fail early for unsupported aggregation functions
+            self._create_aggregator()
+
+    def reset(self) -> None:
+        super().reset()
+        self._num_documents = 0
+        self._aggregators: Dict[Tuple[str, ...], StreamingAggregator] = {}
+
+    def _create_aggregator(self) -> StreamingAggregator:
+        return StreamingAggregator(
+            aggregation_functions=list(self.aggregation_functions),
+            bin_edges=self.histogram_bin_edges,
+            sketch_size=self.sketch_size,
+        )
+
+    def _get_aggregator(self, key: Tuple[str, ...]) -> StreamingAggregator:
+        aggregator = self._aggregators.get(key)
+        if aggregator is None:
+            aggregator = self._create_aggregator()
+            if self.FILL_MISSING_WITH_ZEROS:
+                # the key was not present in the previous documents
+                aggregator.update(0, weight=self._num_documents)
+            self._aggregators[key] = aggregator
+        return aggregator
+
+    def _add_collected(self, collected_result: Any) -> None:
+        if not self.streaming:
+            self._values.append(collected_result)
+            return
+        if isinstance(collected_result, dict):
+            collected_result_flat = flatten_dict(collected_result)
+        else:
+            collected_result_flat = {(): collected_result}
+        for key, value in collected_result_flat.items():
+            aggregator = self._get_aggregator(key)
+            if isinstance(value, list):
+                for v in value:
+                    aggregator.update(v)
+            else:
+                aggregator.update(value)
+        self._num_documents += 1
+        if self.FILL_MISSING_WITH_ZEROS:
+            for key, aggregator in self._aggregators.items():
+                if key not in collected_result_flat:
+                    aggregator.update(0)
+
+    def _update(self, document: Document) -> None:
+        self._add_collected(self._collect(document))
+
+    def get_state(self) -> Dict[str, Any]:
+        """Return the accumulated state as a picklable object that can be merged into another
+        statistic (with the same configuration) via merge_state()."""
+        if self.streaming:
+            return {"num_documents": self._num_documents, "aggregators": dict(self._aggregators)}
+        return {"values": list(self._values)}
+
+    def merge_state(self, state: Dict[str, Any]) -> None:
+        """Add the values or aggregators of a state created with get_state()."""
+        if not self.streaming:
+            self._values.extend(state["values"])
+            return
+        for key, aggregator in state["aggregators"].items():
+            if key not in self._aggregators and self.FILL_MISSING_WITH_ZEROS:
+                self._get_aggregator(key)
+            if key in self._aggregators:
+                self._aggregators[key].merge(aggregator)
+            else:
+                self._aggregators[key] = aggregator
+        if self.FILL_MISSING_WITH_ZEROS:
+            for key, aggregator in self._aggregators.items():
+                if key not in state["aggregators"]:
+                    aggregator.update(0, weight=state["num_documents"])
+        self._num_documents += state["num_documents"]
+
+    def _compute(self) -> Any:
+        if not self.streaming:
+            return super()._compute()
+
+        if self.current_split is not None:
+            title = f"{self.title} (split: {self.current_split}, {self._num_documents} documents)"
+        else:
+            title = f"{self.title} ({self._num_documents} documents)"
+        if self.show_histogram:
+            if self.histogram_bin_edges is None:
+                logger.warning(
+                    "show_histogram requires histogram_bin_edges in streaming mode, skip the "
+                    "histogram"
+                )
+            else:
+                import plotext as plt
+
+                bin_edges = self.histogram_bin_edges
+                bin_labels = [f"{a}-{b}" for a, b in zip(bin_edges, bin_edges[1:])]
+                for k, aggregator in self._aggregators.items():
+                    plt.bar(
+                        bin_labels,
+                        aggregator.histogram.counts,  # type: ignore
+                        label=".".join(k) if len(k) > 0 else None,
+                    )
+                plt.title(title)
+                plt.show()
+                plt.clear_figure()
+
+        aggregated_stats = {}
+        for k, aggregator in self._aggregators.items():
+            for f_name, value in aggregator.compute().items():
+                aggregated_stats[k + (f_name,)] = value
+
+        if self.show_as_markdown:
+            import pandas as pd
+
+            series = pd.Series(
+                {k: v for k, v in aggregated_stats.items() if k[-1] != "histogram"}, dtype=object
+            )
+            if len(series.index.levels) > 1:
+                df = series.unstack(-1)
+                logger.info(f"{title}\n{df.to_markdown()}")
+            else:
+                series.index = series.index.get_level_values(0)
+                logger.info(f"{title}\n{series.to_markdown()}")
+
+        return unflatten_dict(aggregated_stats)
+
+
+class TokenCountCollector(StreamingDocumentStatistic):
     """Collects the token count of a field when tokenizing its content with a Huggingface
     tokenizer.
 
-    The content of the field should be a string.
+    The content of the field should be a string. The documents are tokenized in batches of
+    batch_size texts. If use_cache is True, the token counts are cached in memory by the hash of
+    the text (per tokenizer and tokenizer_kwargs) and shared between all instances, so repeated
+    runs over the same texts do not need to tokenize them again. The in-memory cache keeps the
+    counts of the cache_max_size most recently used texts, call clear_token_count_cache() to
+    release it. It is disabled by default because it only pays off if the same texts are counted
+    again within the same process. To reuse the counts of large corpora or across runs, pass a
+    cache_dir: the counts are then also stored in a SQLite database in this directory (this
+    implies use_cache).
     """
 
     def __init__(
@@ -23,25 +265,127 @@ class TokenCountCollector(DocumentStatistic):
         text_field: str = "text",
         tokenizer_kwargs: Optional[Dict[str, Any]] = None,
         document_type: Optional[Type[Document]] = None,
+        batch_size: int = 1000,
+        use_cache: bool = False,
+        cache_max_size: int = TOKEN_COUNT_CACHE_MAX_SIZE,
+        cache_dir: Optional[str] = None,
         **kwargs,
     ):
         if document_type is None and text_field == "text":
             document_type = TextBasedDocument
         super().__init__(document_type=document_type, **kwargs)
-        self.tokenizer = (
-            AutoTokenizer.from_pretrained(tokenizer) if isinstance(tokenizer, str) else tokenizer
-        )
+        self.tokenizer = get_tokenizer(tokenizer) if isinstance(tokenizer, str) else tokenizer
         self.tokenizer_kwargs = tokenizer_kwargs or {}
         self.text_field = text_field
+        self.batch_size = batch_size
+        self.use_cache = use_cache or cache_dir is not None
+        self.cache_max_size = cache_max_size
+        self.cache_dir = cache_dir
+        # identifies the tokenization result (not the tokenizer instance) for the cache
+        self._cache_key: Hashable = (
+            type(self.tokenizer).__name__,
+            self.tokenizer.name_or_path,
+            len(self.tokenizer),
+            repr(sorted(self.tokenizer_kwargs.items())),
+        )
+        # the key of the persistent cache has to be stable across runs
+        self._persistent_cache_key = hashlib.blake2b(
+            repr(self._cache_key).encode("utf-8"), digest_size=16
+        ).hexdigest()
+
+    def reset(self) -> None:
+        super().reset()
+        self._texts: List[str] = []
 
     def _collect(self, doc: Document) -> int:
         text = getattr(doc, self.text_field)
-        encodings = self.tokenizer(text, **self.tokenizer_kwargs)
-        tokens = encodings.tokens()
-        return len(tokens)
+        return self._count_tokens([text])[0]
+
+    def _update(self, document: Document) -> None:
+        # collect the texts and tokenize them in batches, see _flush()
+        self._texts.append(getattr(document, self.text_field))
+        if len(self._texts) >= self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if len(self._texts) > 0:
+            for count in self._count_tokens(self._texts):
+                self._add_collected(count)
+            self._texts = []
+
+    def get_state(self) -> Dict[str, Any]:
+        self._flush()
+        return super().get_state()
+
+    def _compute(self) -> Any:
+        self._flush()
+        return super()._compute()
+
+    def _count_tokens(self, texts: List[str]) -> List[int]:
+        if not self.use_cache:
+            return self._tokenize_and_count(texts)
+
+        keys = [(self._cache_key, _hash_text(text)) for text in texts]
+        counts: List[Optional[int]] = []
+        with _TOKEN_COUNT_CACHE_LOCK:
+            for key in keys:
+                count = _TOKEN_COUNT_CACHE.get(key)
+                if count is not None:
+                    _TOKEN_COUNT_CACHE.move_to_end(key)
+                counts.append(count)
+        missing_indices = [idx for idx, count in enumerate(counts) if count is None]
+        if len(missing_indices) == 0:
+            return counts  # type: ignore
+
+        connection = (
+            _connect_token_count_cache(self.cache_dir) if self.cache_dir is not None else None
+        )
+        try:
+            new_counts: Dict[bytes, int] = {}
+            if connection is not None:
+                stored_counts = _load_token_counts(
+                    connection,
+                    self._persistent_cache_key,
+                    [keys[idx][1] for idx in missing_indices],
+                )
+                for idx in missing_indices:
+                    counts[idx] = stored_counts.get(keys[idx][1])
+                missing_indices = [idx for idx in missing_indices if counts[idx] is None]
+            if len(missing_indices) > 0:
+                tokenized_counts = self._tokenize_and_count(
+                    [texts[idx] for idx in missing_indices]
+                )
+                for idx, count in zip(missing_indices, tokenized_counts):
+                    counts[idx] = count
+                    new_counts[keys[idx][1]] = count
+                if connection is not None:
+                    _store_token_counts(connection, self._persistent_cache_key, new_counts)
+        finally:
+            if connection is not None:
+                connection.close()
+
+        with _TOKEN_COUNT_CACHE_LOCK:
+            for key, count in zip(keys, counts):
+                if key not in _TOKEN_COUNT_CACHE:
+                    _TOKEN_COUNT_CACHE[key] = count  # type: ignore
+            while len(_TOKEN_COUNT_CACHE) > self.cache_max_size:
+                _TOKEN_COUNT_CACHE.popitem(last=False)
+        return counts  # type: ignore
+
+    def _tokenize_and_count(self, texts: List[str]) -> List[int]:
+        # Tokenize all texts at once (fast tokenizers process them in parallel) and count the
+        # input ids instead of creating the token strings. Do not create the not required
+        # attention masks etc. unless requested.
+        tokenizer_kwargs = {
+            "return_attention_mask": False,
+            "return_token_type_ids": False,
+            **self.tokenizer_kwargs,
+        }
+        encodings = self.tokenizer(texts, **tokenizer_kwargs)
+        return [len(input_ids) for input_ids in encodings["input_ids"]]
 
 
-class FieldLengthCollector(DocumentStatistic):
+class FieldLengthCollector(StreamingDocumentStatistic):
     """Collects the length of a field, e.g. to collect the number the characters in the input text.
 
     The field should be a list of sized elements.
@@ -56,7 +400,7 @@ class FieldLengthCollector(DocumentStatistic):
         return len(field_obj)
 
 
-class SubFieldLengthCollector(DocumentStatistic):
+class SubFieldLengthCollector(StreamingDocumentStatistic):
     """Collects the length of a subfield in a field, e.g. to collect the number of arguments of
     N-ary relations."""
 
@@ -74,7 +418,7 @@ class SubFieldLengthCollector(DocumentStatistic):
         return lengths
 
 
-class DummyCollector(DocumentStatistic):
+class DummyCollector(StreamingDocumentStatistic):
     """A dummy collector that always returns 1, e.g. to count the number of documents.
 
     Can be used to count the number of documents.
@@ -86,7 +430,7 @@ class DummyCollector(DocumentStatistic):
         return 1
 
 
-class LabelCountCollector(DocumentStatistic):
+class LabelCountCollector(StreamingDocumentStatistic):
     """Collects the number of field entries per label, e.g. to collect the number of entities per
     type.
 
@@ -94,9 +438,12 @@ class LabelCountCollector(DocumentStatistic):
 
     Important: To make correct use of the result data, missing values need to be filled with 0, e.g.:
         {("ORG",): [2, 3], ("LOC",): [2]} -> {("ORG",): [2, 3], ("LOC",): [2, 0]}
+    In streaming mode, this is done on the fly, so all aggregation functions can also be used with
+    labels="INFERRED" (and "len" is the number of documents for all labels).
     """
 
     DEFAULT_AGGREGATION_FUNCTIONS = ["mean", "std", "min", "max", "len", "sum"]
+    FILL_MISSING_WITH_ZEROS = True
 
     def __init__(
         self, field: str, labels: Union[List[str], str], label_attribute: str = "label", **kwargs
@@ -106,15 +453,16 @@ class LabelCountCollector(DocumentStatistic):
         self.label_attribute = label_attribute
         if not (isinstance(labels, list) or labels == "INFERRED"):
             raise ValueError("labels must be a list of strings or 'INFERRED'")
-        if labels == "INFERRED":
+        if labels == "INFERRED" and not self.streaming:
             logger.warning(
                 f"Inferring labels with {self.__class__.__name__} from data produces wrong results "
                 f"for certain aggregation functions (e.g. 'mean', 'std', 'min') because zero values "
                 f"are not included in the calculation. We remove these aggregation functions from "
                 f"this collector, but be aware that the results may be wrong for your own aggregation "
-                f"functions that rely on zero values."
+                f"functions that rely on zero values. Use streaming=True to fill in the zero values "
+                f"on the fly."
             )
-            self.aggregation_functions: Dict[str, Callable[[List], Any]] = {
+            self.aggregation_functions = {
                 name: func
                 for name, func in self.aggregation_functions.items()
                 if name not in ["mean", "std", "min"]
@@ -0,0 +1,305 @@
+import bisect
+import math
+import random
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+# aggregation function names that can be calculated by StreamingAggregator, in addition to
+# percentiles like "p90" or "p99.9"
+STREAMING_AGGREGATION_FUNCTIONS = [
+    "len",
+    "sum",
+    "mean",
+    "std",
+    "min",
+    "max",
+    "median",
+    "histogram",
+]
+PERCENTILE_PATTERN = re.compile(r"^p(\d+(\.\d+)?)$")
+
+
+def is_streaming_aggregation_function(name: str) -> bool:
+    return name in STREAMING_AGGREGATION_FUNCTIONS or PERCENTILE_PATTERN.match(name) is not None
+
+
+class RunningMoments:
+    """Count, sum, mean, (population) variance, min and max of a stream of numbers, updated with
+    Welford's algorithm. Two instances can be merged with the parallel variant of the algorithm
+    (Chan et al.), so the moments can be calculated on shards and combined afterwards."""
+
+    __slots__ = ("count", "sum", "mean", "m2", "min", "max")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum: float = 0
+        self.mean = 0.0
+        # sum of squared differences from the mean
+        self.m2 = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def update(self, value: float, weight: int = 1) -> None:
+        """Add the value weight times."""
+        if weight <= 0:
+            return
+        count = self.count + weight
+        delta = value - self.mean
+        self.mean += delta * weight / count
+        self.m2 += delta * (value - self.mean) * weight
+        self.count = count
+        self.sum += value * weight
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "RunningMoments") -> None:
+        if other.count == 0:
+            return
+        if self.count == 0:
+            for name in self.__slots__:
+                setattr(self, name, getattr(other, name))
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)  # type: ignore
+        self.max = max(self.max, other.max)  # type: ignore
+
+    @property
+    def variance(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        return max(self.m2, 0.0) / self.count
+
+    @property
+    def std(self) -> Optional[float]:
+        variance = self.variance
+        return None if variance is None else variance**0.5
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class QuantileSketch:
+    """A KLL sketch (Karnin, Lang and Liberty, 2016) to approximate quantiles of a stream of
+    numbers in constant memory.
+
+    The sketch keeps a hierarchy of compactors where an item at level h represents 2**h items of
+    the stream. If the sketch is full, a compactor is sorted and every second item (with a random
+    offset) is promoted to the next level. The rank error is roughly proportional to 1/k, i.e.
+    about 1% for the default k=200, while at most about 3*k items are stored. Two sketches can be
+    merged by concatenating their compactors.
+    """
+
+    def __init__(self, k: int = 200, c: float = 2 / 3, seed: Optional[int] = 0):
+        if k < 2:
+            raise ValueError(f"k must be at least 2, but it is {k}")
+        self.k = k
+        self.c = c
+        self.count = 0
+        self.compactors: List[List[float]] = []
+        self.size = 0
+        self.max_size = 0
+        self._random = random.Random(seed)
+        self._grow()
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil(self.c**depth * self.k)) + 1
+
+    def _grow(self) -> None:
+        self.compactors.append([])
+        self.max_size = sum(self._capacity(level) for level in range(len(self.compactors)))
+
+    def update(self, value: float, weight: int = 1) -> None:
+        """Add the value weight times. A weight is inserted as its binary decomposition, i.e. a
+        weight of 5 adds the value to level 0 and level 2."""
+        if weight <= 0:
+            return
+        self.count += weight
+        level = 0
+        while weight > 0:
+            if weight & 1:
+                while len(self.compactors) <= level:
+                    self._grow()
+                self.compactors[level].append(value)
+                self.size += 1
+            weight >>= 1
+            level += 1
+        if self.size >= self.max_size:
+            self._compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.count += other.count
+        self.size = sum(len(items) for items in self.compactors)
+        self._compress()
+
+    def _compress(self) -> None:
+        while self.size >= self.max_size:
+            for level in range(len(self.compactors)):
+                items = self.compactors[level]
+                if len(items) >= self._capacity(level):
+                    if level + 1 >= len(self.compactors):
+                        self._grow()
+                    items.sort()
+                    # keep the last item at this level if the number of items is odd
+                    kept = [items.pop()] if len(items) % 2 == 1 else []
+                    offset = self._random.randint(0, 1)
+                    self.compactors[level + 1].extend(items[offset::2])
+                    self.compactors[level] = kept
+                    self.size = sum(len(items) for items in self.compactors)
+                    # compact only one level at a time (lazy compaction)
+                    break
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Return the (approximate) value at quantile q, a number between 0 and 1."""
+        if not 0 <= q <= 1:
+            raise ValueError(f"q must be between 0 and 1, but it is {q}")
+        if self.count == 0:
+            return None
+        weighted_items = sorted(
+            (value, 2**level) for level, items in enumerate(self.compactors) for value in items
+        )
+        total_weight = sum(weight for _, weight in weighted_items)
+        # use the same (lower) rank as for the median of the non-streaming statistics
+        rank = min(int(q * total_weight), total_weight - 1)
+        cumulative_weight = 0
+        for value, weight in weighted_items:
+            cumulative_weight += weight
+            if cumulative_weight > rank:
+                return value
+        return weighted_items[-1][0]
+
+
+class FixedBinHistogram:
+    """A histogram with fixed bins given by their sorted edges. As for numpy.histogram, all but
+    the last bin are half-open, i.e. [edges[0], edges[1]), ..., [edges[-2], edges[-1]]. Values
+    outside the range are counted as underflow or overflow."""
+
+    def __init__(self, bin_edges: Sequence[float]):
+        if len(bin_edges) < 2 or any(a >= b for a, b in zip(bin_edges, bin_edges[1:])):
+            raise ValueError(
+                f"bin_edges must contain at least two strictly increasing values, but they are "
+                f"{bin_edges}"
+            )
+        self.bin_edges = list(bin_edges)
+        self.counts = [0] * (len(self.bin_edges) - 1)
+        self.underflow = 0
+        self.overflow = 0
+
+    def update(self, value: float, weight: int = 1) -> None:
+        if value < self.bin_edges[0]:
+            self.underflow += weight
+        elif value > self.bin_edges[-1]:
+            self.overflow += weight
+        else:
+            idx = min(bisect.bisect_right(self.bin_edges, value) - 1, len(self.counts) - 1)
+            self.counts[idx] += weight
+
+    def merge(self, other: "FixedBinHistogram") -> None:
+        if other.bin_edges != self.bin_edges:
+            raise ValueError("can not merge histograms with different bin edges")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "bin_edges": list(self.bin_edges),
+            "counts": list(self.counts),
+            "underflow": self.underflow,
+            "overflow": self.overflow,
+        }
+
+
+class StreamingAggregator:
+    """Aggregates a stream of numbers in constant memory. The moments (len, sum, mean, std, min,
+    max) are always calculated, the quantile sketch only if a quantile (median or a percentile
+    like "p90") is requested and the histogram only if bin_edges are given.
+
+    Args:
+        aggregation_functions: The names of the aggregation functions that are calculated by
+            compute(), see STREAMING_AGGREGATION_FUNCTIONS.
+        bin_edges: The bin edges for the "histogram" aggregation.
+        sketch_size: The parameter k of the quantile sketch, see QuantileSketch.
+    """
+
+    def __init__(
+        self,
+        aggregation_functions: Sequence[str],
+        bin_edges: Optional[Sequence[float]] = None,
+        sketch_size: int = 200,
+    ):
+        for name in aggregation_functions:
+            if not is_streaming_aggregation_function(name):
+                raise ValueError(
+                    f"aggregation function {name} is not supported for streaming, use one of "
+                    f"{STREAMING_AGGREGATION_FUNCTIONS} or a percentile like 'p90'"
+                )
+        if "histogram" in aggregation_functions and bin_edges is None:
+            raise ValueError("the histogram aggregation requires bin_edges")
+        self.aggregation_functions = list(aggregation_functions)
+        self.moments = RunningMoments()
+        self.sketch: Optional[QuantileSketch] = None
+        if any(
+            name == "median" or PERCENTILE_PATTERN.match(name) for name in aggregation_functions
+        ):
+            self.sketch = QuantileSketch(k=sketch_size)
+        self.histogram: Optional[FixedBinHistogram] = None
+        if bin_edges is not None:
+            self.histogram = FixedBinHistogram(bin_edges)
+
+    @property
+    def count(self) -> int:
+        return self.moments.count
+
+    def update(self, value: float, weight: int = 1) -> None:
+        self.moments.update(value, weight=weight)
+        if self.sketch is not None:
+            self.sketch.update(value, weight=weight)
+        if self.histogram is not None:
+            self.histogram.update(value, weight=weight)
+
+    def merge(self, other: "StreamingAggregator") -> None:
+        self.moments.merge(other.moments)
+        if self.sketch is not None and other.sketch is not None:
+            self.sketch.merge(other.sketch)
+        if self.histogram is not None and other.histogram is not None:
+            self.histogram.merge(other.histogram)
+
+    def _aggregate(self, name: str) -> Any:
+        moments = self.moments
+        if name == "len":
+            return moments.count
+        if name == "sum":
+            return moments.sum
+        if name == "mean":
+            return moments.mean if moments.count > 0 else None
+        if name == "std":
+            return moments.std
+        if name == "min":
+            return moments.min
+        if name == "max":
+            return moments.max
+        if name == "histogram":
+            return self.histogram.to_dict()  # type: ignore
+        if name == "median":
+            return self.sketch.quantile(0.5)  # type: ignore
+        match = PERCENTILE_PATTERN.match(name)
+        return self.sketch.quantile(float(match.group(1)) / 100)  # type: ignore
+
+    def compute(self) -> Dict[str, Any]:
+        return {name: self._aggregate(name) for name in self.aggregation_functions}
@@ -1,9 +1,13 @@
+from pytorch_ie.models.transformer_re_pair_classification import (
+    TransformerREPairClassificationModel,
+)
 from pytorch_ie.models.transformer_seq2seq import TransformerSeq2SeqModel
 from pytorch_ie.models.transformer_span_classification import TransformerSpanClassificationModel
 from pytorch_ie.models.transformer_text_classification import TransformerTextClassificationModel
 from pytorch_ie.models.transformer_token_classification import TransformerTokenClassificationModel
 
 __all__ = [
+    "TransformerREPairClassificationModel",
     "TransformerSeq2SeqModel",
     "TransformerSpanClassificationModel",
     "TransformerTextClassificationModel",
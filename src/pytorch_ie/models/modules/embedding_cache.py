@@ -0,0 +1,197 @@
+import glob
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.distributed
+from torch import Tensor, nn
+
+
+def get_example_keys(inputs: Mapping[str, Tensor]) -> List[str]:
+    """Get a key for each example of a batch of model inputs. The key is a hash of all input
+    values of the example without padding (as given by the attention_mask), so it does not depend
+    on the padding of the batch."""
+    values = {name: value.detach().cpu().numpy() for name, value in sorted(inputs.items())}
+    batch_size = len(next(iter(values.values())))
+    attention_mask = values.get("attention_mask")
+    keys = []
+    for idx in range(batch_size):
+        mask = attention_mask[idx].astype(bool) if attention_mask is not None else None
+        hasher = hashlib.blake2b(digest_size=16)
+        for name, value in values.items():
+            example_value = value[idx]
+            if mask is not None and example_value.shape == mask.shape:
+                example_value = example_value[mask]
+            hasher.update(name.encode())
+            hasher.update(np.ascontiguousarray(example_value, dtype=np.int64).tobytes())
+        keys.append(hasher.hexdigest())
+    return keys
+
+
+def get_model_fingerprint(model: nn.Module) -> str:
+    """Get a hash of the class and the state (parameter names and values) of a model. Embeddings
+    that were created by models with the same fingerprint are the same."""
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(type(model).__name__.encode())
+    for name, value in model.state_dict().items():
+        hasher.update(name.encode())
+        hasher.update(str(value.dtype).encode())
+        hasher.update(
+            value.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy().tobytes()
+        )
+    return hasher.hexdigest()
+
+
+class EmbeddingCache:
+    """A cache for fixed size embeddings (e.g. the outputs of a frozen encoder), keyed by strings.
+
+    By default, the embeddings are kept in memory. If cache_dir is given, they are appended to a
+    file in cache_dir (as raw float32 rows, together with a file that contains the key for each
+    row) and read via a memory map. A cache in an existing cache_dir is loaded, so the
+    embeddings can be re-used across runs.
+
+    The fingerprint (e.g. the result of get_model_fingerprint() for the model that creates the
+    embeddings) is stored in the cache_dir and loading a cache with a different fingerprint
+    raises a ValueError. Each distributed rank (or the given rank) appends only to its own files,
+    so multiple processes can share a cache_dir, and the files of all ranks are loaded.
+    """
+
+    KEYS_FILE_NAME = "keys-{rank}.txt"
+    EMBEDDINGS_FILE_NAME = "embeddings-{rank}.bin"
+    CONFIG_FILE_NAME = "config.json"
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+        rank: Optional[int] = None,
+    ):
+        self.cache_dir = cache_dir
+        self.fingerprint = fingerprint
+        if rank is None:
+            rank = 0
+            if torch.distributed.is_available() and torch.distributed.is_initialized():
+                rank = torch.distributed.get_rank()
+        self.rank = rank
+        self.dim: Optional[int] = None
+        # the location (rank of the file and row) of each key
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._num_rows: Dict[int, int] = {}
+        self._rows: List[Tensor] = []
+        self._memmaps: Dict[int, np.ndarray] = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load()
+
+    def _path(self, file_name: str, rank: Optional[int] = None) -> str:
+        if self.cache_dir is None:
+            raise ValueError("the cache has no cache_dir")
+        return os.path.join(self.cache_dir, file_name.format(rank=rank))
+
+    def _load(self) -> None:
+        config_path = self._path(self.CONFIG_FILE_NAME)
+        if not os.path.exists(config_path):
+            return
+        with open(config_path) as f:
+            config = json.load(f)
+        if config.get("fingerprint") != self.fingerprint:
+            raise ValueError(
+                f"the cache in {self.cache_dir} was created with fingerprint "
+                f"{config.get('fingerprint')}, but the fingerprint is {self.fingerprint}"
+            )
+        self.dim = config["dim"]
+        keys_pattern = re.compile(re.escape(self.KEYS_FILE_NAME).replace(r"\{rank\}", r"(\d+)"))
+        for keys_path in sorted(glob.glob(self._path(self.KEYS_FILE_NAME, rank="*"))):
+            match = keys_pattern.fullmatch(os.path.basename(keys_path))
+            if match is None:
+                continue
+            rank = int(match.group(1))
+            with open(keys_path) as f:
+                keys = f.read().splitlines()
+            embeddings_path = self._path(self.EMBEDDINGS_FILE_NAME, rank=rank)
+            num_rows = min(os.path.getsize(embeddings_path) // (4 * self.dim), len(keys))
+            if rank == self.rank:
+                # the rows are written before their keys, so remove rows of an interrupted write
+                os.truncate(embeddings_path, num_rows * 4 * self.dim)
+            for idx, key in enumerate(keys[:num_rows]):
+                self._index.setdefault(key, (rank, idx))
+            self._num_rows[rank] = num_rows
+
+    def _save_config(self) -> None:
+        # write to a temporary file first, so other processes never read a partial config
+        tmp_path = self._path(f"{self.CONFIG_FILE_NAME}.{self.rank}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "fingerprint": self.fingerprint}, f)
+        os.replace(tmp_path, self._path(self.CONFIG_FILE_NAME))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def add(self, keys: Sequence[str], embeddings: Tensor) -> None:
+        """Add embeddings (shape: [len(keys), dim]) to the cache. Keys that are already in the
+        cache are skipped."""
+        if len(keys) != len(embeddings):
+            raise ValueError(f"got {len(keys)} keys, but {len(embeddings)} embeddings")
+        embeddings = embeddings.detach().to(device="cpu", dtype=torch.float32)
+        if self.dim is None:
+            self.dim = embeddings.shape[-1]
+            if self.cache_dir is not None:
+                self._save_config()
+        elif embeddings.shape[-1] != self.dim:
+            raise ValueError(
+                f"the embeddings have dimension {embeddings.shape[-1]}, but the cache contains "
+                f"embeddings of dimension {self.dim}"
+            )
+        new_embeddings: Dict[str, Tensor] = {}
+        for key, embedding in zip(keys, embeddings):
+            if key not in self._index:
+                new_embeddings.setdefault(key, embedding)
+        if len(new_embeddings) == 0:
+            return
+        new_keys = list(new_embeddings)
+        new_rows = list(new_embeddings.values())
+
+        if self.cache_dir is None:
+            for key, row in zip(new_keys, new_rows):
+                self._index[key] = (self.rank, len(self._rows))
+                self._rows.append(row.clone())
+        else:
+            with open(self._path(self.EMBEDDINGS_FILE_NAME, rank=self.rank), "ab") as f:
+                f.write(torch.stack(new_rows).numpy().tobytes())
+            with open(self._path(self.KEYS_FILE_NAME, rank=self.rank), "a") as f:
+                f.writelines(f"{key}\n" for key in new_keys)
+            num_rows = self._num_rows.get(self.rank, 0)
+            for idx, key in enumerate(new_keys):
+                self._index[key] = (self.rank, num_rows + idx)
+            self._num_rows[self.rank] = num_rows + len(new_keys)
+
+    def _get_memmap(self, rank: int) -> np.ndarray:
+        memmap = self._memmaps.get(rank)
+        if memmap is None or len(memmap) < self._num_rows[rank]:
+            memmap = np.memmap(
+                self._path(self.EMBEDDINGS_FILE_NAME, rank=rank),
+                dtype=np.float32,
+                mode="r",
+                shape=(self._num_rows[rank], self.dim),
+            )
+            self._memmaps[rank] = memmap
+        return memmap
+
+    def get(self, keys: Sequence[str]) -> Tensor:
+        """Get the embeddings for the keys (shape: [len(keys), dim]). All keys need to be in the
+        cache."""
+        locations = np.array([self._index[key] for key in keys], dtype=np.int64).reshape(-1, 2)
+        if self.cache_dir is None:
+            return torch.stack([self._rows[idx] for idx in locations[:, 1].tolist()])
+        embeddings = np.empty((len(keys), self.dim), dtype=np.float32)
+        for rank in np.unique(locations[:, 0]).tolist():
+            mask = locations[:, 0] == rank
+            embeddings[mask] = self._get_memmap(rank)[locations[mask, 1]]
+        return torch.from_numpy(embeddings)
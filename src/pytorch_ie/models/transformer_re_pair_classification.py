@@ -0,0 +1,242 @@
+import logging
+from typing import Any, Dict, MutableMapping, Optional, Tuple
+
+import torch
+import torchmetrics
+from torch import Tensor, nn
+from torch.optim import AdamW
+from transformers import AutoConfig, AutoModel, get_linear_schedule_with_warmup
+from typing_extensions import TypeAlias
+
+from pytorch_ie.model import PyTorchIEModel
+from pytorch_ie.models.interface import RequiresModelNameOrPath, RequiresNumClasses
+from pytorch_ie.models.modules.mlp import MLP
+
+ModelInputType: TypeAlias = MutableMapping[str, Any]
+ModelOutputType: TypeAlias = Dict[str, Any]
+
+ModelStepInputType = Tuple[
+    ModelInputType,
+    Optional[Tensor],
+]
+
+TRAINING = "train"
+VALIDATION = "val"
+TEST = "test"
+
+SPAN_POOLING_METHODS = ["max", "mean", "start"]
+PAIR_HEADS = ["mlp", "bilinear"]
+
+logger = logging.getLogger(__name__)
+
+
+@PyTorchIEModel.register()
+class TransformerREPairClassificationModel(
+    PyTorchIEModel, RequiresModelNameOrPath, RequiresNumClasses
+):
+    """A relation classification model that scores all entity pairs of an input at once.
+
+    Each input is encoded only once by the transformer. The entity representations are pooled
+    from the hidden states of their token spans (span_pooling: "max", "mean" or "start", i.e. the
+    first token of the span) and each (head, tail) pair is classified by the pair head: an MLP on
+    the concatenated head and tail representations ("mlp") or a bilinear layer on projections
+    of them ("bilinear").
+
+    In addition to the transformer inputs, the model expects the entries "entity_spans", a tensor
+    of shape (num_entities, 3) with rows (batch index, start, end), and "pair_indices", a tensor
+    of shape (num_pairs, 2) with the indices of the head and tail entities (rows of
+    entity_spans). The targets are the label ids of the pairs. See the
+    TransformerREPairClassificationTaskModule for a taskmodule that creates these inputs.
+    """
+
+    def __init__(
+        self,
+        model_name_or_path: str,
+        num_classes: int,
+        tokenizer_vocab_size: Optional[int] = None,
+        ignore_index: Optional[int] = None,
+        learning_rate: float = 1e-5,
+        task_learning_rate: float = 1e-4,
+        warmup_proportion: float = 0.1,
+        span_pooling: str = "max",
+        pair_head: str = "mlp",
+        pair_hidden_dim: int = 256,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+
+        if span_pooling not in SPAN_POOLING_METHODS:
+            raise ValueError(
+                f"span_pooling must be one of {SPAN_POOLING_METHODS}, but got {span_pooling}"
+            )
+        if pair_head not in PAIR_HEADS:
+            raise ValueError(f"pair_head must be one of {PAIR_HEADS}, but got {pair_head}")
+
+        self.save_hyperparameters()
+
+        self.learning_rate = learning_rate
+        self.task_learning_rate = task_learning_rate
+        self.warmup_proportion = warmup_proportion
+        self.span_pooling = span_pooling
+        self.pair_head = pair_head
+
+        config = AutoConfig.from_pretrained(model_name_or_path)
+        if self.is_from_pretrained:
+            self.model = AutoModel.from_config(config=config)
+        else:
+            self.model = AutoModel.from_pretrained(model_name_or_path, config=config)
+
+        if tokenizer_vocab_size is not None:
+            self.model.resize_token_embeddings(tokenizer_vocab_size)
+
+        classifier_dropout = (
+            config.classifier_dropout
+            if hasattr(config, "classifier_dropout") and config.classifier_dropout is not None
+            else config.hidden_dropout_prob
+        )
+        self.dropout = nn.Dropout(classifier_dropout)
+
+        if pair_head == "mlp":
+            self.classifier = MLP(
+                input_dim=config.hidden_size * 2,
+                hidden_dim=pair_hidden_dim,
+                output_dim=num_classes,
+                num_layers=2,
+            )
+        else:
+            self.head_projection = nn.Linear(config.hidden_size, pair_hidden_dim)
+            self.tail_projection = nn.Linear(config.hidden_size, pair_hidden_dim)
+            self.classifier = nn.Bilinear(pair_hidden_dim, pair_hidden_dim, num_classes)
+
+        # targets with the ignore_index do not contribute to the loss (as for the metrics)
+        self.loss_fct = (
+            nn.CrossEntropyLoss(ignore_index=ignore_index)
+            if ignore_index is not None
+            else nn.CrossEntropyLoss()
+        )
+
+        self.f1 = nn.ModuleDict(
+            {
+                f"stage_{stage}": torchmetrics.F1Score(
+                    num_classes=num_classes, ignore_index=ignore_index, task="multiclass"
+                )
+                for stage in [TRAINING, VALIDATION, TEST]
+            }
+        )
+
+    def pool_spans(self, hidden_state: Tensor, entity_spans: Tensor) -> Tensor:
+        """Pool the hidden states (shape: [batch_size, seq_length, hidden_size]) of the entity
+        spans (shape: [num_entities, 3]) to entity representations of shape
+        [num_entities, hidden_size].
+
+        Only the hidden states of the span tokens are used: the mean is computed from the
+        differences of the cumulative sums at the span boundaries and the max is reduced from the
+        gathered span tokens, so no tensor of shape [num_entities, seq_length, hidden_size] is
+        created.
+        """
+        batch_indices, starts, ends = entity_spans.unbind(dim=-1)
+        if self.span_pooling == "start":
+            return hidden_state[batch_indices, starts]
+
+        lengths = (ends - starts).clamp(min=0)
+        if self.span_pooling == "mean":
+            # Accumulate in float32: the differences of the cumulative sums lose too much
+            # precision in half precision. Shape: [batch_size, seq_length + 1, hidden_size]
+            cumsum = nn.functional.pad(hidden_state.float().cumsum(dim=1), (0, 0, 1, 0))
+            span_sums = cumsum[batch_indices, ends] - cumsum[batch_indices, starts]
+            span_means = span_sums / lengths.clamp(min=1)[:, None]
+            return span_means.to(hidden_state.dtype)
+
+        # flat indices of all span tokens, shape: [num_span_tokens]
+        span_ids = torch.repeat_interleave(
+            torch.arange(len(lengths), device=hidden_state.device), lengths
+        )
+        span_offsets = torch.cumsum(lengths, dim=0) - lengths
+        token_positions = (
+            torch.arange(len(span_ids), device=hidden_state.device)
+            - span_offsets[span_ids]
+            + starts[span_ids]
+        )
+        span_token_states = hidden_state[batch_indices[span_ids], token_positions]
+        pooled = hidden_state.new_full(
+            (len(lengths), hidden_state.shape[-1]), torch.finfo(hidden_state.dtype).min
+        )
+        return pooled.scatter_reduce(
+            0,
+            span_ids[:, None].expand_as(span_token_states),
+            span_token_states,
+            reduce="amax",
+            include_self=True,
+        )
+
+    def classify_pairs(self, head_embeddings: Tensor, tail_embeddings: Tensor) -> Tensor:
+        if self.pair_head == "mlp":
+            return self.classifier(torch.cat([head_embeddings, tail_embeddings], dim=-1))
+        return self.classifier(
+            self.head_projection(head_embeddings), self.tail_projection(tail_embeddings)
+        )
+
+    def forward(self, inputs: ModelInputType) -> ModelOutputType:
+        entity_spans = inputs["entity_spans"]
+        pair_indices = inputs["pair_indices"]
+        model_inputs = {
+            name: value
+            for name, value in inputs.items()
+            if name not in ["entity_spans", "pair_indices"]
+        }
+        output = self.model(**model_inputs)
+
+        entity_embeddings = self.dropout(self.pool_spans(output.last_hidden_state, entity_spans))
+        logits = self.classify_pairs(
+            entity_embeddings[pair_indices[:, 0]], entity_embeddings[pair_indices[:, 1]]
+        )
+
+        return {"logits": logits, "pair_batch_indices": entity_spans[pair_indices[:, 0], 0]}
+
+    def step(self, stage: str, batch: ModelStepInputType):
+        inputs, target = batch
+        assert target is not None, "target has to be available for training"
+
+        logits = self(inputs)["logits"]
+
+        loss = self.loss_fct(logits, target)
+
+        self.log(f"{stage}/loss", loss, on_step=(stage == TRAINING), on_epoch=True, prog_bar=True)
+
+        f1 = self.f1[f"stage_{stage}"]
+        f1(logits, target)
+        self.log(f"{stage}/f1", f1, on_step=False, on_epoch=True, prog_bar=True)
+
+        return loss
+
+    def training_step(self, batch: ModelStepInputType, batch_idx: int):
+        return self.step(stage=TRAINING, batch=batch)
+
+    def validation_step(self, batch: ModelStepInputType, batch_idx: int):
+        return self.step(stage=VALIDATION, batch=batch)
+
+    def test_step(self, batch: ModelStepInputType, batch_idx: int):
+        return self.step(stage=TEST, batch=batch)
+
+    def configure_optimizers(self):
+        # the transformer is trained with learning_rate and the entity pooling and pair head
+        # with task_learning_rate
+        model_parameter_ids = {id(param) for param in self.model.parameters()}
+        optimizer_grouped_parameters = [
+            {"params": list(self.model.parameters())},
+            {
+                "params": [
+                    param for param in self.parameters() if id(param) not in model_parameter_ids
+                ],
+                "lr": self.task_learning_rate,
+            },
+        ]
+        optimizer = AdamW(optimizer_grouped_parameters, lr=self.learning_rate)
+        if self.warmup_proportion > 0.0:
+            stepping_batches = self.trainer.estimated_stepping_batches
+            scheduler = get_linear_schedule_with_warmup(
+                optimizer, int(stepping_batches * self.warmup_proportion), stepping_batches
+            )
+            return [optimizer], [{"scheduler": scheduler, "interval": "step"}]
+        else:
+            return optimizer
@@ -1,4 +1,6 @@
-from typing import Any, Tuple
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
 
 import torch
 from transformers import AutoConfig, AutoModelForSeq2SeqLM, BatchEncoding
@@ -16,12 +18,26 @@ ModelStepInputType: TypeAlias = Tuple[ModelInputType]
 
 @PyTorchIEModel.register()
 class TransformerSeq2SeqModel(PyTorchIEModel, RequiresModelNameOrPath):
-    def __init__(self, model_name_or_path: str, learning_rate: float = 1e-5, **kwargs) -> None:
+    def __init__(
+        self,
+        model_name_or_path: str,
+        learning_rate: float = 1e-5,
+        generation_kwargs: Optional[Dict[str, Any]] = None,
+        max_generation_statistics: int = 1000,
+        **kwargs,
+    ) -> None:
         super().__init__(**kwargs)
 
         self.save_hyperparameters()
 
         self.learning_rate = learning_rate
+        # default parameters for generate(), e.g. num_beams or early_stopping
+        self.generation_kwargs = generation_kwargs or {}
+        # one entry per predict() call (only the most recent max_generation_statistics ones are
+        # kept), see predict()
+        self.generation_statistics: Deque[Dict[str, float]] = deque(
+            maxlen=max_generation_statistics
+        )
 
         if self.is_from_pretrained:
             config = AutoConfig.from_pretrained(model_name_or_path)
@@ -29,18 +45,55 @@ class TransformerSeq2SeqModel(PyTorchIEModel, RequiresModelNameOrPath):
         else:
             self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name_or_path)
 
+    def reset_generation_statistics(self) -> None:
+        self.generation_statistics.clear()
+
     def forward(self, inputs: ModelInputType) -> ModelOutputType:
         return self.model(**inputs)
 
     def predict(
         self,
         inputs: Any,
+        generation_kwargs: Optional[Dict[str, Any]] = None,
+        max_target_length: Optional[int] = None,
         **kwargs,
     ) -> Any:
+        """Generate the output sequences for the inputs.
+
+        Args:
+            inputs: the model inputs, labels are ignored
+            generation_kwargs: parameters for generate(), they take precedence over the
+                generation_kwargs passed to the constructor
+            max_target_length: if provided, the number of generated tokens is limited to this value
+                unless max_new_tokens or max_length is already set via the generation parameters
+            **kwargs: further parameters for generate(), they take precedence over all others
+        """
         if "labels" in inputs:
             inputs = {k: v for k, v in inputs.items() if k != "labels"}
 
-        return self.model.generate(**inputs, **kwargs)
+        generation_kwargs = {**self.generation_kwargs, **(generation_kwargs or {}), **kwargs}
+        if (
+            max_target_length is not None
+            and "max_new_tokens" not in generation_kwargs
+            and "max_length" not in generation_kwargs
+        ):
+            generation_kwargs["max_new_tokens"] = max_target_length
+
+        start_time = time.perf_counter()
+        output = self.model.generate(**inputs, **generation_kwargs)
+        # counting the tokens also waits for the generation to be finished on the device
+        pad_token_id = getattr(getattr(self.model, "config", None), "pad_token_id", None)
+        generated_tokens = (
+            output.numel() if pad_token_id is None else (output != pad_token_id).sum()
+        )
+        self.generation_statistics.append(
+            {
+                "batch_size": len(output),
+                "generated_tokens": int(generated_tokens),
+                "time": time.perf_counter() - start_time,
+            }
+        )
+        return output
 
     def step(self, batch: ModelStepInputType):
         inputs = batch[0]
@@ -1,6 +1,7 @@
 import logging
 from typing import Any, Dict, MutableMapping, Optional, Tuple
 
+import torch
 import torchmetrics
 from torch import Tensor, nn
 from torch.optim import AdamW
@@ -9,6 +10,11 @@ from typing_extensions import TypeAlias
 
 from pytorch_ie.model import PyTorchIEModel
 from pytorch_ie.models.interface import RequiresModelNameOrPath, RequiresNumClasses
+from pytorch_ie.models.modules.embedding_cache import (
+    EmbeddingCache,
+    get_example_keys,
+    get_model_fingerprint,
+)
 
 ModelInputType: TypeAlias = MutableMapping[str, Any]
 ModelOutputType: TypeAlias = Dict[str, Any]
@@ -29,6 +35,19 @@ logger = logging.getLogger(__name__)
 class TransformerTextClassificationModel(
     PyTorchIEModel, RequiresModelNameOrPath, RequiresNumClasses
 ):
+    """A text classification model that classifies the CLS embedding of a transformer.
+
+    If the transformer is frozen (freeze_model=True), its outputs do not change during training.
+    Then, cache_embeddings=True allows to compute the CLS embedding of each example only once: the
+    embeddings are cached (keyed by a hash of the inputs, see get_example_keys()) and only the
+    classifier is applied to the cached embeddings in subsequent epochs. The embeddings are kept
+    in memory, or in embedding_cache_dir, if set (see EmbeddingCache). The cache is created when
+    the first embeddings are requested, i.e. after the weights are loaded, and it is tied to a
+    fingerprint of the transformer weights, so a cache_dir with embeddings of another transformer
+    is rejected. Note that the cached embeddings are computed with the transformer in eval mode,
+    i.e. without dropout.
+    """
+
     def __init__(
         self,
         model_name_or_path: str,
@@ -41,10 +60,15 @@ class TransformerTextClassificationModel(
         freeze_model: bool = False,
         multi_label: bool = False,
         t_total: Optional[int] = None,
+        cache_embeddings: bool = False,
+        embedding_cache_dir: Optional[str] = None,
         **kwargs,
     ) -> None:
         super().__init__(**kwargs)
 
+        if cache_embeddings and not freeze_model:
+            raise ValueError("cache_embeddings requires freeze_model=True")
+
         if t_total is not None:
             logger.warning(
                 "t_total is deprecated, we use estimated_stepping_batches from the pytorch lightning trainer instead"
@@ -80,6 +104,10 @@ class TransformerTextClassificationModel(
 
         self.loss_fct = nn.BCEWithLogitsLoss() if multi_label else nn.CrossEntropyLoss()
 
+        self.cache_embeddings = cache_embeddings
+        self.embedding_cache_dir = embedding_cache_dir
+        self.embedding_cache: Optional[EmbeddingCache] = None
+
         self.f1 = nn.ModuleDict(
             {
                 f"stage_{stage}": torchmetrics.F1Score(
@@ -91,12 +119,37 @@ class TransformerTextClassificationModel(
             }
         )
 
-    def forward(self, inputs: ModelInputType) -> ModelOutputType:
-        output = self.model(**inputs)
-
-        hidden_state = output.last_hidden_state
+    def get_embedding_cache(self) -> EmbeddingCache:
+        if self.embedding_cache is None:
+            self.embedding_cache = EmbeddingCache(
+                cache_dir=self.embedding_cache_dir, fingerprint=get_model_fingerprint(self.model)
+            )
+        return self.embedding_cache
+
+    def get_cls_embeddings(self, inputs: ModelInputType) -> Tensor:
+        if not self.cache_embeddings:
+            output = self.model(**inputs)
+            return output.last_hidden_state[:, 0, :]
+
+        embedding_cache = self.get_embedding_cache()
+
+        keys = get_example_keys(inputs)
+        missing = [idx for idx, key in enumerate(keys) if key not in embedding_cache]
+        if len(missing) > 0:
+            missing_indices = torch.tensor(missing, device=inputs["input_ids"].device)
+            missing_inputs = {name: value[missing_indices] for name, value in inputs.items()}
+            was_training = self.model.training
+            self.model.eval()
+            with torch.no_grad():
+                output = self.model(**missing_inputs)
+            self.model.train(was_training)
+            embedding_cache.add([keys[idx] for idx in missing], output.last_hidden_state[:, 0, :])
+        return embedding_cache.get(keys).to(
+            device=self.classifier.weight.device, dtype=self.classifier.weight.dtype
+        )
 
-        cls_embeddings = hidden_state[:, 0, :]
+    def forward(self, inputs: ModelInputType) -> ModelOutputType:
+        cls_embeddings = self.get_cls_embeddings(inputs)
         logits = self.classifier(cls_embeddings)
 
         return {"logits": logits}
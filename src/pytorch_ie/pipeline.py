@@ -1,19 +1,44 @@
+import inspect
+import itertools
 import logging
 import os
 import warnings
-from collections import UserDict
+from collections import UserDict, deque
 from contextlib import contextmanager
-from typing import Any, Dict, List, MutableSequence, Optional, Sequence, Tuple, TypeVar, Union
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    MutableSequence,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import torch
 import tqdm
 from packaging import version
-from pie_core import AnnotationPipeline, Document, TaskEncoding, TaskEncodingDataset, TaskModule
+from pie_core import (
+    AnnotationPipeline,
+    Document,
+    DocumentMetric,
+    TaskEncoding,
+    TaskEncodingDataset,
+    TaskEncodingSequence,
+    TaskModule,
+)
 from torch import Tensor
 from torch.utils.data import DataLoader
 from transformers.utils import ModelOutput
 
+from pytorch_ie.dataset import IterableTaskEncodingDataset
 from pytorch_ie.model import AutoPyTorchIEModel, PyTorchIEModel
+from pytorch_ie.utils.parallel_encoding import encode_in_parallel
 
 
 class InplaceNotSupportedException(Exception):
@@ -35,6 +60,17 @@ def get_autocast_dtype(device_type: str):
         raise ValueError(f"Unsupported device type for half precision autocast: {device_type}")
 
 
+def _iterate_chunks(items: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
 @AnnotationPipeline.register()
 class PyTorchIEPipeline(AnnotationPipeline[PyTorchIEModel, TaskModule]):
     """
@@ -196,12 +232,18 @@ class PyTorchIEPipeline(AnnotationPipeline[PyTorchIEModel, TaskModule]):
         postprocess_parameters: Dict[str, Any] = {}
 
         # set preprocess parameters
-        for p_name in ["document_batch_size"]:
+        for p_name in ["document_batch_size", "num_encode_workers"]:
             if p_name in pipeline_parameters:
                 preprocess_parameters[p_name] = pipeline_parameters.pop(p_name)
 
         # set forward parameters
-        for p_name in ["show_progress_bar", "fast_dev_run", "half_precision_ops"]:
+        for p_name in [
+            "show_progress_bar",
+            "fast_dev_run",
+            "half_precision_ops",
+            "sort_by_length",
+            "generation_kwargs",
+        ]:
             if p_name in pipeline_parameters:
                 forward_parameters[p_name] = pipeline_parameters.pop(p_name)
 
@@ -211,7 +253,13 @@ class PyTorchIEPipeline(AnnotationPipeline[PyTorchIEModel, TaskModule]):
                 dataloader_params[p_name] = pipeline_parameters.pop(p_name)
 
         # set postprocess parameters
-        for p_name in ["inplace"]:
+        for p_name in [
+            "inplace",
+            "metrics",
+            "keep_documents",
+            "document_chunk_size",
+            "log_metrics_every_n_documents",
+        ]:
             if p_name in pipeline_parameters:
                 postprocess_parameters[p_name] = pipeline_parameters.pop(p_name)
 
@@ -223,17 +271,59 @@ class PyTorchIEPipeline(AnnotationPipeline[PyTorchIEModel, TaskModule]):
             pipeline_parameters,
         )
 
+    def _get_default_forward_params(self) -> Dict[str, Any]:
+        """
+        Forward parameters that are derived from the taskmodule. These are used if not explicitly set in `__init__` or
+        `__call__`. For generative taskmodules (i.e. taskmodules with a `max_target_length` attribute), the model
+        inputs are processed ordered by length (`sort_by_length=True`) because a generation batch takes as long as its
+        longest sequence. In addition, the maximum target length is used as length budget if the model supports that
+        (see e.g. `TransformerSeq2SeqModel.predict`).
+        """
+        default_forward_params: Dict[str, Any] = {}
+        if hasattr(self.taskmodule, "max_target_length"):
+            default_forward_params["sort_by_length"] = True
+        max_target_length = getattr(self.taskmodule, "max_target_length", None)
+        if (
+            max_target_length is not None
+            and "max_target_length" in inspect.signature(self.model.predict).parameters
+        ):
+            default_forward_params["max_target_length"] = max_target_length
+        return default_forward_params
+
+    def _get_input_length(self, task_encoding: TaskEncoding) -> int:
+        inputs = task_encoding.inputs
+        if not isinstance(inputs, (dict, UserDict)) or "input_ids" not in inputs:
+            raise ValueError(
+                "sort_by_length requires task encodings with inputs that contain input_ids"
+            )
+        return len(inputs["input_ids"])
+
     def preprocess(
         self,
         documents: Sequence[Document],
         document_batch_size: Optional[int] = None,
+        num_encode_workers: int = 0,
         **preprocess_parameters: Dict,
     ) -> Sequence[TaskEncoding]:
         """
         Preprocess will take the `input_` of a specific pipeline and return a dictionary of everything necessary for
         `_forward` to run properly. It should contain at least one tensor, but might have arbitrary other items.
+
+        If num_encode_workers > 0, the documents are encoded by a pool of worker processes (see
+        encode_in_parallel()).
         """
 
+        if num_encode_workers > 0:
+            task_encodings, documents_in_order = encode_in_parallel(
+                self.taskmodule,
+                documents,
+                num_workers=num_encode_workers,
+                encode_target=False,
+            )
+            return TaskEncodingSequence(
+                task_encodings=task_encodings, documents_in_order=documents_in_order
+            )
+
         encodings = self.taskmodule.encode(
             documents,
             encode_target=False,
@@ -313,6 +403,247 @@ class PyTorchIEPipeline(AnnotationPipeline[PyTorchIEModel, TaskModule]):
 
         return dataloader
 
+    def _predict(
+        self, dataloader: Iterable[Any], forward_params: Dict[str, Any]
+    ) -> Iterator[List[Any]]:
+        """Run the model on the batches of the dataloader and yield the unbatched outputs of each
+        batch. The parameters show_progress_bar and half_precision_ops are consumed (popped) from
+        forward_params, all others are passed to forward()."""
+        show_progress_bar = forward_params.pop("show_progress_bar", False)
+        half_precision_ops = forward_params.pop("half_precision_ops", False)
+
+        # Torch documentation recommends: "When entering an autocast-enabled region, Tensors may be any type.
+        # You should not call half() or bfloat16() on your model(s) or inputs when using autocasting."
+        # (see https://docs.pytorch.org/docs/stable/amp.html#torch.autocast). So show a warning in this case.
+        if half_precision_ops:
+            if self.model.dtype == get_autocast_dtype(self.device.type):
+                logger.warning(
+                    "Using half precision operations with a model already in half precision. "
+                    "This is not recommended, as it may lead to unexpected results."
+                )
+
+        for batch in tqdm.tqdm(dataloader, desc="inference", disable=not show_progress_bar):
+            with torch.no_grad():
+                with torch.autocast(device_type=self.device.type, enabled=half_precision_ops):
+                    output = self.forward(batch, **forward_params)
+                    batch_outputs = self.taskmodule.unbatch_output(output)
+            yield batch_outputs
+
+    def _process_documents(
+        self,
+        documents: Sequence[Document],
+        preprocess_params: Dict[str, Any],
+        dataloader_params: Dict[str, Any],
+        forward_params: Dict[str, Any],
+        postprocess_params: Dict[str, Any],
+    ) -> Sequence[Document]:
+        """Encode the documents, run the model on the encodings and integrate the results back
+        into the documents (see __call__)."""
+        # the forward parameters are consumed (popped) below
+        forward_params = dict(forward_params)
+
+        # This creates encodings from the documents. It modifies the documents and may produce multiple entries per
+        # document.
+        model_inputs = self.preprocess(documents, **preprocess_params)
+        if forward_params.pop("fast_dev_run", False):
+            warnings.warn(
+                "Execute a fast dev run, only the first two model inputs will be processed."
+            )
+            model_inputs = model_inputs[:2]
+
+        # Process the inputs ordered by length to minimize padding. This is especially helpful
+        # for generative models because a batch takes as long as its longest sequence.
+        order: Optional[List[int]] = None
+        sorted_model_inputs: Sequence[TaskEncoding] = model_inputs
+        if forward_params.pop("sort_by_length", False):
+            input_lengths = [self._get_input_length(model_input) for model_input in model_inputs]
+            order = sorted(range(len(model_inputs)), key=input_lengths.__getitem__)
+            sorted_model_inputs = [model_inputs[idx] for idx in order]
+
+        # Create a dataloader from the model inputs. This uses taskmodule.collate().
+        dataloader = self.get_dataloader(model_inputs=sorted_model_inputs, **dataloader_params)
+
+        model_outputs: List = []
+        for batch_outputs in self._predict(dataloader, forward_params):
+            model_outputs.extend(batch_outputs)
+
+        assert len(model_inputs) == len(
+            model_outputs
+        ), f"length mismatch: len(model_inputs) [{len(model_inputs)}] != len(model_outputs) [{len(model_outputs)}]"
+
+        # restore the original order
+        if order is not None:
+            sorted_model_outputs = model_outputs
+            model_outputs = [None] * len(sorted_model_outputs)
+            for position, idx in enumerate(order):
+                model_outputs[idx] = sorted_model_outputs[position]
+
+        documents = self.postprocess(
+            model_inputs=model_inputs,
+            model_outputs=model_outputs,
+            **postprocess_params,
+        )
+        return documents
+
+    def _iterate_encoded_documents(
+        self,
+        documents: Iterable[Document],
+        document_chunk_size: int,
+        sort_by_length: bool,
+        preprocess_params: Dict[str, Any],
+    ) -> Iterator[Tuple[int, Document, List[TaskEncoding]]]:
+        """Encode the documents lazily in chunks of document_chunk_size documents and yield each
+        (encoded) document together with its position in the input and its task encodings, in
+        the order of the documents. If sort_by_length is True, the documents of a chunk are
+        yielded ordered by the length of their longest task encoding."""
+        num_documents = 0
+        for chunk in _iterate_chunks(documents, document_chunk_size):
+            model_inputs = self.preprocess(chunk, **preprocess_params)
+            document_task_encodings: Dict[int, Tuple[int, Document, List[TaskEncoding]]] = {}
+            documents_in_order = getattr(model_inputs, "documents_in_order", None)
+            if documents_in_order is None:
+                documents_in_order = [task_encoding.document for task_encoding in model_inputs]
+            for document in documents_in_order:
+                if id(document) not in document_task_encodings:
+                    document_task_encodings[id(document)] = (num_documents, document, [])
+                    num_documents += 1
+            for task_encoding in model_inputs:
+                document_task_encodings[id(task_encoding.document)][2].append(task_encoding)
+            encoded_documents: Iterable[Tuple[int, Document, List[TaskEncoding]]] = (
+                document_task_encodings.values()
+            )
+            if sort_by_length:
+                encoded_documents = sorted(
+                    encoded_documents,
+                    key=lambda entry: max(map(self._get_input_length, entry[2]), default=0),
+                )
+            yield from encoded_documents
+
+    def _process_and_evaluate_documents(
+        self,
+        documents: Union[Document, Iterable[Document]],
+        metrics: Sequence[DocumentMetric],
+        keep_documents: bool,
+        document_chunk_size: int,
+        preprocess_params: Dict[str, Any],
+        dataloader_params: Dict[str, Any],
+        forward_params: Dict[str, Any],
+        postprocess_params: Dict[str, Any],
+        log_metrics_every_n_documents: Optional[int] = None,
+    ) -> Sequence[Document]:
+        """Process the documents with a single streamed dataloader and update the metrics with
+        each finished document. If log_metrics_every_n_documents is set, the intermediate metric
+        values are logged after every n finished documents. The final values are logged at
+        debug level; the metrics are not reset, so the caller can still compute them.
+
+        The documents, which may be any iterable, are encoded lazily in chunks of
+        document_chunk_size documents. Because the task encodings are created while the
+        dataloader is iterated, they are collated in the main process (num_workers is not used).
+        A document is decoded and evaluated as soon as the outputs for all its task encodings are
+        available. If keep_documents is False, the processed documents are released afterwards
+        and an empty list is returned, so that the memory requirements do not depend on the
+        number of documents. Otherwise, the processed documents are returned in the input order,
+        even if they were processed ordered by length (sort_by_length).
+        """
+        if isinstance(documents, Document):
+            documents = [documents]
+        if document_chunk_size < 1:
+            raise ValueError(
+                f"document_chunk_size has to be positive, but it is {document_chunk_size}"
+            )
+        if log_metrics_every_n_documents is not None and log_metrics_every_n_documents < 1:
+            raise ValueError(
+                "log_metrics_every_n_documents has to be positive, but it is "
+                f"{log_metrics_every_n_documents}"
+            )
+        # the forward parameters are consumed (popped) below
+        forward_params = dict(forward_params)
+        if forward_params.pop("fast_dev_run", False):
+            warnings.warn(
+                "Execute a fast dev run, only the first two documents will be processed."
+            )
+            documents = itertools.islice(documents, 2)
+        sort_by_length = forward_params.pop("sort_by_length", False)
+        dataloader_params = {
+            key: value for key, value in dataloader_params.items() if key != "num_workers"
+        }
+
+        # the documents that are not yet finished (in processing order) with their position in the
+        # input, their task encodings and the outputs that are already available
+        pending: Deque[Tuple[int, Document, List[TaskEncoding], List[Any]]] = deque()
+        # the documents (index in pending plus the number of already finished documents) of the
+        # task encodings that were passed to the dataloader, but whose outputs are not available yet
+        queued: Deque[int] = deque()
+        num_finished = 0
+
+        def iterate_task_encodings() -> Iterator[TaskEncoding]:
+            for document_idx, (position, document, task_encodings) in enumerate(
+                self._iterate_encoded_documents(
+                    documents,
+                    document_chunk_size=document_chunk_size,
+                    sort_by_length=sort_by_length,
+                    preprocess_params=preprocess_params,
+                )
+            ):
+                pending.append((position, document, task_encodings, []))
+                for task_encoding in task_encodings:
+                    queued.append(document_idx)
+                    yield task_encoding
+
+        # the processed documents with their position in the input
+        result: List[Tuple[int, Document]] = []
+
+        def finish_documents() -> None:
+            nonlocal num_finished
+            while len(pending) > 0 and len(pending[0][2]) == len(pending[0][3]):
+                position, document, task_encodings, task_outputs = pending.popleft()
+                processed_documents = self.postprocess(
+                    model_inputs=TaskEncodingSequence(
+                        task_encodings=task_encodings, documents_in_order=[document]
+                    ),
+                    model_outputs=task_outputs,
+                    **postprocess_params,
+                )
+                metric_values = []
+                for processed_document in processed_documents:
+                    metric_values = [metric(processed_document) for metric in metrics]
+                    if keep_documents:
+                        result.append((position, processed_document))
+                num_finished += 1
+                if (
+                    log_metrics_every_n_documents is not None
+                    and num_finished % log_metrics_every_n_documents == 0
+                ):
+                    for metric, values in zip(metrics, metric_values):
+                        logger.info(
+                            f"{type(metric).__name__} after {num_finished} documents: {values}"
+                        )
+
+        dataloader = DataLoader(
+            IterableTaskEncodingDataset(iterate_task_encodings, shard=False),
+            collate_fn=self.taskmodule.collate,
+            num_workers=0,
+            **dataloader_params,
+        )
+        for batch_outputs in self._predict(dataloader, forward_params):
+            for task_output in batch_outputs:
+                document_idx = queued.popleft()
+                pending[document_idx - num_finished][3].append(task_output)
+            finish_documents()
+        # documents without task encodings at the end
+        finish_documents()
+        if len(pending) > 0 or len(queued) > 0:
+            raise RuntimeError("not all task encodings were processed")
+
+        for metric in metrics:
+            logger.debug(
+                f"{type(metric).__name__} after {num_finished} documents: "
+                f"{metric.compute(reset=False)}"
+            )
+        # restore the input order (the documents may have been processed ordered by length)
+        result.sort(key=lambda entry: entry[0])
+        return [document for _, document in result]
+
     def __call__(
         self,
         documents: Union[Document, Sequence[Document]],
@@ -333,6 +664,8 @@ class PyTorchIEPipeline(AnnotationPipeline[PyTorchIEModel, TaskModule]):
                 list of documents.
             document_batch_size (:obj:`int`, `optional`): The batch size to use for encoding the documents with the
                 taskmodule. If not provided, the default batch size of the taskmodule will be used.
+            num_encode_workers (:obj:`int`, `optional`, defaults to :obj:`0`): The number of worker processes to
+                encode the documents with. If 0, the documents are encoded in the main process.
             show_progress_bar (:obj:`bool`, `optional`, defaults to :obj:`False`): Whether or not to show a progress bar
                 during inference.
             fast_dev_run (:obj:`bool`, `optional`, defaults to :obj:`False`): Whether or not to run a fast development
@@ -340,12 +673,35 @@ class PyTorchIEPipeline(AnnotationPipeline[PyTorchIEModel, TaskModule]):
             half_precision_ops (:obj:`bool`, `optional`, defaults to :obj:`False`): Whether or not to use half
                 precision operations. If set to :obj:`True`, the model will be run with half precision operations
                 via :obj:`torch.autocast`.
+            sort_by_length (:obj:`bool`, `optional`): Whether or not to process the model inputs ordered by their
+                length (number of input_ids) to minimize padding. The results are returned in the original order.
+                Defaults to :obj:`True` for generative taskmodules (with a :obj:`max_target_length` attribute) and
+                to :obj:`False` otherwise.
+            generation_kwargs (:obj:`Dict[str, Any]`, `optional`): Parameters for the generation of generative
+                models, e.g. :obj:`max_new_tokens`, :obj:`num_beams` or :obj:`early_stopping` (see
+                `TransformerSeq2SeqModel.predict`). If the taskmodule has a :obj:`max_target_length` and the model
+                supports it, it is used to limit the generated tokens if no length is given here.
             batch_size (:obj:`int`, `optional`, defaults to :obj:`1`): The batch size to use for the dataloader. If not
                 provided, a batch size of 1 will be used.
             num_workers (:obj:`int`, `optional`, defaults to :obj:`8`): The number of workers to use for the dataloader.
                 If not provided, 8 workers will be used.
             inplace (:obj:`bool`, `optional`, defaults to :obj:`True`): Whether or not to modify the input documents
-                in place. Requires the input to be a mutable sequence of documents or a single document.
+                in place. Requires the input to be a mutable sequence of documents or a single document (if no
+                metrics are given).
+            metrics (:obj:`Sequence[DocumentMetric]`, `optional`): Metrics to evaluate the processed documents with.
+                If provided, the documents (which can be any iterable in this case) are streamed through a single
+                dataloader (the task encodings are collated in the main process, so :obj:`num_workers` is not used)
+                and the metrics are updated with each finished document. They are not reset, so call
+                :obj:`metric.compute()` to get the final values. The final values are also logged at debug level.
+                The processed documents are returned in the input order.
+            keep_documents (:obj:`bool`, `optional`, defaults to :obj:`True`): Only used together with
+                :obj:`metrics`. If set to :obj:`False`, the processed documents are released after evaluation
+                and an empty list is returned, so the memory consumption does not grow with the number of
+                documents.
+            document_chunk_size (:obj:`int`, `optional`, defaults to :obj:`1000`): Only used together with
+                :obj:`metrics`. The number of documents that are encoded at once.
+            log_metrics_every_n_documents (:obj:`int`, `optional`): Only used together with :obj:`metrics`. If
+                provided, the intermediate metric values are logged (at info level) after every n finished documents.
 
         Note that all the arguments except `documents` can be set in the `__init__` method and/or overridden in the
         `__call__` method.
@@ -366,8 +722,25 @@ class PyTorchIEPipeline(AnnotationPipeline[PyTorchIEModel, TaskModule]):
         if remaining_kwargs:
             logger.warning(f"Ignoring remaining kwargs: {remaining_kwargs}")
 
+        # Fuse __init__ params and __call__ params without modifying the __init__ ones.
+        preprocess_params = {**self._preprocess_params, **preprocess_params}
+        dataloader_params = {**self._dataloader_params, **dataloader_params}
+        forward_params = {
+            **self._get_default_forward_params(),
+            **self._forward_params,
+            **forward_params,
+        }
+        postprocess_params = {**self._postprocess_params, **postprocess_params}
+        metrics: Optional[Sequence[DocumentMetric]] = postprocess_params.pop("metrics", None)
+        keep_documents: bool = postprocess_params.pop("keep_documents", True)
+        document_chunk_size: int = postprocess_params.pop("document_chunk_size", 1000)
+        log_metrics_every_n_documents: Optional[int] = postprocess_params.pop(
+            "log_metrics_every_n_documents", None
+        )
+
         in_place: bool = postprocess_params.get("inplace", True)
-        if in_place and not isinstance(documents, (MutableSequence, Document)):
+        # when evaluating, the documents are processed in chunks, so they may be any iterable
+        if in_place and metrics is None and not isinstance(documents, (MutableSequence, Document)):
             raise InplaceNotSupportedException(
                 "Immutable sequences of Documents (such as Datasets) can't be modified in place. Please set inplace=False."
             )
@@ -378,59 +751,30 @@ class PyTorchIEPipeline(AnnotationPipeline[PyTorchIEModel, TaskModule]):
             )
             os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
-        # Fuse __init__ params and __call__ params without modifying the __init__ ones.
-        preprocess_params = {**self._preprocess_params, **preprocess_params}
-        dataloader_params = {**self._dataloader_params, **dataloader_params}
-        forward_params = {**self._forward_params, **forward_params}
-        postprocess_params = {**self._postprocess_params, **postprocess_params}
+        if metrics is not None:
+            return self._process_and_evaluate_documents(
+                documents,
+                metrics=metrics,
+                keep_documents=keep_documents,
+                document_chunk_size=document_chunk_size,
+                preprocess_params=preprocess_params,
+                dataloader_params=dataloader_params,
+                forward_params=forward_params,
+                postprocess_params=postprocess_params,
+                log_metrics_every_n_documents=log_metrics_every_n_documents,
+            )
 
         single_document = False
         if isinstance(documents, Document):
             single_document = True
             documents = [documents]
 
-        # This creates encodings from the documents. It modifies the documents and may produce multiple entries per
-        # document.
-        model_inputs = self.preprocess(documents, **preprocess_params)
-        if forward_params.pop("fast_dev_run", False):
-            warnings.warn(
-                "Execute a fast dev run, only the first two model inputs will be processed."
-            )
-            model_inputs = model_inputs[:2]
-        # Create a dataloader from the model inputs. This uses taskmodule.collate().
-        dataloader = self.get_dataloader(model_inputs=model_inputs, **dataloader_params)
-
-        show_progress_bar = forward_params.pop("show_progress_bar", False)
-        half_precision_ops = forward_params.pop("half_precision_ops", False)
-
-        # Torch documentation recommends: "When entering an autocast-enabled region, Tensors may be any type.
-        # You should not call half() or bfloat16() on your model(s) or inputs when using autocasting."
-        # (see https://docs.pytorch.org/docs/stable/amp.html#torch.autocast). So show a warning in this case.
-        if half_precision_ops:
-            if self.model.dtype == get_autocast_dtype(self.device.type):
-                logger.warning(
-                    "Using half precision operations with a model already in half precision. "
-                    "This is not recommended, as it may lead to unexpected results."
-                )
-
-        model_outputs: List = []
-        with torch.no_grad():
-            with torch.autocast(device_type=self.device.type, enabled=half_precision_ops):
-                for batch in tqdm.tqdm(
-                    dataloader, desc="inference", disable=not show_progress_bar
-                ):
-                    output = self.forward(batch, **forward_params)
-                    processed_output = self.taskmodule.unbatch_output(output)
-                    model_outputs.extend(processed_output)
-
-        assert len(model_inputs) == len(
-            model_outputs
-        ), f"length mismatch: len(model_inputs) [{len(model_inputs)}] != len(model_outputs) [{len(model_outputs)}]"
-
-        documents = self.postprocess(
-            model_inputs=model_inputs,
-            model_outputs=model_outputs,
-            **postprocess_params,
+        documents = self._process_documents(
+            documents,
+            preprocess_params=preprocess_params,
+            dataloader_params=dataloader_params,
+            forward_params=forward_params,
+            postprocess_params=postprocess_params,
         )
         if single_document:
             return documents[0]
@@ -1,4 +1,5 @@
 from .simple_transformer_text_classification import SimpleTransformerTextClassificationTaskModule
+from .transformer_re_pair_classification import TransformerREPairClassificationTaskModule
 from .transformer_re_text_classification import TransformerRETextClassificationTaskModule
 from .transformer_seq2seq import TransformerSeq2SeqTaskModule
 from .transformer_span_classification import TransformerSpanClassificationTaskModule
@@ -7,6 +8,7 @@ from .transformer_token_classification import TransformerTokenClassificationTask
 
 __all__ = [
     "SimpleTransformerTextClassificationTaskModule",
+    "TransformerREPairClassificationTaskModule",
     "TransformerRETextClassificationTaskModule",
     "TransformerSeq2SeqTaskModule",
     "TransformerSpanClassificationTaskModule",
@@ -13,7 +13,6 @@ from typing import Any, Dict, Iterator, MutableMapping, Optional, Sequence, Tupl
 import numpy as np
 import torch
 from pie_core import TaskEncoding, TaskModule
-from transformers import AutoTokenizer
 from transformers.file_utils import PaddingStrategy
 from transformers.tokenization_utils_base import TruncationStrategy
 from typing_extensions import TypeAlias
@@ -21,6 +20,8 @@ from typing_extensions import TypeAlias
 from pytorch_ie.annotations import Label
 from pytorch_ie.documents import TextDocumentWithLabel
 from pytorch_ie.models.transformer_text_classification import ModelOutputType, ModelStepInputType
+from pytorch_ie.utils.padding import pad_with_tokenizer_config
+from pytorch_ie.utils.tokenizer import get_tokenizer
 
 logger = logging.getLogger(__name__)
 
@@ -72,7 +73,7 @@ class SimpleTransformerTextClassificationTaskModule(TaskModuleType):
         # Save all passed arguments. They will be available via self._config().
         self.save_hyperparameters()
 
-        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name_or_path)
+        self.tokenizer = get_tokenizer(tokenizer_name_or_path)
 
         # some tokenization and padding parameters
         self.truncation = truncation
@@ -154,12 +155,12 @@ class SimpleTransformerTextClassificationTaskModule(TaskModuleType):
         input_features = [task_encoding.inputs for task_encoding in task_encodings]
 
         # pad the inputs and return torch tensors
-        inputs = self.tokenizer.pad(
+        inputs = pad_with_tokenizer_config(
+            self.tokenizer,
             input_features,
             padding=self.padding,
             max_length=self.max_length,
             pad_to_multiple_of=self.pad_to_multiple_of,
-            return_tensors="pt",
         )
 
         if task_encodings[0].has_targets:
@@ -0,0 +1,450 @@
+"""
+workflow:
+    Document
+        -> (InputEncoding, TargetEncoding) -> TaskEncoding -> TaskBatchEncoding
+            -> ModelBatchEncoding -> ModelBatchOutput
+        -> TaskOutput
+    -> Document
+"""
+
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Type, Union
+
+import numpy as np
+import torch
+from pie_core import AnnotationLayer, Document, TaskEncoding, TaskModule
+from transformers.file_utils import PaddingStrategy
+from transformers.tokenization_utils_base import TruncationStrategy
+from typing_extensions import TypeAlias
+
+from pytorch_ie.annotations import BinaryRelation, LabeledSpan, Span
+from pytorch_ie.documents import (
+    TextDocument,
+    TextDocumentWithLabeledSpansAndBinaryRelations,
+    TextDocumentWithLabeledSpansBinaryRelationsAndLabeledPartitions,
+)
+from pytorch_ie.models.transformer_re_pair_classification import (
+    ModelOutputType,
+    ModelStepInputType,
+)
+from pytorch_ie.taskmodules.interface import ChangesTokenizerVocabSize
+from pytorch_ie.taskmodules.transformer_re_text_classification import TaskOutputType
+from pytorch_ie.utils.padding import pad_with_tokenizer_config
+from pytorch_ie.utils.span import get_token_slice, is_contained_in
+from pytorch_ie.utils.tokenizer import detach_tokenizer, get_tokenizer
+
+InputEncodingType: TypeAlias = Dict[str, Any]
+TargetEncodingType: TypeAlias = Sequence[int]
+
+TaskEncodingType: TypeAlias = TaskEncoding[
+    TextDocument,
+    InputEncodingType,
+    TargetEncodingType,
+]
+
+TaskModuleType: TypeAlias = TaskModule[
+    TextDocument,
+    InputEncodingType,
+    TargetEncodingType,
+    ModelStepInputType,
+    ModelOutputType,
+    TaskOutputType,
+]
+
+
+ENTITY_MARKER = "E"
+
+
+logger = logging.getLogger(__name__)
+
+
+@TaskModule.register()
+class TransformerREPairClassificationTaskModule(TaskModuleType, ChangesTokenizerVocabSize):
+    """Relation extraction that classifies all relation candidates of a partition at once. In
+    contrast to the TransformerRETextClassificationTaskModule, which creates one input (with
+    head and tail markers) per relation candidate, this taskmodule creates a single input per
+    partition. The input contains the token ids of the partition, the token spans of all entities
+    and the (head, tail) entity index pairs of all relation candidates. A model like the
+    TransformerREPairClassificationModel encodes the partition once, pools the entity
+    representations from their token spans and classifies all pairs. The task outputs (one label
+    and probability per candidate) are converted to relations in the same way as the
+    TransformerRETextClassificationTaskModule does.
+
+    parameters:
+
+        partition_annotation: str, optional. If specified, LabeledSpan annotations with this name are
+            expected to define partitions of the document that will be processed individually, e.g. sentences
+            or sections of the document text.
+        none_label: str, defaults to "no_relation". The relation label that indicate dummy/negative relations.
+            Predicted relations with that label will not be added to the document(s).
+        create_relation_candidates: bool, defaults to False. If True, create relation candidates by pairwise
+            combining all entities in the partition and assigning the none_label. If the document already
+            contains a relation with the entity pair, we do not add it again. If False, assume that the document
+            already contains relation annotations including negative examples (i.e. relations with the none_label).
+        add_entity_markers: bool, defaults to False. If True, insert marker tokens before and after all
+            entities of the partition (the same for all entities, so the input is still shared by all pairs).
+            The entity token spans then include their markers.
+        add_type_to_marker: bool, defaults to False. If True, the entity markers contain the entity label.
+    """
+
+    PREPARED_ATTRIBUTES = ["label_to_id", "entity_labels"]
+
+    def __init__(
+        self,
+        tokenizer_name_or_path: str,
+        relation_annotation: str = "binary_relations",
+        create_relation_candidates: bool = False,
+        partition_annotation: Optional[str] = None,
+        none_label: str = "no_relation",
+        padding: Union[bool, str, PaddingStrategy] = True,
+        truncation: Union[bool, str, TruncationStrategy] = True,
+        max_length: Optional[int] = None,
+        pad_to_multiple_of: Optional[int] = None,
+        label_to_id: Optional[Dict[str, int]] = None,
+        entity_labels: Optional[List[str]] = None,
+        add_entity_markers: bool = False,
+        add_type_to_marker: bool = False,
+        reversed_relation_label_suffix: Optional[str] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.save_hyperparameters()
+
+        self.relation_annotation = relation_annotation
+        self.create_relation_candidates = create_relation_candidates
+        self.partition_annotation = partition_annotation
+        self.none_label = none_label
+        self.padding = padding
+        self.truncation = truncation
+        self.max_length = max_length
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.label_to_id = label_to_id or {}
+        self.id_to_label = {v: k for k, v in self.label_to_id.items()}
+        self.entity_labels = entity_labels
+        self.add_entity_markers = add_entity_markers
+        self.add_type_to_marker = add_type_to_marker
+        self.reversed_relation_label_suffix = reversed_relation_label_suffix
+
+        self.tokenizer = get_tokenizer(tokenizer_name_or_path)
+
+        self.entity_markers: Optional[List[str]] = None
+
+    @property
+    def document_type(self) -> Optional[Type[TextDocument]]:
+        dt: Type[TextDocument]
+        if self.partition_annotation is not None:
+            dt = TextDocumentWithLabeledSpansBinaryRelationsAndLabeledPartitions
+        else:
+            dt = TextDocumentWithLabeledSpansAndBinaryRelations
+
+        if self.relation_annotation == "binary_relations":
+            return dt
+        else:
+            logger.warning(
+                f"relation_annotation={self.relation_annotation} is "
+                f"not the default value ('binary_relations'), so the taskmodule {type(self).__name__} can not request "
+                f"the usual document type for auto-conversion ({dt.__name__}) because this has the bespoken default "
+                f"value as layer name instead of the provided one."
+            )
+            return None
+
+    def get_relation_layer(self, document: Document) -> AnnotationLayer[BinaryRelation]:
+        return document[self.relation_annotation]
+
+    def get_entity_layer(self, document: Document) -> AnnotationLayer[LabeledSpan]:
+        relations: AnnotationLayer[BinaryRelation] = self.get_relation_layer(document)
+        if len(relations._targets) != 1:
+            raise Exception(
+                f"the relation layer is expected to target exactly one entity layer, but it has "
+                f"the following targets: {relations._targets}"
+            )
+        entity_layer_name = relations._targets[0]
+        return document[entity_layer_name]
+
+    def _prepare(self, documents: Sequence[TextDocument]) -> None:
+        entity_labels: Set[str] = set()
+        relation_labels: Set[str] = set()
+        for document in documents:
+            for entity in self.get_entity_layer(document):
+                entity_labels.add(entity.label)
+            for relation in self.get_relation_layer(document):
+                relation_labels.add(relation.label)
+
+        relation_labels.discard(self.none_label)
+
+        self.label_to_id = {label: i + 1 for i, label in enumerate(sorted(relation_labels))}
+        self.label_to_id[self.none_label] = 0
+
+        self.entity_labels = sorted(entity_labels)
+
+    def _get_marker(self, entity: LabeledSpan, is_start: bool) -> str:
+        return f"[{'' if is_start else '/'}{ENTITY_MARKER}" + (
+            f":{entity.label}]" if self.add_type_to_marker else "]"
+        )
+
+    def construct_entity_markers(self) -> List[str]:
+        # ignore the typing because we know that this is only called on a prepared taskmodule,
+        # i.e. self.entity_labels is already set by _prepare or __init__
+        entity_labels: List[str] = self.entity_labels  # type: ignore
+        entity_markers: Set[str] = set()
+        for is_start in [True, False]:
+            if self.add_type_to_marker:
+                for entity_label in entity_labels:
+                    entity_markers.add(
+                        f"[{'' if is_start else '/'}{ENTITY_MARKER}:{entity_label}]"
+                    )
+            else:
+                entity_markers.add(f"[{'' if is_start else '/'}{ENTITY_MARKER}]")
+        return sorted(entity_markers)
+
+    def _post_prepare(self):
+        self.id_to_label = {v: k for k, v in self.label_to_id.items()}
+        if self.add_entity_markers:
+            self.entity_markers = self.construct_entity_markers()
+            # the tokenizer may share its vocabulary with other instances, so get a private copy first
+            detach_tokenizer(self.tokenizer)
+            self.tokenizer.add_tokens(self.entity_markers, special_tokens=True)
+            self.entity_markers_to_id = {
+                marker: self.tokenizer.vocab[marker] for marker in self.entity_markers
+            }
+
+    def _get_relation_candidates(
+        self, document: Document, entities: Sequence[LabeledSpan]
+    ) -> List[BinaryRelation]:
+        """Get the relation candidates for the given entities (e.g. all entities of a partition
+        that could be mapped to tokens)."""
+        relations: AnnotationLayer[BinaryRelation] = self.get_relation_layer(document)
+        entity_set = set(entities)
+        if not self.create_relation_candidates:
+            candidates = []
+            for relation in relations:
+                if not isinstance(relation, BinaryRelation):
+                    raise NotImplementedError(
+                        f"the taskmodule does not yet support relations of type: {type(relation)}"
+                    )
+                if relation.head in entity_set and relation.tail in entity_set:
+                    candidates.append(relation)
+            return candidates
+
+        arguments_to_relation = {(rel.head, rel.tail): rel for rel in relations}
+        # If there is no relation with the candidate arguments, we create a relation candidate with the
+        # none label. Otherwise, we use the existing relation.
+        return [
+            arguments_to_relation.get(
+                (head, tail),
+                BinaryRelation(head=head, tail=tail, label=self.none_label, score=1.0),
+            )
+            for head in entities
+            for tail in entities
+            if head != tail
+        ]
+
+    def _insert_entity_markers(
+        self,
+        input_ids: Sequence[int],
+        entities: Sequence[LabeledSpan],
+        token_slices: Sequence[Tuple[int, int]],
+    ) -> Tuple[List[int], List[Tuple[int, int]]]:
+        """Insert a start and end marker around each entity and return the new input ids together
+        with the token slices of the entities (including their markers). Markers at the same
+        position are ordered such that nested entities stay nested: end markers come first (inner
+        entities first), then start markers (outer entities first)."""
+        insertions = []
+        for idx, (entity, (start, end)) in enumerate(zip(entities, token_slices)):
+            insertions.append((end, 0, -start, idx, self._get_marker(entity, is_start=False)))
+            insertions.append((start, 1, -end, idx, self._get_marker(entity, is_start=True)))
+        new_input_ids: List[int] = []
+        new_starts: Dict[int, int] = {}
+        new_ends: Dict[int, int] = {}
+        previous_position = 0
+        for position, is_start, _, idx, marker in sorted(insertions):
+            new_input_ids.extend(input_ids[previous_position:position])
+            previous_position = position
+            if is_start:
+                new_starts[idx] = len(new_input_ids)
+            new_input_ids.append(self.entity_markers_to_id[marker])
+            if not is_start:
+                new_ends[idx] = len(new_input_ids)
+        new_input_ids.extend(input_ids[previous_position:])
+        new_token_slices = [(new_starts[idx], new_ends[idx]) for idx in range(len(entities))]
+        return new_input_ids, new_token_slices
+
+    def encode_input(
+        self,
+        document: TextDocument,
+    ) -> Optional[Union[TaskEncodingType, Sequence[TaskEncodingType]]]:
+        entities: AnnotationLayer[LabeledSpan] = self.get_entity_layer(document)
+
+        partitions: Sequence[Span]
+        if self.partition_annotation is not None:
+            partitions = document[self.partition_annotation]
+            if len(partitions) == 0:
+                logger.warning(
+                    f"the document {document.id} has no '{self.partition_annotation}' partition entries, "
+                    f"no inputs will be created!"
+                )
+        else:
+            # use single dummy partition
+            partitions = [Span(start=0, end=len(document.text))]
+
+        task_encodings: List[TaskEncodingType] = []
+        for partition in partitions:
+            text = document.text[partition.start : partition.end]
+            encoding = self.tokenizer(
+                text,
+                padding=False,
+                truncation=self.truncation,
+                max_length=self.max_length,
+                is_split_into_words=False,
+                return_offsets_mapping=False,
+            )
+
+            # map the character spans of the entities in the partition to token spans
+            partition_entities: List[LabeledSpan] = []
+            token_slices: List[Tuple[int, int]] = []
+            for entity in entities:
+                if not is_contained_in(
+                    (entity.start, entity.end), (partition.start, partition.end)
+                ):
+                    continue
+                token_slice = get_token_slice(
+                    character_slice=(entity.start, entity.end),
+                    char_to_token_mapper=encoding.char_to_token,
+                    character_offset=partition.start,
+                )
+                # The mapping may fail (and is None) if the entity start or end does not match a token start
+                # or end, respectively. This also happens if the entity was truncated away.
+                if token_slice is None:
+                    logger.warning(
+                        f"Skipping entity {entity} of document {document.id}, cannot get its token slice"
+                    )
+                    continue
+                partition_entities.append(entity)
+                token_slices.append(token_slice)
+
+            input_ids = list(encoding["input_ids"])
+            if self.add_entity_markers and len(partition_entities) > 0:
+                input_ids, token_slices = self._insert_entity_markers(
+                    input_ids=input_ids, entities=partition_entities, token_slices=token_slices
+                )
+                # the markers may exceed the maximum length, so truncate again (but keep the
+                # final special token)
+                max_length = self.max_length or self.tokenizer.model_max_length
+                if len(input_ids) > max_length:
+                    input_ids = input_ids[: max_length - 1] + input_ids[-1:]
+                    kept = [
+                        idx for idx, (_, end) in enumerate(token_slices) if end <= max_length - 1
+                    ]
+                    partition_entities = [partition_entities[idx] for idx in kept]
+                    token_slices = [token_slices[idx] for idx in kept]
+
+            candidates = self._get_relation_candidates(document, partition_entities)
+            if len(candidates) == 0:
+                continue
+
+            entity_to_idx = {entity: idx for idx, entity in enumerate(partition_entities)}
+            task_encodings.append(
+                TaskEncoding(
+                    document=document,
+                    inputs={
+                        "input_ids": input_ids,
+                        "entity_spans": [list(token_slice) for token_slice in token_slices],
+                        "pair_indices": [
+                            [entity_to_idx[candidate.head], entity_to_idx[candidate.tail]]
+                            for candidate in candidates
+                        ],
+                    },
+                    metadata={"candidate_annotations": candidates},
+                )
+            )
+
+        return task_encodings
+
+    def encode_target(
+        self,
+        task_encoding: TaskEncodingType,
+    ) -> TargetEncodingType:
+        return [
+            self.label_to_id[candidate.label]
+            for candidate in task_encoding.metadata["candidate_annotations"]
+        ]
+
+    def unbatch_output(self, model_output: ModelOutputType) -> Sequence[TaskOutputType]:
+        probabilities = model_output["logits"].softmax(dim=-1).detach().cpu().float().numpy()
+        pair_batch_indices = model_output["pair_batch_indices"].detach().cpu().numpy()
+        label_ids = np.argmax(probabilities, axis=-1)
+
+        batch_size = int(pair_batch_indices.max()) + 1 if len(pair_batch_indices) > 0 else 0
+        unbatched_output: List[TaskOutputType] = [
+            {"labels": [], "probabilities": []} for _ in range(batch_size)
+        ]
+        # the pairs are sorted by batch index, so the outputs are in the order of the candidates
+        for pair_idx, (batch_idx, label_id) in enumerate(zip(pair_batch_indices, label_ids)):
+            result = unbatched_output[batch_idx]
+            result["labels"].append(self.id_to_label[label_id])  # type: ignore
+            result["probabilities"].append(float(probabilities[pair_idx, label_id]))  # type: ignore
+        return unbatched_output
+
+    def create_annotations_from_output(
+        self,
+        task_encoding: TaskEncodingType,
+        task_output: TaskOutputType,
+    ) -> Iterator[Tuple[str, BinaryRelation]]:
+        candidates = task_encoding.metadata["candidate_annotations"]
+        for candidate, label, probability in zip(
+            candidates, task_output["labels"], task_output["probabilities"]
+        ):
+            head = candidate.head
+            tail = candidate.tail
+            # reverse any predicted reversed relations back
+            if self.reversed_relation_label_suffix is not None and label.endswith(
+                self.reversed_relation_label_suffix
+            ):
+                label = label[: -len(self.reversed_relation_label_suffix)]
+                head, tail = tail, head
+            if label != self.none_label:
+                yield self.relation_annotation, BinaryRelation(
+                    head=head, tail=tail, label=label, score=probability
+                )
+
+    def collate(self, task_encodings: Sequence[TaskEncodingType]) -> ModelStepInputType:
+        input_features = [
+            {"input_ids": task_encoding.inputs["input_ids"]} for task_encoding in task_encodings
+        ]
+        inputs = pad_with_tokenizer_config(
+            self.tokenizer,
+            input_features,
+            padding=self.padding,
+            max_length=self.max_length,
+            pad_to_multiple_of=self.pad_to_multiple_of,
+        )
+
+        # The entity spans of all encodings are concatenated to a single (num_entities, 3) array
+        # with the batch index as first column. The pair indices refer to rows of this array.
+        padded_length = inputs["input_ids"].shape[1]
+        entity_spans = []
+        pair_indices = []
+        num_entities = 0
+        for batch_idx, task_encoding in enumerate(task_encodings):
+            spans = np.asarray(task_encoding.inputs["entity_spans"], dtype=np.int64).reshape(-1, 2)
+            if self.tokenizer.padding_side == "left":
+                spans = spans + padded_length - len(task_encoding.inputs["input_ids"])
+            entity_spans.append(np.column_stack([np.full(len(spans), batch_idx), spans]))
+            pairs = np.asarray(task_encoding.inputs["pair_indices"], dtype=np.int64)
+            pair_indices.append(pairs.reshape(-1, 2) + num_entities)
+            num_entities += len(spans)
+        inputs["entity_spans"] = torch.from_numpy(np.concatenate(entity_spans))
+        inputs["pair_indices"] = torch.from_numpy(np.concatenate(pair_indices))
+
+        if not task_encodings[0].has_targets:
+            return inputs, None
+
+        targets = torch.from_numpy(
+            np.concatenate(
+                [
+                    np.asarray(task_encoding.targets, dtype=np.int64)
+                    for task_encoding in task_encodings
+                ]
+            )
+        )
+        return inputs, targets
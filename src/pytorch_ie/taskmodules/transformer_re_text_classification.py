@@ -25,7 +25,6 @@ from typing import (
 import numpy as np
 import torch
 from pie_core import AnnotationLayer, Document, TaskEncoding, TaskModule
-from transformers import AutoTokenizer
 from transformers.file_utils import PaddingStrategy
 from transformers.tokenization_utils_base import TruncationStrategy
 from typing_extensions import TypeAlias
@@ -44,7 +43,9 @@ from pytorch_ie.documents import (
 )
 from pytorch_ie.models.transformer_text_classification import ModelOutputType, ModelStepInputType
 from pytorch_ie.taskmodules.interface import ChangesTokenizerVocabSize
+from pytorch_ie.utils.padding import pad_with_tokenizer_config
 from pytorch_ie.utils.span import get_token_slice, is_contained_in
+from pytorch_ie.utils.tokenizer import detach_tokenizer, get_tokenizer
 from pytorch_ie.utils.window import get_window_around_slice
 
 InputEncodingType: TypeAlias = Dict[str, Any]
@@ -207,7 +208,7 @@ class TransformerRETextClassificationTaskModule(TaskModuleType, ChangesTokenizer
         else:
             self.argument_role_to_marker = argument_role_to_marker
 
-        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name_or_path)
+        self.tokenizer = get_tokenizer(tokenizer_name_or_path)
 
         self.argument_markers = None
 
@@ -289,6 +290,8 @@ class TransformerRETextClassificationTaskModule(TaskModuleType, ChangesTokenizer
 
     def _post_prepare(self):
         self.argument_markers = self.construct_argument_markers()
+        # the tokenizer may share its vocabulary with other instances, so get a private copy first
+        detach_tokenizer(self.tokenizer)
         self.tokenizer.add_tokens(self.argument_markers, special_tokens=True)
 
         self.argument_markers_to_id = {
@@ -618,12 +621,12 @@ class TransformerRETextClassificationTaskModule(TaskModuleType, ChangesTokenizer
     def collate(self, task_encodings: Sequence[TaskEncodingType]) -> ModelStepInputType:
         input_features = [task_encoding.inputs for task_encoding in task_encodings]
 
-        inputs: Dict[str, torch.Tensor] = self.tokenizer.pad(
+        inputs: Dict[str, torch.Tensor] = pad_with_tokenizer_config(
+            self.tokenizer,
             input_features,
             padding=self.padding,
             max_length=self.max_length,
             pad_to_multiple_of=self.pad_to_multiple_of,
-            return_tensors="pt",
         )
 
         if not task_encodings[0].has_targets:
@@ -9,10 +9,23 @@ workflow:
 
 import logging
 import re
-from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Type, Union
-
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
+
+import torch
 from pie_core import Annotation, TaskEncoding, TaskModule
-from transformers import AutoTokenizer
+from transformers import PreTrainedTokenizerFast
 from transformers.file_utils import PaddingStrategy
 from transformers.tokenization_utils_base import TruncationStrategy
 from typing_extensions import TypeAlias
@@ -20,6 +33,13 @@ from typing_extensions import TypeAlias
 from pytorch_ie.annotations import BinaryRelation, LabeledSpan
 from pytorch_ie.documents import TextDocument, TextDocumentWithLabeledSpansAndBinaryRelations
 from pytorch_ie.models.transformer_seq2seq import ModelOutputType, ModelStepInputType
+from pytorch_ie.utils.mention_index import MentionIndex
+from pytorch_ie.utils.padding import (
+    get_padded_length,
+    pad_sequences,
+    pad_with_tokenizer_config,
+)
+from pytorch_ie.utils.tokenizer import get_tokenizer
 
 InputEncodingType: TypeAlias = Dict[str, Sequence[int]]
 TargetEncodingType: TypeAlias = Dict[str, Sequence[int]]
@@ -38,6 +58,11 @@ TaskModuleType: TypeAlias = TaskModule[
 
 logger = logging.getLogger(__name__)
 
+MENTION_ALIGNMENTS = ["first", "closest"]
+
+# tokens that are removed from the decoded strings before parsing the triplets
+IGNORED_TOKENS_REGEX = re.compile("<s>|<pad>|</s>")
+
 
 @TaskModule.register()
 class TransformerSeq2SeqTaskModule(TaskModuleType):
@@ -54,6 +79,10 @@ class TransformerSeq2SeqTaskModule(TaskModuleType):
         max_input_length: Optional[int] = None,
         max_target_length: Optional[int] = None,
         pad_to_multiple_of: Optional[int] = None,
+        mention_alignment: str = "first",
+        partition_annotation: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        chunk_overlap: int = 0,
         **kwargs,
     ) -> None:
         super().__init__(**kwargs)
@@ -66,8 +95,26 @@ class TransformerSeq2SeqTaskModule(TaskModuleType):
         self.max_input_length = max_input_length
         self.max_target_length = max_target_length
         self.pad_to_multiple_of = pad_to_multiple_of
+        if mention_alignment not in MENTION_ALIGNMENTS:
+            raise ValueError(
+                f"mention_alignment has to be one of {MENTION_ALIGNMENTS}, but it is: {mention_alignment}"
+            )
+        # "first": use the first occurrence of head and tail in the text,
+        # "closest": use the occurrences of head and tail that are closest to each other
+        self.mention_alignment = mention_alignment
+        # If partition_annotation and / or chunk_size are set, the documents are split into chunks
+        # (the partitions, e.g. sentences, and / or windows of chunk_size tokens that overlap by
+        # chunk_overlap tokens) which are encoded and decoded individually.
+        if chunk_size is not None and not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(
+                f"chunk_overlap has to be at least 0 and smaller than chunk_size, but it is {chunk_overlap} "
+                f"(chunk_size: {chunk_size})"
+            )
+        self.partition_annotation = partition_annotation
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
 
-        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name_or_path)
+        self.tokenizer = get_tokenizer(tokenizer_name_or_path)
 
     @property
     def document_type(self) -> Optional[Type[TextDocument]]:
@@ -95,18 +142,77 @@ class TransformerSeq2SeqTaskModule(TaskModuleType):
             is_split_into_words=False,
         )
 
+    @property
+    def use_chunks(self) -> bool:
+        return self.partition_annotation is not None or self.chunk_size is not None
+
     def encode_input(
         self,
         document: TextDocument,
     ) -> Optional[Union[TaskEncodingType, Sequence[TaskEncodingType]]]:
+        if self.use_chunks:
+            return self.encode_chunks(document)
         return TaskEncoding(
             document=document,
             inputs=self.encode_text(document.text),
         )
 
+    def encode_chunks(self, document: TextDocument) -> List[TaskEncodingType]:
+        """Create one task encoding per chunk of the document. The character span of the chunk is
+        stored as metadata["chunk_span"]."""
+        if self.partition_annotation is not None:
+            partition_spans = [
+                (partition.start, partition.end)
+                for partition in sorted(
+                    document[self.partition_annotation], key=lambda partition: partition.start
+                )
+            ]
+        else:
+            partition_spans = [(0, len(document.text))]
+
+        task_encodings = []
+        for partition_start, partition_end in partition_spans:
+            # tokenize the partition only once, the chunks are slices of the token ids
+            encoding = self.tokenizer(
+                document.text[partition_start:partition_end],
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+            )
+            input_ids = encoding["input_ids"]
+            offsets = encoding["offset_mapping"]
+            if len(input_ids) == 0:
+                continue
+            if self.chunk_size is not None:
+                chunk_size, chunk_overlap = self.chunk_size, self.chunk_overlap
+            else:
+                chunk_size, chunk_overlap = len(input_ids), 0
+            step = chunk_size - chunk_overlap
+            for token_start in range(0, max(len(input_ids) - chunk_overlap, 1), step):
+                token_end = min(token_start + chunk_size, len(input_ids))
+                inputs = self.tokenizer.prepare_for_model(
+                    input_ids[token_start:token_end],
+                    padding=False,
+                    truncation=self.truncation,
+                    max_length=self.max_input_length,
+                )
+                chunk_span = (
+                    partition_start + offsets[token_start][0],
+                    partition_start + offsets[token_end - 1][1],
+                )
+                task_encodings.append(
+                    TaskEncoding(
+                        document=document,
+                        inputs={key: inputs[key] for key in ["input_ids", "attention_mask"]},
+                        metadata={"chunk_span": chunk_span},
+                    )
+                )
+        return task_encodings
+
     def document_to_target_string(self, document: TextDocument) -> str:
         relations: Sequence[BinaryRelation] = document[self.relation_annotation]
+        return self.relations_to_target_string(document.text, relations)
 
+    def relations_to_target_string(self, text: str, relations: Iterable[BinaryRelation]) -> str:
         head_to_tail_and_label: Dict[LabeledSpan, List[Tuple[LabeledSpan, str]]] = {}
         for relation in relations:
             if not isinstance(relation.head, LabeledSpan) or not isinstance(
@@ -125,7 +231,7 @@ class TransformerSeq2SeqTaskModule(TaskModuleType):
         for head in sorted(head_to_tail_and_label.keys(), key=lambda head: head.start):
             tail_and_label_for_head = head_to_tail_and_label[head]
 
-            head_entity = document.text[head.start : head.end]
+            head_entity = text[head.start : head.end]
 
             lin_triplets.append("<triplet>")
             lin_triplets.append(head_entity)
@@ -133,7 +239,7 @@ class TransformerSeq2SeqTaskModule(TaskModuleType):
             for tail, label in sorted(
                 tail_and_label_for_head, key=lambda tail_and_label: tail_and_label[0].start
             ):
-                tail_entity = document.text[tail.start : tail.end]
+                tail_entity = text[tail.start : tail.end]
 
                 lin_triplets.append("<subj>")
                 lin_triplets.append(tail_entity)
@@ -146,25 +252,73 @@ class TransformerSeq2SeqTaskModule(TaskModuleType):
         self,
         task_encoding: TaskEncodingType,
     ) -> TargetEncodingType:
-        target_string = self.document_to_target_string(task_encoding.document)
+        if "chunk_span" in task_encoding.metadata:
+            # only the relations with both arguments in the chunk are targets
+            chunk_start, chunk_end = task_encoding.metadata["chunk_span"]
+            document = task_encoding.document
+            target_string = self.relations_to_target_string(
+                document.text,
+                [
+                    relation
+                    for relation in document[self.relation_annotation]
+                    if chunk_start <= min(relation.head.start, relation.tail.start)
+                    and max(relation.head.end, relation.tail.end) <= chunk_end
+                ],
+            )
+        else:
+            target_string = self.document_to_target_string(task_encoding.document)
         return {"labels": self.encode_text(target_string)["input_ids"]}
 
     def unbatch_output(self, model_output: ModelOutputType) -> Sequence[TaskOutputType]:
-        unbatched_output = []
-        for out in model_output:
-            decoded_string = self.tokenizer.decode(
-                out, skip_special_tokens=False, clean_up_tokenization_spaces=True
+        sequences = (
+            model_output.tolist() if isinstance(model_output, torch.Tensor) else model_output
+        )
+        # Remove the ignored special tokens on id level (instead of from the decoded strings)
+        # and decode the whole batch in a single call.
+        ignored_ids = {
+            self.tokenizer.bos_token_id,
+            self.tokenizer.eos_token_id,
+            self.tokenizer.pad_token_id,
+        }
+        decoded_strings = self._batch_decode(
+            [
+                [token_id for token_id in sequence if token_id not in ignored_ids]
+                for sequence in sequences
+            ]
+        )
+        return [
+            self._extract_triplets_from_tokens(decoded_string.split())
+            for decoded_string in decoded_strings
+        ]
+
+    def _batch_decode(self, sequences: List[List[int]]) -> List[str]:
+        if isinstance(self.tokenizer, PreTrainedTokenizerFast):
+            # this avoids the per-sequence overhead of batch_decode() of the python wrapper
+            decoded = self.tokenizer.backend_tokenizer.decode_batch(
+                sequences, skip_special_tokens=False
             )
-            triplets = self._extract_triplets(decoded_string)
-            unbatched_output.append(triplets)
-
-        return unbatched_output
+            return [self.tokenizer.clean_up_tokenization(text) for text in decoded]
+        return self.tokenizer.batch_decode(
+            sequences, skip_special_tokens=False, clean_up_tokenization_spaces=True
+        )
 
     def create_annotations_from_output(
         self,
         task_encoding: TaskEncodingType,
         task_output: TaskOutputType,
     ) -> Iterator[Tuple[str, Annotation]]:
+        text = task_encoding.document.text
+        # for chunks, search the mentions only in the chunk and shift the offsets afterwards
+        chunk_start, chunk_end = task_encoding.metadata.get("chunk_span", (0, len(text)))
+        # index all generated mentions at once, this scans the text only a single time
+        mention_index = MentionIndex(
+            text=text[chunk_start:chunk_end],
+            mentions=[
+                mention
+                for relation_dct in task_output
+                for mention in (relation_dct["head"], relation_dct["tail"])
+            ],
+        )
         for relation_dct in task_output:
             head_entity = relation_dct["head"]
             tail_entity = relation_dct["tail"]
@@ -173,24 +327,24 @@ class TransformerSeq2SeqTaskModule(TaskModuleType):
             if label == "no_relation":
                 continue
 
-            # for now, just use the first head and tail match in the document
-            text = task_encoding.document.text.lower()
-            try:
-                # this may fail if head_entity or tail_entity contains any special regex character (e.g. brackets)
-                head_match = re.search(head_entity.lower(), text)
-                tail_match = re.search(tail_entity.lower(), text)
-            except Exception:
-                logger.warning(
-                    f"could not successfully search for the entities in the text, skip the triplet "
-                    f'(head: "{head_entity}", tail: "{tail_entity}", label: "{label}")'
-                )
-                continue
-
-            if head_match is None or tail_match is None:
-                continue
-
-            head = LabeledSpan(start=head_match.start(), end=head_match.end(), label="head")
-            tail = LabeledSpan(start=tail_match.start(), end=tail_match.end(), label="tail")
+            if self.mention_alignment == "closest":
+                head_and_tail = mention_index.find_closest_pair(head_entity, tail_entity)
+                if head_and_tail is None:
+                    continue
+                head_span, tail_span = head_and_tail
+            else:
+                head_span_or_none = mention_index.find_first(head_entity)
+                tail_span_or_none = mention_index.find_first(tail_entity)
+                if head_span_or_none is None or tail_span_or_none is None:
+                    continue
+                head_span, tail_span = head_span_or_none, tail_span_or_none
+
+            head = LabeledSpan(
+                start=chunk_start + head_span[0], end=chunk_start + head_span[1], label="head"
+            )
+            tail = LabeledSpan(
+                start=chunk_start + tail_span[0], end=chunk_start + tail_span[1], label="tail"
+            )
 
             relation = BinaryRelation(head=head, tail=tail, label=label)
 
@@ -200,78 +354,113 @@ class TransformerSeq2SeqTaskModule(TaskModuleType):
                 (self.relation_annotation, relation),
             ]
 
+    def combine_outputs(
+        self,
+        task_encodings: Sequence[TaskEncodingType],
+        task_outputs: Sequence[TaskOutputType],
+    ) -> None:
+        if not self.use_chunks:
+            super().combine_outputs(task_encodings, task_outputs)
+            return
+
+        # Overlapping chunks may result in the same predictions, so add each entity and relation
+        # only once per document. Relations get the already added entities as arguments. Note that
+        # we can not use the annotations itself as keys because attached annotations do not
+        # compare equal to detached ones.
+        added_entities: Dict[int, Dict[Tuple[int, int, str], LabeledSpan]] = {}
+        added_relations: Dict[int, Set[Tuple[Tuple[int, int, str], Tuple[int, int, str], str]]] = (
+            {}
+        )
+        for task_encoding, task_output in zip(task_encodings, task_outputs):
+            document = task_encoding.document
+            document_entities = added_entities.setdefault(id(document), {})
+            document_relations = added_relations.setdefault(id(document), set())
+            for annotation_name, annotation in self.create_annotations_from_output(
+                task_encoding, task_output
+            ):
+                if isinstance(annotation, LabeledSpan):
+                    entity_key = (annotation.start, annotation.end, annotation.label)
+                    if entity_key not in document_entities:
+                        document_entities[entity_key] = annotation
+                        document[annotation_name].predictions.append(annotation)
+                elif isinstance(annotation, BinaryRelation):
+                    head_key = (annotation.head.start, annotation.head.end, annotation.head.label)
+                    tail_key = (annotation.tail.start, annotation.tail.end, annotation.tail.label)
+                    relation_key = (head_key, tail_key, annotation.label)
+                    if relation_key not in document_relations:
+                        document_relations.add(relation_key)
+                        relation = BinaryRelation(
+                            head=document_entities[head_key],
+                            tail=document_entities[tail_key],
+                            label=annotation.label,
+                            score=annotation.score,
+                        )
+                        document[annotation_name].predictions.append(relation)
+                else:
+                    raise TypeError(f"unexpected annotation type: {type(annotation)}")
+
     def collate(self, task_encodings: Sequence[TaskEncodingType]) -> ModelStepInputType:
         input_features = [task_encoding.inputs for task_encoding in task_encodings]
 
-        padded_encoding = self.tokenizer.pad(
+        padded_encoding = pad_with_tokenizer_config(
+            self.tokenizer,
             input_features,
             padding=self.padding,
             max_length=self.max_input_length,
             pad_to_multiple_of=self.pad_to_multiple_of,
-            return_tensors="pt",
         )
 
         if task_encodings[0].has_targets:
-            # TODO: this is a bit of a hack -- fix
-            labels = {
-                "input_ids": [task_encoding.targets["labels"] for task_encoding in task_encodings]
-            }
-
-            padded_labels = self.tokenizer.pad(
+            labels = [task_encoding.targets["labels"] for task_encoding in task_encodings]
+            padded_encoding["labels"] = pad_sequences(
                 labels,
-                padding=self.padding,
-                max_length=self.max_target_length,
-                pad_to_multiple_of=self.pad_to_multiple_of,
-                return_tensors="pt",
+                pad_value=self.tokenizer.pad_token_id,
+                length=get_padded_length(
+                    [len(label_ids) for label_ids in labels],
+                    padding=self.padding,
+                    max_length=self.max_target_length,
+                    pad_to_multiple_of=self.pad_to_multiple_of,
+                ),
+                padding_side=self.tokenizer.padding_side,
             )
 
-            # TODO: this is a bit of a hack -- fix
-            padded_encoding["labels"] = padded_labels["input_ids"]
-
         return (padded_encoding,)
 
-    # TODO: improve this method as soon as we have unittests for this taskmodule
-    def _extract_triplets(self, text) -> TaskOutputType:
+    def _extract_triplets(self, text: str) -> TaskOutputType:
+        tokens = IGNORED_TOKENS_REGEX.sub("", text).split()
+        return self._extract_triplets_from_tokens(tokens)
+
+    def _extract_triplets_from_tokens(self, tokens: Iterable[str]) -> TaskOutputType:
+        """Parse the whitespace separated tokens of the linearized triplets (see
+        `document_to_target_string`) in a single pass."""
         triplets = []
-        relation, subject, relation, object_ = "", "", "", ""
-        text = text.strip()
-        current = "x"
-        for token in text.replace("<s>", "").replace("<pad>", "").replace("</s>", "").split():
+        subject: List[str] = []
+        relation: List[str] = []
+        object_: List[str] = []
+
+        def add_triplet():
+            triplets.append(
+                {"head": " ".join(subject), "type": " ".join(relation), "tail": " ".join(object_)}
+            )
+
+        current = None
+        for token in tokens:
             if token == "<triplet>":
-                current = "t"
-                if relation != "":
-                    triplets.append(
-                        {
-                            "head": subject.strip(),
-                            "type": relation.strip(),
-                            "tail": object_.strip(),
-                        }
-                    )
-                    relation = ""
-                subject = ""
+                if len(relation) > 0:
+                    add_triplet()
+                    relation = []
+                subject = []
+                current = subject
             elif token == "<subj>":
-                current = "s"
-                if relation != "":
-                    triplets.append(
-                        {
-                            "head": subject.strip(),
-                            "type": relation.strip(),
-                            "tail": object_.strip(),
-                        }
-                    )
-                object_ = ""
+                if len(relation) > 0:
+                    add_triplet()
+                object_ = []
+                current = object_
             elif token == "<obj>":
-                current = "o"
-                relation = ""
-            else:
-                if current == "t":
-                    subject += " " + token
-                elif current == "s":
-                    object_ += " " + token
-                elif current == "o":
-                    relation += " " + token
-        if subject != "" and relation != "" and object_ != "":
-            triplets.append(
-                {"head": subject.strip(), "type": relation.strip(), "tail": object_.strip()}
-            )
+                relation = []
+                current = relation
+            elif current is not None:
+                current.append(token)
+        if len(subject) > 0 and len(relation) > 0 and len(object_) > 0:
+            add_triplet()
         return triplets
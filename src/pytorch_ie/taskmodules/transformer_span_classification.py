@@ -14,7 +14,6 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 from pie_core import TaskEncoding, TaskModule
-from transformers import AutoTokenizer
 from transformers.file_utils import PaddingStrategy
 from transformers.tokenization_utils_base import BatchEncoding, TruncationStrategy
 from typing_extensions import TypeAlias
@@ -27,6 +26,8 @@ from pytorch_ie.documents import (
     TextDocumentWithLabeledSpansAndSentences,
 )
 from pytorch_ie.models.transformer_span_classification import ModelOutputType, ModelStepInputType
+from pytorch_ie.utils.padding import pad_with_tokenizer_config
+from pytorch_ie.utils.tokenizer import get_tokenizer
 
 InputEncodingType: TypeAlias = BatchEncoding
 TargetEncodingType: TypeAlias = Sequence[Tuple[int, int, int]]
@@ -78,7 +79,7 @@ class TransformerSpanClassificationTaskModule(TaskModuleType):
                 "Multi-label classification (multi_label=True) is not supported yet."
             )
 
-        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name_or_path)
+        self.tokenizer = get_tokenizer(tokenizer_name_or_path)
         self.entity_annotation = entity_annotation
         self.single_sentence = single_sentence
         self.sentence_annotation = sentence_annotation
@@ -285,12 +286,12 @@ class TransformerSpanClassificationTaskModule(TaskModuleType):
     def collate(self, task_encodings: Sequence[TaskEncodingType]) -> ModelStepInputType:
         input_features = [task_encoding.inputs for task_encoding in task_encodings]
 
-        inputs: Dict[str, torch.Tensor] = self.tokenizer.pad(
+        inputs: Dict[str, torch.Tensor] = pad_with_tokenizer_config(
+            self.tokenizer,
             input_features,
             padding=self.padding,
             max_length=self.max_length,
             pad_to_multiple_of=self.pad_to_multiple_of,
-            return_tensors="pt",
         )
 
         if not task_encodings[0].has_targets:
@@ -300,6 +301,4 @@ class TransformerSpanClassificationTaskModule(TaskModuleType):
             task_encoding.targets for task_encoding in task_encodings
         ]
 
-        inputs = {k: torch.tensor(v, dtype=torch.int64) for k, v in inputs.items()}
-
         return inputs, targets
@@ -25,7 +25,6 @@ from typing import (
 import numpy as np
 import torch
 from pie_core import TaskEncoding, TaskModule
-from transformers import AutoTokenizer
 from transformers.file_utils import PaddingStrategy
 from transformers.tokenization_utils_base import TruncationStrategy
 from typing_extensions import TypeAlias
@@ -33,6 +32,8 @@ from typing_extensions import TypeAlias
 from pytorch_ie.annotations import Label, MultiLabel
 from pytorch_ie.documents import TextDocument, TextDocumentWithLabel, TextDocumentWithMultiLabel
 from pytorch_ie.models.transformer_text_classification import ModelOutputType, ModelStepInputType
+from pytorch_ie.utils.padding import pad_with_tokenizer_config
+from pytorch_ie.utils.tokenizer import get_tokenizer
 
 logger = logging.getLogger(__name__)
 
@@ -96,7 +97,7 @@ class TransformerTextClassificationTaskModule(TaskModuleType):
                 "Multi-label classification (multi_label=True) is not supported yet."
             )
 
-        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name_or_path)
+        self.tokenizer = get_tokenizer(tokenizer_name_or_path)
 
         self.annotation = annotation
         self.label_to_verbalizer = label_to_verbalizer
@@ -237,12 +238,12 @@ class TransformerTextClassificationTaskModule(TaskModuleType):
         metadata = [task_encoding.metadata for task_encoding in task_encodings]
         documents = [task_encoding.document for task_encoding in task_encodings]
 
-        inputs = self.tokenizer.pad(
+        inputs = pad_with_tokenizer_config(
+            self.tokenizer,
             input_features,
             padding=self.padding,
             max_length=self.max_length,
             pad_to_multiple_of=self.pad_to_multiple_of,
-            return_tensors="pt",
         )
 
         if not task_encodings[0].has_targets:
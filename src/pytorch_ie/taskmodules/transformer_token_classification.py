@@ -7,14 +7,14 @@ workflow:
     -> Document
 """
 
-import copy
 import logging
 from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Type, Union
 
+import numpy as np
 import torch
 import torch.nn.functional as F
 from pie_core import TaskEncoding, TaskModule
-from transformers import AutoTokenizer
+from transformers import AutoConfig
 from transformers.file_utils import PaddingStrategy
 from transformers.tokenization_utils_base import BatchEncoding, TruncationStrategy
 from typing_extensions import TypeAlias
@@ -26,13 +26,17 @@ from pytorch_ie.documents import (
     TextDocumentWithLabeledSpansAndLabeledPartitions,
 )
 from pytorch_ie.models.transformer_token_classification import ModelOutputType, ModelStepInputType
+from pytorch_ie.utils.padding import pad_sequences, pad_with_tokenizer_config
 from pytorch_ie.utils.span import (
-    bio_tags_to_spans,
-    convert_span_annotations_to_tag_sequence,
-    get_char_to_token_mapper,
+    TagIdMapping,
+    convert_span_annotations_to_tag_ids,
+    get_char_to_token_mapper_from_offsets,
+    get_special_token_ids,
     get_special_token_mask,
-    has_overlap,
+    is_contained_in,
+    tag_ids_to_spans,
 )
+from pytorch_ie.utils.tokenizer import get_tokenizer
 from pytorch_ie.utils.window import enumerate_windows
 
 InputEncodingType: TypeAlias = Union[Dict[str, Any], BatchEncoding]
@@ -56,6 +60,22 @@ TaskModuleType: TypeAlias = TaskModule[
 
 logger = logging.getLogger(__name__)
 
+# model types whose position ids start at 0
+ZERO_BASED_POSITION_IDS_MODEL_TYPES = {"albert", "bert", "electra", "ernie", "megatron-bert"}
+# model types whose position ids start after the padding index (see
+# transformers.models.roberta.modeling_roberta.create_position_ids_from_input_ids)
+PADDING_OFFSET_POSITION_IDS_MODEL_TYPES = {
+    "camembert",
+    "data2vec-text",
+    "longformer",
+    "mpnet",
+    "roberta",
+    "roberta-prelayernorm",
+    "xlm-roberta",
+    "xlm-roberta-xl",
+    "xmod",
+}
+
 
 @TaskModule.register()
 class TransformerTokenClassificationTaskModule(TaskModuleType):
@@ -76,12 +96,17 @@ class TransformerTokenClassificationTaskModule(TaskModuleType):
         window_overlap: int = 0,
         show_statistics: bool = False,
         include_ill_formed_predictions: bool = True,
+        top_k: int = 1,
+        return_full_probabilities: bool = False,
+        pack_partitions: bool = False,
+        block_diagonal_attention: bool = False,
+        position_ids_start: Optional[Union[int, str]] = "auto",
         **kwargs,
     ) -> None:
         super().__init__(**kwargs)
         self.save_hyperparameters()
 
-        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name_or_path)
+        self.tokenizer = get_tokenizer(tokenizer_name_or_path)
         self.entity_annotation = entity_annotation
         self.partition_annotation = partition_annotation
         if label_to_id is not None:
@@ -95,6 +120,47 @@ class TransformerTokenClassificationTaskModule(TaskModuleType):
         self.window_overlap = window_overlap
         self.show_statistics = show_statistics
         self.include_ill_formed_predictions = include_ill_formed_predictions
+        if top_k < 1:
+            raise ValueError(f"top_k has to be at least 1, but it is {top_k}")
+        self.top_k = top_k
+        self.return_full_probabilities = return_full_probabilities
+        if pack_partitions:
+            if partition_annotation is None or max_length is None:
+                raise ValueError(
+                    "pack_partitions requires partition_annotation and max_length to be set"
+                )
+            if max_window is not None:
+                raise ValueError("pack_partitions can not be combined with max_window")
+        elif block_diagonal_attention:
+            raise ValueError("block_diagonal_attention requires pack_partitions=True")
+        self.pack_partitions = pack_partitions
+        self.block_diagonal_attention = block_diagonal_attention
+        if block_diagonal_attention and position_ids_start == "auto":
+            position_ids_start = self._get_default_position_ids_start(tokenizer_name_or_path)
+        self.position_ids_start = position_ids_start
+
+    def _get_default_position_ids_start(self, tokenizer_name_or_path: str) -> int:
+        """Derive the first position id of the model from its config (the model is expected to
+        have the same name as the tokenizer)."""
+        try:
+            model_type = AutoConfig.from_pretrained(tokenizer_name_or_path).model_type
+        except (OSError, ValueError):
+            model_type = None
+        if model_type in ZERO_BASED_POSITION_IDS_MODEL_TYPES:
+            return 0
+        if model_type in PADDING_OFFSET_POSITION_IDS_MODEL_TYPES:
+            if self.tokenizer.pad_token_id is None:
+                raise ValueError(
+                    f"can not derive position_ids_start for {tokenizer_name_or_path} (model type "
+                    f"{model_type}) because the tokenizer has no pad_token_id, please set it "
+                    f"explicitly"
+                )
+            return self.tokenizer.pad_token_id + 1
+        raise ValueError(
+            f"can not derive position_ids_start for {tokenizer_name_or_path} (model type: "
+            f"{model_type}), please set it explicitly: 0 for BERT-like models, padding_idx + 1 "
+            f"for RoBERTa-like models, or None to not add position_ids"
+        )
 
     @property
     def document_type(self) -> Optional[Type[TextDocument]]:
@@ -131,6 +197,7 @@ class TransformerTokenClassificationTaskModule(TaskModuleType):
 
     def _post_prepare(self):
         self.id_to_label = {v: k for k, v in self.label_to_id.items()}
+        self.tag_id_mapping = TagIdMapping.from_label_to_id(self.label_to_id)
 
     def encode_text(
         self, text, partition: Optional[Span] = None, add_special_tokens: bool = True
@@ -154,12 +221,18 @@ class TransformerTokenClassificationTaskModule(TaskModuleType):
         self,
         document: TextDocument,
     ) -> Optional[Union[TaskEncodingType, Sequence[TaskEncodingType]]]:
+        if self.pack_partitions:
+            return self.encode_packed_partitions(document)
+
         partitions: Sequence[Optional[Span]]
         if self.partition_annotation is not None:
             partitions = document[self.partition_annotation]
         else:
             partitions = [None]
 
+        special_ids = (
+            get_special_token_ids(self.tokenizer) if self.max_window is not None else None
+        )
         task_encodings: List[TaskEncodingType] = []
         for partition_index, partition in enumerate(partitions):
             add_special_tokens = self.max_window is None
@@ -167,16 +240,14 @@ class TransformerTokenClassificationTaskModule(TaskModuleType):
                 text=document.text, partition=partition, add_special_tokens=add_special_tokens
             )
 
-            metadata = {
-                "offset_mapping": inputs.pop("offset_mapping"),
-                "special_tokens_mask": inputs.pop("special_tokens_mask"),
-                "char_to_token_mapper": inputs.char_to_token,
-            }
-
-            if partition is not None:
-                metadata["sentence_index"] = partition_index
-
             if self.max_window is None:
+                metadata = {
+                    "offset_mapping": inputs.pop("offset_mapping"),
+                    "special_tokens_mask": inputs.pop("special_tokens_mask"),
+                    "char_to_token_mapper": inputs.char_to_token,
+                }
+                if partition is not None:
+                    metadata["sentence_index"] = partition_index
                 task_encodings.append(
                     TaskEncoding(
                         document=document,
@@ -185,7 +256,10 @@ class TransformerTokenClassificationTaskModule(TaskModuleType):
                     )
                 )
             else:
-                offset_mapping = metadata.pop("offset_mapping")
+                # The offsets of the whole partition are shared by the char-to-token mappers of all windows.
+                offsets = np.asarray(inputs["offset_mapping"], dtype=np.int32).reshape(-1, 2)
+                token_starts = np.ascontiguousarray(offsets[:, 0])
+                token_ends = np.ascontiguousarray(offsets[:, 1])
                 # The actual number of tokens will be lower than max_window because we add the default special
                 # tokens later on (e.g. CLS and SEP).
                 max_window = self.max_window - self.tokenizer.num_special_tokens_to_add()
@@ -198,40 +272,37 @@ class TransformerTokenClassificationTaskModule(TaskModuleType):
                         token_ids_0=token_ids[start_idx:end_idx]
                     )
                     new_special_tokens_mask = get_special_token_mask(
-                        token_ids_0=new_input_ids, tokenizer=self.tokenizer
+                        token_ids_0=new_input_ids,
+                        tokenizer=self.tokenizer,
+                        special_ids=special_ids,
                     )
                     window_inputs = {"input_ids": new_input_ids}
-                    # for now, we copy just to keep "sentence_index"
-                    window_metadata = copy.deepcopy(metadata)
-                    window_metadata["special_tokens_mask"] = new_special_tokens_mask
-                    offset_mapping_without_special_tokens = offset_mapping[start_idx:end_idx]
-                    j = 0
-                    current_offset_mapping: List[Tuple[int, int]] = []
                     # this maps from positions without special tokens to positions with special tokens
-                    position_with_special_tokens = {}
-                    for i, is_special_token in enumerate(new_special_tokens_mask):
-                        if is_special_token:
-                            current_offset_mapping.append((0, 0))
-                        else:
-                            position_with_special_tokens[j] = i
-                            current_offset_mapping.append(offset_mapping_without_special_tokens[j])
-                            j += 1
-                    window_metadata["offset_mapping"] = current_offset_mapping
-                    char_to_token_mapping: Dict[int, int] = {}
-                    for token_idx, (char_start, char_end) in enumerate(current_offset_mapping):
-                        for char_idx in range(char_start, char_end):
-                            char_to_token_mapping[char_idx] = token_idx
-                    window_metadata["char_to_token_mapper"] = get_char_to_token_mapper(
-                        char_to_token_mapping=char_to_token_mapping,
-                        char_start=offset_mapping_without_special_tokens[0][0],
-                        char_end=offset_mapping_without_special_tokens[-1][1],
-                    )
-                    # new_metadata["window_tokens"] = token_slice
-                    window_metadata["window_labels"] = (
-                        position_with_special_tokens[label_offset_slice[0]],
-                        # we have to look up the actual index, not the pythonic end position
-                        position_with_special_tokens[label_offset_slice[1] - 1] + 1,
+                    token_positions = np.flatnonzero(
+                        np.asarray(new_special_tokens_mask, dtype=bool) == 0
                     )
+                    # special tokens get the offsets (0, 0)
+                    window_offset_mapping = np.zeros((len(new_input_ids), 2), dtype=np.int32)
+                    window_offset_mapping[token_positions] = offsets[start_idx:end_idx]
+                    window_metadata = {
+                        "special_tokens_mask": new_special_tokens_mask,
+                        "offset_mapping": window_offset_mapping,
+                        "char_to_token_mapper": get_char_to_token_mapper_from_offsets(
+                            token_starts=token_starts,
+                            token_ends=token_ends,
+                            token_slice=token_slice,
+                            token_positions=token_positions,
+                            char_start=int(token_starts[start_idx]),
+                            char_end=int(token_ends[end_idx - 1]),
+                        ),
+                        "window_labels": (
+                            int(token_positions[label_offset_slice[0]]),
+                            # we have to look up the actual index, not the pythonic end position
+                            int(token_positions[label_offset_slice[1] - 1]) + 1,
+                        ),
+                    }
+                    if partition is not None:
+                        window_metadata["sentence_index"] = partition_index
 
                     task_encodings.append(
                         TaskEncoding(
@@ -243,6 +314,73 @@ class TransformerTokenClassificationTaskModule(TaskModuleType):
 
         return task_encodings
 
+    def encode_packed_partitions(self, document: TextDocument) -> List[TaskEncodingType]:
+        """Encode each partition individually (including special tokens) and greedily concatenate
+        consecutive partitions into sequences of at most max_length tokens. Partitions that are
+        longer than max_length get their own sequence.
+
+        The metadata of a packed sequence contains the offset mapping (with respect to the
+        document text) and the special tokens mask of the whole sequence as well as the
+        "segments", i.e. (partition index, token start, token end) for each contained partition.
+        """
+        partitions: Sequence[Span] = document[self.partition_annotation]
+        partition_indices = sorted(
+            range(len(partitions)), key=lambda idx: (partitions[idx].start, partitions[idx].end)
+        )
+        encoded_partitions = []
+        for partition_index in partition_indices:
+            partition = partitions[partition_index]
+            inputs = self.encode_text(text=document.text, partition=partition)
+            encoded_partitions.append((partition_index, partition, inputs))
+
+        packs: List[List[Tuple[int, Span, BatchEncoding]]] = []
+        current_length = 0
+        for encoded_partition in encoded_partitions:
+            length = len(encoded_partition[2]["input_ids"])
+            if len(packs) == 0 or current_length + length > self.max_length:
+                packs.append([])
+                current_length = 0
+            packs[-1].append(encoded_partition)
+            current_length += length
+
+        task_encodings: List[TaskEncodingType] = []
+        for pack in packs:
+            inputs: Dict[str, List[int]] = {}
+            special_tokens_mask: List[int] = []
+            offset_mappings = []
+            segments: List[Tuple[int, int, int]] = []
+            for partition_index, partition, partition_inputs in pack:
+                start = len(special_tokens_mask)
+                for key in partition_inputs.keys():
+                    if key not in ("offset_mapping", "special_tokens_mask"):
+                        inputs.setdefault(key, []).extend(partition_inputs[key])
+                special_tokens_mask.extend(partition_inputs["special_tokens_mask"])
+                offset_mappings.append(
+                    np.asarray(partition_inputs["offset_mapping"], dtype=np.int32).reshape(-1, 2)
+                    + partition.start
+                )
+                segments.append((partition_index, start, len(special_tokens_mask)))
+
+            offset_mapping = np.concatenate(offset_mappings)
+            is_special = np.asarray(special_tokens_mask, dtype=bool)
+            offset_mapping[is_special] = 0
+            token_positions = np.flatnonzero(~is_special)
+            metadata = {
+                "offset_mapping": offset_mapping,
+                "special_tokens_mask": special_tokens_mask,
+                "char_to_token_mapper": get_char_to_token_mapper_from_offsets(
+                    token_starts=np.ascontiguousarray(offset_mapping[token_positions, 0]),
+                    token_ends=np.ascontiguousarray(offset_mapping[token_positions, 1]),
+                    token_positions=token_positions,
+                ),
+                "segments": segments,
+            }
+            task_encodings.append(
+                TaskEncoding(document=document, inputs=inputs, metadata=metadata)
+            )
+
+        return task_encodings
+
     def encode_target(
         self,
         task_encoding: TaskEncodingType,
@@ -253,44 +391,91 @@ class TransformerTokenClassificationTaskModule(TaskModuleType):
         entities: Sequence[LabeledSpan] = document[self.entity_annotation]
 
         partition = None
-        if self.partition_annotation is not None:
+        if "segments" in metadata:
+            # packed partitions: only consider entities that are fully contained in one of them
+            partitions = document[self.partition_annotation]
+            segment_partitions = [partitions[segment[0]] for segment in metadata["segments"]]
+            pack_start = min(p.start for p in segment_partitions)
+            pack_end = max(p.end for p in segment_partitions)
+            entities = [
+                entity
+                for entity in entities
+                if pack_start <= entity.start
+                and entity.end <= pack_end
+                and any(
+                    is_contained_in((entity.start, entity.end), (p.start, p.end))
+                    for p in segment_partitions
+                )
+            ]
+        elif self.partition_annotation is not None:
             partition_index = metadata["sentence_index"]
             partitions = document[self.partition_annotation]
             partition = partitions[partition_index]
-        tag_sequence_or_none = convert_span_annotations_to_tag_sequence(
+        tag_ids = convert_span_annotations_to_tag_ids(
             spans=entities,
             special_tokens_mask=metadata["special_tokens_mask"],
             char_to_token_mapper=metadata["char_to_token_mapper"],
+            tag_id_mapping=self.tag_id_mapping,
+            special_token_tag_id=self.label_pad_token_id,
             partition=partition,
             statistics=None,
         )
-        if tag_sequence_or_none is None:
+        if tag_ids is None:
             logger.warning(
                 f"can not create targets for document with id: {getattr(document, 'id', None)}, skip it"
             )
             return None
-        else:
-            tag_sequence = tag_sequence_or_none
 
         # exclude labels that are out of the window (when overlap is used)
         window_labels = metadata.get("window_labels")
         if window_labels is not None:
-            tag_sequence[0 : window_labels[0]] = [None] * window_labels[0]
-            tag_sequence[window_labels[1] :] = [None] * len(tag_sequence[window_labels[1] :])
+            tag_ids[: window_labels[0]] = self.label_pad_token_id
+            tag_ids[window_labels[1] :] = self.label_pad_token_id
 
-        targets = [
-            self.label_to_id[tag] if tag is not None else self.label_pad_token_id
-            for tag in tag_sequence
-        ]
+        targets = tag_ids.tolist()
 
         return targets
 
     def unbatch_output(self, model_output: ModelOutputType) -> Sequence[TaskOutputType]:
-        logits = model_output["logits"]
-        probabilities = F.softmax(logits, dim=-1).detach().cpu().float().numpy()
-        indices = torch.argmax(logits, dim=-1).detach().cpu().numpy()
-        tags = [[self.id_to_label[e] for e in b] for b in indices]
-        return [{"tags": t, "probabilities": p} for t, p in zip(tags, probabilities)]
+        """Convert the logits into per-sequence task outputs with compact arrays:
+
+        - "tag_ids": the argmax tag ids (int16, shape: [seq_len]),
+        - "tag_probabilities": their probabilities (float16, shape: [seq_len]),
+        - if top_k > 1, "top_k_tag_ids" and "top_k_probabilities" (shape: [seq_len, top_k]),
+        - if return_full_probabilities is enabled, the full distribution over all tags as
+          "probabilities" (float32, shape: [seq_len, num_tags]).
+
+        The reduction is done with torch on the device of the logits before moving the result to
+        the CPU, so the full probability matrix is only kept if explicitly requested.
+        """
+        logits = model_output["logits"].detach()
+        probabilities = F.softmax(logits.float(), dim=-1)
+        num_tags = probabilities.shape[-1]
+        id_dtype = torch.int16 if num_tags <= torch.iinfo(torch.int16).max else torch.int32
+        top_k = min(self.top_k, num_tags)
+        if top_k > 1:
+            top_probabilities, top_tag_ids = torch.topk(probabilities, k=top_k, dim=-1)
+        else:
+            top_probabilities, top_tag_ids = torch.max(probabilities, dim=-1, keepdim=True)
+        top_tag_ids_np = top_tag_ids.to(id_dtype).cpu().numpy()
+        top_probabilities_np = top_probabilities.half().cpu().numpy()
+        full_probabilities = (
+            probabilities.cpu().numpy() if self.return_full_probabilities else None
+        )
+
+        result: List[TaskOutputType] = []
+        for i in range(len(top_tag_ids_np)):
+            task_output = {
+                "tag_ids": top_tag_ids_np[i, :, 0],
+                "tag_probabilities": top_probabilities_np[i, :, 0],
+            }
+            if top_k > 1:
+                task_output["top_k_tag_ids"] = top_tag_ids_np[i]
+                task_output["top_k_probabilities"] = top_probabilities_np[i]
+            if full_probabilities is not None:
+                task_output["probabilities"] = full_probabilities[i]
+            result.append(task_output)
+        return result
 
     def create_annotations_from_output(
         self,
@@ -298,46 +483,48 @@ class TransformerTokenClassificationTaskModule(TaskModuleType):
         task_output: TaskOutputType,
     ) -> Iterator[Tuple[str, LabeledSpan]]:
         offset = 0
-        if self.partition_annotation is not None:
+        # the offsets of packed partitions are already relative to the document text
+        if self.partition_annotation is not None and "segments" not in task_encoding.metadata:
             partitions = task_encoding.document[self.partition_annotation]
             offset = partitions[task_encoding.metadata["sentence_index"]].start
 
-        tag_sequence = [
-            "O" if is_special_token else tag
-            for tag, is_special_token in zip(
-                task_output["tags"], task_encoding.metadata["special_tokens_mask"]
-            )
-        ]
-
-        spans = bio_tags_to_spans(
-            tag_sequence, include_ill_formed=self.include_ill_formed_predictions
+        metadata = task_encoding.metadata
+        spans = tag_ids_to_spans(
+            task_output["tag_ids"],
+            tag_id_mapping=self.tag_id_mapping,
+            include_ill_formed=self.include_ill_formed_predictions,
+            # this also splits the predictions of packed partitions at the segment boundaries
+            mask=metadata["special_tokens_mask"],
         )
-        for label, (start, end) in spans:
-            if "window_labels" in task_encoding.metadata:
-                # Take only spans into account that are at least partly in the window. The model was not
-                # trained to correctly predict spans that are just in the context.
-                # NOTE: The "end" index is exclusive, but encoding.metadata["window_labels"][1] is inclusive!
-                if not has_overlap((start, end + 1), task_encoding.metadata["window_labels"]):
-                    continue
+        if "window_labels" in metadata:
+            # Take only spans into account that are at least partly in the window. The model was not
+            # trained to correctly predict spans that are just in the context.
+            # NOTE: The "end" index is inclusive, but metadata["window_labels"][1] is exclusive!
+            window_start, window_end = metadata["window_labels"]
+            spans = spans[(spans[:, 1] < window_end) & (spans[:, 2] >= window_start)]
+        offset_mapping = metadata["offset_mapping"]
+        for label_index, start, end in spans.tolist():
             yield (
                 self.entity_annotation,
                 LabeledSpan(
-                    task_encoding.metadata["offset_mapping"][start][0] + offset,
-                    task_encoding.metadata["offset_mapping"][end][1] + offset,
-                    label,
+                    int(offset_mapping[start][0]) + offset,
+                    int(offset_mapping[end][1]) + offset,
+                    self.tag_id_mapping.labels[label_index],
                 ),
             )
 
     def collate(self, task_encodings: Sequence[TaskEncodingType]) -> ModelStepInputType:
         input_features = [task_encoding.inputs for task_encoding in task_encodings]
 
-        inputs = self.tokenizer.pad(
+        inputs = pad_with_tokenizer_config(
+            self.tokenizer,
             input_features,
             padding=self.padding,
             max_length=self.max_length,
             pad_to_multiple_of=self.pad_to_multiple_of,
-            return_tensors="pt",
         )
+        if self.block_diagonal_attention:
+            self._add_block_diagonal_attention(inputs, task_encodings)
 
         if not task_encodings[0].has_targets:
             return inputs, None
@@ -346,19 +533,43 @@ class TransformerTokenClassificationTaskModule(TaskModuleType):
             task_encoding.targets for task_encoding in task_encodings
         ]
 
-        sequence_length = inputs["input_ids"].shape[1]
-        padding_side = self.tokenizer.padding_side
-        if padding_side == "right":
-            target_list_padded = [
-                list(t) + [self.label_pad_token_id] * (sequence_length - len(t))
-                for t in target_list
-            ]
-        else:
-            target_list_padded = [
-                [self.label_pad_token_id] * (sequence_length - len(t)) + list(t)
-                for t in target_list
-            ]
-
-        targets = torch.tensor(target_list_padded, dtype=torch.int64)
+        targets = pad_sequences(
+            target_list,
+            pad_value=self.label_pad_token_id,
+            length=inputs["input_ids"].shape[1],
+            padding_side=self.tokenizer.padding_side,
+        )
 
         return inputs, targets
+
+    def _add_block_diagonal_attention(
+        self, inputs: BatchEncoding, task_encodings: Sequence[TaskEncodingType]
+    ) -> None:
+        """Replace the attention mask with a 3D mask that allows the tokens to attend only to
+        tokens of the same packed segment. If position_ids_start is not None, also add position
+        ids that restart at position_ids_start at each segment (padding gets position_ids_start).
+
+        This requires a model that accepts a 3D attention_mask and, unless position_ids_start is
+        None, position_ids, e.g. BERT-like models (position_ids_start=0) or RoBERTa-like models
+        (position_ids_start=padding_idx + 1, i.e. 2). By default ("auto"), position_ids_start is
+        derived from the model type in the config of tokenizer_name_or_path and an error is
+        raised if that is not possible. Models that expect a 2D attention mask or do not have a
+        position_ids argument (e.g. DistilBERT) are not supported. Note that without position
+        ids, the positions do not restart at each segment.
+        """
+        batch_size, sequence_length = inputs["input_ids"].shape
+        # segment index for each position, -1 for padding
+        segment_ids = np.full((batch_size, sequence_length), -1, dtype=np.int64)
+        position_ids = np.full((batch_size, sequence_length), self.position_ids_start or 0)
+        for batch_idx, task_encoding in enumerate(task_encodings):
+            length = len(task_encoding.inputs["input_ids"])
+            shift = 0 if self.tokenizer.padding_side == "right" else sequence_length - length
+            for segment_idx, (_, start, end) in enumerate(task_encoding.metadata["segments"]):
+                segment_ids[batch_idx, shift + start : shift + end] = segment_idx
+                position_ids[batch_idx, shift + start : shift + end] += np.arange(end - start)
+        attention_mask = (segment_ids[:, :, None] == segment_ids[:, None, :]) & (
+            segment_ids[:, :, None] >= 0
+        )
+        inputs["attention_mask"] = torch.from_numpy(attention_mask.astype(np.int64))
+        if self.position_ids_start is not None:
+            inputs["position_ids"] = torch.from_numpy(position_ids.astype(np.int64))
@@ -0,0 +1,256 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from pie_core import Annotation, Document, TaskEncoding
+from transformers import BatchEncoding
+
+from pytorch_ie.utils.parallel_encoding import (
+    AnnotationReference,
+    _get_annotation_references,
+    _map_annotations,
+)
+from pytorch_ie.utils.span import get_char_to_token_mapper_from_offsets
+
+INT32_INFO = np.iinfo(np.int32)
+
+# metadata entries that are converted to int32 arrays (in addition to all inputs and targets)
+COMPACT_METADATA_KEYS = ("offset_mapping", "special_tokens_mask")
+
+
+def to_int32_array(value: Any) -> Any:
+    """Convert a (possibly nested) list or array of integers to an int32 array. Anything else
+    (e.g. empty or ragged lists, floats, booleans or integers that do not fit into int32) is
+    returned unchanged."""
+    if isinstance(value, np.ndarray):
+        array = value
+    elif isinstance(value, (list, tuple)) and len(value) > 0:
+        try:
+            array = np.asarray(value)
+        except ValueError:
+            # ragged nested lists
+            return value
+    else:
+        return value
+    if array.dtype.kind not in "iu" or array.ndim > 2:
+        return value
+    if array.size > 0 and (array.min() < INT32_INFO.min or array.max() > INT32_INFO.max):
+        return value
+    return np.ascontiguousarray(array, dtype=np.int32)
+
+
+def _compact_inputs(inputs: Any) -> Any:
+    if isinstance(inputs, (dict, BatchEncoding)):
+        # note that this converts a BatchEncoding into a plain dict, i.e. it drops the encodings
+        # of the (fast) tokenizer that are much larger than the ids
+        return {key: to_int32_array(value) for key, value in inputs.items()}
+    return to_int32_array(inputs)
+
+
+def _compact_targets(targets: Any, inputs: Any) -> Any:
+    # Only convert token level targets (e.g. tag ids) that are aligned with the input_ids. Other
+    # targets (e.g. a single label id or a list of label tuples) are small and collate() may
+    # expect them to be plain lists.
+    if not isinstance(inputs, (dict, BatchEncoding)) or "input_ids" not in inputs:
+        return targets
+    if isinstance(targets, (list, np.ndarray)) and len(targets) == len(inputs["input_ids"]):
+        return to_int32_array(targets)
+    return targets
+
+
+def _compact_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    result = dict(metadata)
+    for key in COMPACT_METADATA_KEYS:
+        if key in result:
+            result[key] = to_int32_array(result[key])
+    char_to_token_mapper = result.get("char_to_token_mapper")
+    if (
+        isinstance(getattr(char_to_token_mapper, "__self__", None), BatchEncoding)
+        and "offset_mapping" in result
+        and "special_tokens_mask" in result
+    ):
+        # The bound char_to_token method keeps the whole BatchEncoding alive. Replace it with an
+        # equivalent mapper that is based on the offsets of the (non-special) tokens.
+        offset_mapping = np.asarray(result["offset_mapping"], dtype=np.int32).reshape(-1, 2)
+        token_positions = np.flatnonzero(
+            np.asarray(result["special_tokens_mask"], dtype=bool) == 0
+        ).astype(np.int32)
+        result["char_to_token_mapper"] = get_char_to_token_mapper_from_offsets(
+            token_starts=np.ascontiguousarray(offset_mapping[token_positions, 0]),
+            token_ends=np.ascontiguousarray(offset_mapping[token_positions, 1]),
+            token_positions=token_positions,
+        )
+    return result
+
+
+class CompactTaskEncoding:
+    """A memory efficient replacement for TaskEncoding with the same interface. It stores the
+    fields in __slots__ instead of a __dict__ (that is why it does not subclass TaskEncoding) and
+    holds the document only as an index into a document table that is shared between all
+    encodings created by compact_task_encodings(). The table is not pickled, so sending an
+    encoding to another process (e.g. a dataloader worker) does not also send the document.
+
+    Annotations of the document in the metadata (e.g. the candidate relation of a relation
+    classification taskmodule) would also reference the document. They are stored as references
+    (layer and index, see AnnotationReference) and are resolved when the metadata is accessed
+    while the document is available. Note that the document of an unpickled encoding is not
+    available until the table is re-attached with attach_document_table(). Until then, the
+    metadata contains the AnnotationReferences.
+    """
+
+    __slots__ = (
+        "inputs",
+        "_targets",
+        "_metadata",
+        "_resolved_metadata",
+        "document_index",
+        "_document_table",
+        "_reference_cache",
+    )
+
+    def __init__(
+        self,
+        inputs: Any,
+        targets: Any = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        document_index: Optional[int] = None,
+        document_table: Optional[Sequence[Document]] = None,
+        reference_cache: Optional[Dict[int, Dict[int, AnnotationReference]]] = None,
+    ) -> None:
+        self.inputs = inputs
+        self._targets = targets
+        self.document_index = document_index
+        self._document_table = document_table
+        # the annotation references per document index, shared by the encodings of a table
+        self._reference_cache = reference_cache if reference_cache is not None else {}
+        self.metadata = metadata or {}
+
+    @property
+    def has_targets(self) -> bool:
+        return self._targets is not None
+
+    @property
+    def targets(self) -> Any:
+        if self._targets is None:
+            raise ValueError("task encoding has no targets.")
+        return self._targets
+
+    @targets.setter
+    def targets(self, value) -> None:
+        self._targets = value
+
+    @property
+    def has_document(self) -> bool:
+        return self.document_index is not None and self._document_table is not None
+
+    @property
+    def document(self) -> Document:
+        if self.document_index is None:
+            raise ValueError("task encoding has no document.")
+        if self._document_table is None:
+            raise ValueError(
+                "the document table of the task encoding is not available (it is not pickled, "
+                "use attach_document_table() to restore it)"
+            )
+        return self._document_table[self.document_index]
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        if self._resolved_metadata is None:
+            if not self.has_document:
+                return self._metadata
+            document = self.document
+
+            def from_reference(reference: Any) -> Optional[Annotation]:
+                if isinstance(reference, AnnotationReference):
+                    layer = getattr(document, reference.layer)
+                    annotations = layer.predictions if reference.is_prediction else layer
+                    return annotations[reference.index]
+                return None
+
+            self._resolved_metadata = _map_annotations(self._metadata, from_reference)
+        return self._resolved_metadata
+
+    @metadata.setter
+    def metadata(self, value: Dict[str, Any]) -> None:
+        self._resolved_metadata = value
+        self._metadata = self._to_references(value)
+
+    def _to_references(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.has_document:
+            return metadata
+        document_index: int = self.document_index  # type: ignore
+        if document_index not in self._reference_cache:
+            self._reference_cache[document_index] = _get_annotation_references(self.document)
+        references = self._reference_cache[document_index]
+
+        def to_reference(annotation: Annotation) -> Optional[AnnotationReference]:
+            return references.get(id(annotation))
+
+        return _map_annotations(metadata, to_reference)
+
+    def attach_document_table(
+        self,
+        document_table: Sequence[Document],
+        reference_cache: Optional[Dict[int, Dict[int, AnnotationReference]]] = None,
+    ) -> None:
+        self._document_table = document_table
+        self._reference_cache = reference_cache if reference_cache is not None else {}
+        self._resolved_metadata = None
+
+    def __getstate__(self):
+        # the resolved metadata may have been modified, so convert it (back) to references
+        metadata = self._metadata
+        if self._resolved_metadata is not None:
+            metadata = self._to_references(self._resolved_metadata)
+        return self.inputs, self._targets, metadata, self.document_index
+
+    def __setstate__(self, state) -> None:
+        self.inputs, self._targets, self._metadata, self.document_index = state
+        self._resolved_metadata = None
+        self._document_table = None
+        self._reference_cache = {}
+
+
+def compact_task_encodings(
+    task_encodings: Iterable[TaskEncoding], documents: Optional[Sequence[Document]] = None
+) -> List[CompactTaskEncoding]:
+    """Convert task encodings into CompactTaskEncodings: all integer inputs, token level targets
+    and the offset_mapping and special_tokens_mask in the metadata are stored as int32 arrays,
+    and the document is referenced by its index in a shared document table.
+
+    The documents are used as the document table, if provided (all encoded documents need to be
+    contained). Otherwise, the table is created from the documents of the task encodings.
+    Annotations of the documents in the metadata are stored as references (see
+    CompactTaskEncoding), other metadata entries are kept as they are.
+
+    Args:
+        task_encodings: The task encodings to convert.
+        documents: The documents that were encoded.
+    """
+    document_table: List[Document] = list(documents) if documents is not None else []
+    document2idx = {id(document): idx for idx, document in enumerate(document_table)}
+    reference_cache: Dict[int, Dict[int, AnnotationReference]] = {}
+    result = []
+    for task_encoding in task_encodings:
+        document_index = None
+        document = task_encoding._document
+        if document is not None:
+            if id(document) not in document2idx:
+                if documents is not None:
+                    raise ValueError(
+                        "the document of a task encoding is not contained in the documents"
+                    )
+                document2idx[id(document)] = len(document_table)
+                document_table.append(document)
+            document_index = document2idx[id(document)]
+        result.append(
+            CompactTaskEncoding(
+                inputs=_compact_inputs(task_encoding.inputs),
+                targets=_compact_targets(task_encoding._targets, task_encoding.inputs),
+                metadata=_compact_metadata(task_encoding.metadata),
+                document_index=document_index,
+                document_table=document_table,
+                reference_cache=reference_cache,
+            )
+        )
+    return result
@@ -0,0 +1,420 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+from collections import UserDict
+from collections.abc import Sequence
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union, overload
+
+import numpy as np
+import torch
+from pie_core import Annotation, Document, TaskEncoding, TaskModule
+
+from pytorch_ie.utils.parallel_encoding import (
+    AnnotationReference,
+    _get_annotation_references,
+    _map_annotations,
+)
+from pytorch_ie.utils.span import get_char_to_token_mapper_from_offsets
+
+logger = logging.getLogger(__name__)
+
+# increase this if the format of the cache files changes
+CACHE_FORMAT_VERSION = 2
+MANIFEST_FILE_NAME = "manifest.json"
+OBJECTS_FILE_NAME = "objects.pkl"
+
+# The fields of the task encodings that may be stored as (memory-mapped) arrays. The inputs and
+# targets can be either an array-like itself or a dictionary of array-likes, the metadata is a
+# dictionary (e.g. with the offset_mapping and special_tokens_mask of the tokenizer).
+ENCODING_PARTS = ["inputs", "targets", "metadata"]
+
+
+def _hash_json(obj: Any) -> str:
+    # default=str is required for non-serializable values, e.g. the label_to_id of some taskmodules
+    # has int keys that are handled by json, but enums or tuples are not
+    dumped = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.blake2b(dumped.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get_documents_fingerprint(documents: Iterable[Document]) -> str:
+    """Get a fingerprint of the documents. If the documents are a (Huggingface based) dataset
+    that has a _fingerprint, it is used. Otherwise, the serialized content of all documents is
+    hashed."""
+    fingerprint = getattr(documents, "_fingerprint", None)
+    if fingerprint is not None:
+        return str(fingerprint)
+    hasher = hashlib.blake2b(digest_size=16)
+    for document in documents:
+        hasher.update(json.dumps(document.asdict(), sort_keys=True, default=str).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def get_encoding_fingerprint(
+    taskmodule: TaskModule, documents: Iterable[Document], **encode_kwargs
+) -> str:
+    """Get a fingerprint for the result of taskmodule.encode(documents, **encode_kwargs) that is
+    used as key for the encoding cache. It takes the taskmodule config (including the prepared
+    attributes), the documents and the encode arguments into account."""
+    return _hash_json(
+        {
+            "version": CACHE_FORMAT_VERSION,
+            "taskmodule_class": f"{type(taskmodule).__module__}.{type(taskmodule).__qualname__}",
+            "taskmodule_config": taskmodule._config(),
+            "documents": get_documents_fingerprint(documents),
+            "encode_kwargs": encode_kwargs,
+        }
+    )
+
+
+def _to_array(value: Any) -> Optional[Tuple[np.ndarray, str]]:
+    """Convert the value to a numpy array, if possible, and return it together with its original
+    kind ("tensor", "ndarray", "list" or "tuples", i.e. a list of tuples of numbers such as an
+    offset mapping)."""
+    if isinstance(value, torch.Tensor):
+        return value.detach().cpu().numpy(), "tensor"
+    if isinstance(value, np.ndarray):
+        return value, "ndarray"
+    if isinstance(value, list) and len(value) > 0 and all(isinstance(e, tuple) for e in value):
+        try:
+            array = np.asarray(value)
+        except (ValueError, TypeError):
+            return None
+        if array.ndim != 2 or array.dtype.kind not in "biuf":
+            return None
+        return array, "tuples"
+    if isinstance(value, list):
+        # only flat lists of numbers because nested lists may be ragged or contain tuples
+        if any(isinstance(entry, (list, tuple)) for entry in value):
+            return None
+        try:
+            array = np.asarray(value)
+        except (ValueError, TypeError):
+            return None
+        return array, "list"
+    return None
+
+
+def _get_part(task_encoding: TaskEncoding, part_name: str) -> Any:
+    if part_name == "metadata":
+        return _get_metadata_to_save(task_encoding.metadata)
+    # do not use task_encoding.targets because it raises an exception if there are no targets
+    return task_encoding._targets if part_name == "targets" else task_encoding.inputs
+
+
+def _can_rebuild_char_to_token_mapper(metadata: Dict[str, Any]) -> bool:
+    return (
+        "char_to_token_mapper" in metadata
+        and "offset_mapping" in metadata
+        and "special_tokens_mask" in metadata
+    )
+
+
+def _get_metadata_to_save(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    # the char_to_token_mapper may reference the whole tokenizer output (e.g. a bound method of a
+    # BatchEncoding), so it is not saved, but rebuilt from the offsets when loading
+    if _can_rebuild_char_to_token_mapper(metadata):
+        metadata = {key: value for key, value in metadata.items() if key != "char_to_token_mapper"}
+        metadata["char_to_token_mapper"] = None
+    return metadata
+
+
+def _rebuild_char_to_token_mapper(metadata: Dict[str, Any]) -> None:
+    offsets = np.asarray(metadata["offset_mapping"], dtype=np.int64).reshape(-1, 2)
+    token_positions = np.flatnonzero(np.asarray(metadata["special_tokens_mask"]) == 0)
+    token_starts = np.ascontiguousarray(offsets[token_positions, 0])
+    token_ends = np.ascontiguousarray(offsets[token_positions, 1])
+    char_start, char_end = None, None
+    if "window_labels" in metadata and len(token_positions) > 0:
+        # the characters outside of a window are mapped to -1 (before) and -2 (after)
+        char_start, char_end = int(token_starts[0]), int(token_ends[-1])
+    metadata["char_to_token_mapper"] = get_char_to_token_mapper_from_offsets(
+        token_starts=token_starts,
+        token_ends=token_ends,
+        token_positions=token_positions,
+        char_start=char_start,
+        char_end=char_end,
+    )
+
+
+def _is_compatible(array: np.ndarray, kind: str, field_info: Dict[str, Any]) -> bool:
+    return (
+        kind == field_info["kind"]
+        and array.ndim == len(field_info["trailing_shape"]) + 1
+        and list(array.shape[1:]) == field_info["trailing_shape"]
+        and array.dtype.kind in "biuf"
+    )
+
+
+def save_task_encodings(
+    task_encodings: Sequence[TaskEncoding],
+    path: str,
+    documents: Optional[Sequence[Document]] = None,
+    fingerprint: Optional[str] = None,
+) -> None:
+    """Save the task encodings to the directory path.
+
+    Array-like inputs and targets (or array-like values of dictionary inputs and targets, e.g.
+    input_ids) and array-like metadata values (e.g. offset_mapping) are concatenated per field and
+    saved as numpy files that can be memory-mapped. All other content is pickled. If documents are
+    given, the index of the document of each task encoding is stored, so that the documents can be
+    re-attached when loading the encodings, and the annotations of the documents (e.g. candidate
+    relations in the metadata) are stored as references (layer and index, see
+    AnnotationReference), so the pickled content does not contain the documents. A
+    char_to_token_mapper in the metadata is not saved, but rebuilt from the offset_mapping and
+    special_tokens_mask when loading.
+
+    The files are written to a temporary directory that is moved to path when all files are
+    written, so a cache directory that exists is always complete.
+    """
+    document2idx: Dict[int, int] = {}
+    if documents is not None:
+        document2idx = {id(document): idx for idx, document in enumerate(documents)}
+    references: Dict[int, Dict[int, AnnotationReference]] = {}
+
+    # find the fields that can be stored as arrays for all task encodings
+    fields: Dict[str, Dict[str, Any]] = {}
+    invalid_fields = set()
+    for task_encoding in task_encodings:
+        for part_name in ENCODING_PARTS:
+            part = _get_part(task_encoding, part_name)
+            if part is None:
+                continue
+            # candidate fields are keyed by the dictionary key or None, if the part is array-like
+            candidates = part if isinstance(part, (dict, UserDict)) else {None: part}
+            for key, value in candidates.items():
+                field_name = part_name if key is None else f"{part_name}/{key}"
+                if field_name in invalid_fields:
+                    continue
+                converted = _to_array(value)
+                if converted is None or converted[0].ndim == 0:
+                    invalid_fields.add(field_name)
+                    continue
+                array, kind = converted
+                field_info = fields.get(field_name)
+                if field_info is None:
+                    field_info = {
+                        "kind": kind,
+                        "trailing_shape": list(array.shape[1:]),
+                        "dtype": set(),
+                        "count": 0,
+                    }
+                    fields[field_name] = field_info
+                if not _is_compatible(array, kind, field_info):
+                    invalid_fields.add(field_name)
+                    continue
+                field_info["count"] += 1
+                # empty lists are converted to float arrays, so ignore their dtype
+                if array.size > 0 or kind != "list":
+                    field_info["dtype"].add(array.dtype)
+    for field_name, field_info in list(fields.items()):
+        # the field needs to be present in all task encodings (e.g. not only in the ones with
+        # targets or only in some of the input dictionaries)
+        if field_name in invalid_fields or field_info.pop("count") != len(task_encodings):
+            del fields[field_name]
+            continue
+        dtypes = field_info["dtype"]
+        field_info["dtype"] = np.result_type(*dtypes).str if len(dtypes) > 0 else "<i8"
+
+    parent_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent_dir, prefix=".tmp-")
+    try:
+        field_arrays: Dict[str, List[np.ndarray]] = {field_name: [] for field_name in fields}
+        objects: List[Dict[str, Any]] = []
+        for task_encoding in task_encodings:
+            document_idx = document2idx.get(id(task_encoding._document), -1)
+            obj: Dict[str, Any] = {"document_index": document_idx}
+            for part_name in ENCODING_PARTS:
+                part = _get_part(task_encoding, part_name)
+                if isinstance(part, (dict, UserDict)):
+                    if not isinstance(part, dict):
+                        # e.g. a BatchEncoding, which is restored without the tokenizer output
+                        obj[f"{part_name}_type"] = type(part)
+                    remaining = {}
+                    for key, value in part.items():
+                        field_name = f"{part_name}/{key}"
+                        if field_name in fields:
+                            field_arrays[field_name].append(_to_array(value)[0])  # type: ignore
+                        else:
+                            remaining[key] = value
+                    obj[part_name] = remaining
+                    obj[f"{part_name}_keys"] = list(part)
+                elif part_name in fields:
+                    field_arrays[part_name].append(_to_array(part)[0])  # type: ignore
+                else:
+                    obj[part_name] = part
+            if document_idx >= 0:
+                if document_idx not in references:
+                    references[document_idx] = _get_annotation_references(task_encoding._document)
+                document_references = references[document_idx]
+
+                def to_reference(annotation: Annotation) -> Optional[AnnotationReference]:
+                    return document_references.get(id(annotation))
+
+                obj = _map_annotations(obj, to_reference)
+            objects.append(obj)
+
+        for field_name, arrays in field_arrays.items():
+            field_info = fields[field_name]
+            lengths = np.asarray([len(array) for array in arrays], dtype=np.int64)
+            offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            values = np.empty(
+                (int(offsets[-1]), *field_info["trailing_shape"]), dtype=field_info["dtype"]
+            )
+            for array, start, end in zip(arrays, offsets[:-1], offsets[1:]):
+                values[start:end] = array
+            file_name = field_name.replace("/", ".")
+            np.save(os.path.join(tmp_path, f"{file_name}.values.npy"), values)
+            np.save(os.path.join(tmp_path, f"{file_name}.offsets.npy"), offsets)
+            field_info["file_name"] = file_name
+
+        with open(os.path.join(tmp_path, OBJECTS_FILE_NAME), "wb") as f:
+            pickle.dump(objects, f, protocol=pickle.HIGHEST_PROTOCOL)
+        manifest = {
+            "version": CACHE_FORMAT_VERSION,
+            "fingerprint": fingerprint,
+            "num_encodings": len(task_encodings),
+            "fields": fields,
+        }
+        with open(os.path.join(tmp_path, MANIFEST_FILE_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def is_cached(path: str, fingerprint: Optional[str] = None) -> bool:
+    """Check if path contains complete cached task encodings (with the given fingerprint)."""
+    manifest_path = os.path.join(path, MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_path):
+        return False
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    return manifest.get("version") == CACHE_FORMAT_VERSION and (
+        fingerprint is None or manifest.get("fingerprint") == fingerprint
+    )
+
+
+class CachedTaskEncodingSequence(Sequence):
+    """A sequence of task encodings that were saved with save_task_encodings(). The array fields
+    are memory-mapped, so loading the sequence is fast and the data is shared between all
+    processes that use it (e.g. the ranks of a distributed training or dataloader workers).
+
+    The task encodings are created on access. If documents are given, they are re-attached to the
+    task encodings and the annotation references are resolved, otherwise the task encodings have
+    no document (and annotations of the documents remain AnnotationReferences).
+    """
+
+    def __init__(self, path: str, documents: Optional[Sequence[Document]] = None):
+        self.path = path
+        self.documents = documents
+        with open(os.path.join(path, MANIFEST_FILE_NAME)) as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, OBJECTS_FILE_NAME), "rb") as f:
+            self._objects: List[Dict[str, Any]] = pickle.load(f)
+        self._arrays: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]] = None
+
+    @property
+    def arrays(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        # open the memory maps lazily, e.g. in the dataloader workers
+        if self._arrays is None:
+            self._arrays = {
+                field_name: (
+                    np.load(
+                        os.path.join(self.path, f"{field_info['file_name']}.values.npy"),
+                        mmap_mode="r",
+                    ),
+                    np.load(os.path.join(self.path, f"{field_info['file_name']}.offsets.npy")),
+                )
+                for field_name, field_info in self.manifest["fields"].items()
+            }
+        return self._arrays
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # do not pickle the memory maps because this would copy their content
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        return state
+
+    def _get_field(self, field_name: str, idx: int) -> Any:
+        values, offsets = self.arrays[field_name]
+        array = np.array(values[offsets[idx] : offsets[idx + 1]])
+        kind = self.manifest["fields"][field_name]["kind"]
+        if kind == "tensor":
+            return torch.from_numpy(array)
+        if kind == "list":
+            return array.tolist()
+        if kind == "tuples":
+            return [tuple(row) for row in array.tolist()]
+        return array
+
+    def _get_task_encoding(self, idx: int) -> TaskEncoding:
+        obj = self._objects[idx]
+        document = None
+        if self.documents is not None and obj["document_index"] >= 0:
+            document = self.documents[obj["document_index"]]
+
+            def from_reference(reference: Any) -> Optional[Annotation]:
+                if isinstance(reference, AnnotationReference):
+                    layer = getattr(document, reference.layer)
+                    annotations = layer.predictions if reference.is_prediction else layer
+                    return annotations[reference.index]
+                return None
+
+            obj = _map_annotations(obj, from_reference)
+        parts: Dict[str, Any] = {}
+        for part_name in ENCODING_PARTS:
+            if f"{part_name}_keys" in obj:
+                remaining = obj[part_name]
+                parts[part_name] = {
+                    key: (
+                        remaining[key]
+                        if key in remaining
+                        else self._get_field(f"{part_name}/{key}", idx)
+                    )
+                    for key in obj[f"{part_name}_keys"]
+                }
+                if f"{part_name}_type" in obj:
+                    parts[part_name] = obj[f"{part_name}_type"](parts[part_name])
+            elif part_name in self.manifest["fields"]:
+                parts[part_name] = self._get_field(part_name, idx)
+            else:
+                parts[part_name] = obj[part_name]
+        metadata = parts["metadata"]
+        if metadata.get("char_to_token_mapper", False) is None and (
+            _can_rebuild_char_to_token_mapper(metadata)
+        ):
+            _rebuild_char_to_token_mapper(metadata)
+        return TaskEncoding(
+            inputs=parts["inputs"],
+            targets=parts["targets"],
+            document=document,
+            metadata=metadata,
+        )
+
+    @overload
+    def __getitem__(self, index: int) -> TaskEncoding: ...
+
+    @overload
+    def __getitem__(self, s: slice) -> List[TaskEncoding]: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[TaskEncoding, List[TaskEncoding]]:
+        if isinstance(index, slice):
+            return [self._get_task_encoding(idx) for idx in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"index {index} is out of range")
+        return self._get_task_encoding(index)
+
+    def __len__(self) -> int:
+        return self.manifest["num_encodings"]
@@ -0,0 +1,122 @@
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CharSpan = Tuple[int, int]
+
+
+def normalize_text(text: str) -> Tuple[str, List[int]]:
+    """Lowercase the text and collapse all whitespace runs into a single space. Also return, for
+    each character of the normalized text, the index of the respective character in the original
+    text."""
+    normalized: List[str] = []
+    positions: List[int] = []
+    previous_is_space = False
+    for idx, char in enumerate(text):
+        if char.isspace():
+            if previous_is_space:
+                continue
+            previous_is_space = True
+            char = " "
+        else:
+            previous_is_space = False
+        # lowercasing may result in multiple characters (e.g. for "İ")
+        for lowercased_char in char.lower():
+            normalized.append(lowercased_char)
+            positions.append(idx)
+    return "".join(normalized), positions
+
+
+def normalize_mention(mention: str) -> str:
+    return normalize_text(mention.strip())[0]
+
+
+class MentionIndex:
+    """Index of all occurrences of a set of mentions (surface strings) in a text.
+
+    Mentions and text are compared after normalization (lowercasing, whitespace collapsing, see
+    `normalize_text`). All mentions are searched at once with an Aho-Corasick automaton, i.e. the
+    text is scanned only once, independent of the number of mentions. Afterwards, each lookup is
+    just a dictionary access. Mentions are matched literally, no characters have a special meaning.
+    """
+
+    def __init__(self, text: str, mentions: Iterable[str]):
+        patterns = {normalize_mention(mention) for mention in mentions}
+        patterns.discard("")
+        normalized_text, positions = normalize_text(text)
+        self._occurrences: Dict[str, List[CharSpan]] = {pattern: [] for pattern in patterns}
+        for pattern, start, end in _aho_corasick_search(normalized_text, patterns):
+            # map back to the original text, the end is exclusive
+            self._occurrences[pattern].append((positions[start], positions[end - 1] + 1))
+
+    def find_all(self, mention: str) -> List[CharSpan]:
+        """Return all occurrences of the mention as (start, end) character offsets, sorted by
+        start."""
+        return self._occurrences.get(normalize_mention(mention), [])
+
+    def find_first(self, mention: str) -> Optional[CharSpan]:
+        occurrences = self.find_all(mention)
+        return occurrences[0] if len(occurrences) > 0 else None
+
+    def find_closest_pair(
+        self, mention: str, other_mention: str
+    ) -> Optional[Tuple[CharSpan, CharSpan]]:
+        """Return the occurrences of both mentions that are closest to each other (with respect to
+        their start offsets). If multiple pairs have the same distance, the first one is used."""
+        occurrences = self.find_all(mention)
+        other_occurrences = self.find_all(other_mention)
+        if len(occurrences) == 0 or len(other_occurrences) == 0:
+            return None
+        # both lists are sorted by start, so we can walk through them in parallel
+        best: Optional[Tuple[CharSpan, CharSpan]] = None
+        best_distance = -1
+        i, j = 0, 0
+        while i < len(occurrences) and j < len(other_occurrences):
+            distance = abs(occurrences[i][0] - other_occurrences[j][0])
+            if best is None or distance < best_distance:
+                best = (occurrences[i], other_occurrences[j])
+                best_distance = distance
+            if occurrences[i][0] < other_occurrences[j][0]:
+                i += 1
+            else:
+                j += 1
+        return best
+
+
+def _aho_corasick_search(text: str, patterns: Iterable[str]) -> Iterable[Tuple[str, int, int]]:
+    """Find all (possibly overlapping) occurrences of the patterns in the text. Yields (pattern,
+    start, end) ordered by end and, for the same end, by decreasing pattern length."""
+    # trie: node -> {char: child node}, node 0 is the root
+    transitions: List[Dict[str, int]] = [{}]
+    outputs: List[List[str]] = [[]]
+    for pattern in patterns:
+        node = 0
+        for char in pattern:
+            next_node = transitions[node].get(char)
+            if next_node is None:
+                next_node = len(transitions)
+                transitions[node][char] = next_node
+                transitions.append({})
+                outputs.append([])
+            node = next_node
+        outputs[node].append(pattern)
+
+    # failure links via breadth-first search, the outputs of the failure node are merged in
+    failure = [0] * len(transitions)
+    queue = deque(transitions[0].values())
+    while queue:
+        node = queue.popleft()
+        for char, child in transitions[node].items():
+            queue.append(child)
+            fallback = failure[node]
+            while fallback and char not in transitions[fallback]:
+                fallback = failure[fallback]
+            failure[child] = transitions[fallback].get(char, 0)
+            outputs[child] = outputs[child] + outputs[failure[child]]
+
+    node = 0
+    for idx, char in enumerate(text):
+        while node and char not in transitions[node]:
+            node = failure[node]
+        node = transitions[node].get(char, 0)
+        for pattern in outputs[node]:
+            yield pattern, idx + 1 - len(pattern), idx + 1
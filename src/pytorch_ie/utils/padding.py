@@ -0,0 +1,158 @@
+from typing import Any, Dict, Mapping, Optional, Sequence, Union
+
+import numpy as np
+import torch
+from transformers import BatchEncoding, PreTrainedTokenizer
+from transformers.file_utils import PaddingStrategy
+
+
+def get_padded_length(
+    lengths: Sequence[int],
+    padding: Union[bool, str, PaddingStrategy] = True,
+    max_length: Optional[int] = None,
+    pad_to_multiple_of: Optional[int] = None,
+) -> int:
+    """Get the length to pad sequences with the given lengths to. This follows the padding
+    strategies of tokenizer.pad(): pad to the longest sequence (padding=True or "longest"), to
+    max_length (padding="max_length") or not at all (padding=False or "do_not_pad", requires all
+    sequences to have the same length). If padding is enabled, the length is rounded up to a
+    multiple of pad_to_multiple_of. Note that sequences are never truncated, so the result is at
+    least the maximum length of the sequences.
+    """
+    if padding is True:
+        strategy = PaddingStrategy.LONGEST
+    elif padding is False:
+        strategy = PaddingStrategy.DO_NOT_PAD
+    else:
+        strategy = PaddingStrategy(padding)
+
+    longest = max(lengths, default=0)
+    if strategy == PaddingStrategy.DO_NOT_PAD:
+        if any(length != longest for length in lengths):
+            raise ValueError(
+                "all sequences need to have the same length if padding is disabled, but got "
+                f"lengths {sorted(set(lengths))}"
+            )
+        return longest
+    if strategy == PaddingStrategy.MAX_LENGTH:
+        if max_length is None:
+            raise ValueError("max_length is required for padding='max_length'")
+        length = max(longest, max_length)
+    else:
+        length = longest
+    if pad_to_multiple_of is not None and length % pad_to_multiple_of != 0:
+        length = (length // pad_to_multiple_of + 1) * pad_to_multiple_of
+    return length
+
+
+def _get_padding_mask(lengths: np.ndarray, length: int, padding_side: str) -> np.ndarray:
+    positions = np.arange(length)
+    if padding_side == "right":
+        return positions[None, :] < lengths[:, None]
+    elif padding_side == "left":
+        return positions[None, :] >= (length - lengths)[:, None]
+    else:
+        raise ValueError(f"padding_side must be 'right' or 'left', but got {padding_side}")
+
+
+def pad_sequences(
+    sequences: Sequence[Any],
+    pad_value: int,
+    length: Optional[int] = None,
+    padding_side: str = "right",
+) -> torch.Tensor:
+    """Pad sequences of integers (lists or arrays) to a single int64 tensor of shape
+    (len(sequences), length). The values are written in one step into the preallocated result
+    (instead of padding each sequence separately). If length is None, the sequences are padded
+    to the longest one.
+    """
+    lengths = np.fromiter((len(sequence) for sequence in sequences), dtype=np.int64)
+    if length is None:
+        length = int(lengths.max(initial=0))
+    elif np.any(lengths > length):
+        raise ValueError(f"can not pad sequences of length {lengths.max()} to length {length}")
+    result = np.full((len(sequences), length), pad_value, dtype=np.int64)
+    mask = _get_padding_mask(lengths, length, padding_side)
+    if lengths.sum() > 0:
+        result[mask] = np.concatenate(
+            [np.asarray(sequence, dtype=np.int64).reshape(-1) for sequence in sequences]
+        )
+    return torch.from_numpy(result)
+
+
+def pad_features(
+    features: Sequence[Mapping[str, Any]],
+    pad_values: Mapping[str, int],
+    padding: Union[bool, str, PaddingStrategy] = True,
+    max_length: Optional[int] = None,
+    pad_to_multiple_of: Optional[int] = None,
+    padding_side: str = "right",
+    return_attention_mask: bool = True,
+) -> Dict[str, torch.Tensor]:
+    """Pad a list of feature dicts (e.g. the inputs of task encodings) to a dict of int64
+    tensors. The entries with a key in pad_values are padded with the respective value, all other
+    entries are stacked as they are. If return_attention_mask is True and the features do not
+    contain an attention_mask, it is created. See get_padded_length() for the padding options.
+    """
+    if len(features) == 0:
+        raise ValueError("can not pad an empty list of features")
+    keys = list(features[0].keys())
+    padded_keys = [key for key in keys if key in pad_values]
+    if len(padded_keys) == 0:
+        raise ValueError(f"none of the features {keys} can be padded")
+    lengths = [len(feature[padded_keys[0]]) for feature in features]
+    length = get_padded_length(
+        lengths, padding=padding, max_length=max_length, pad_to_multiple_of=pad_to_multiple_of
+    )
+    result: Dict[str, torch.Tensor] = {}
+    for key in keys:
+        values = [feature[key] for feature in features]
+        if key in pad_values:
+            result[key] = pad_sequences(
+                values, pad_value=pad_values[key], length=length, padding_side=padding_side
+            )
+        else:
+            result[key] = torch.as_tensor(np.asarray(values))
+    if return_attention_mask and "attention_mask" not in result:
+        mask = _get_padding_mask(np.asarray(lengths, dtype=np.int64), length, padding_side)
+        result["attention_mask"] = torch.from_numpy(mask.astype(np.int64))
+    return result
+
+
+def get_tokenizer_pad_values(tokenizer: PreTrainedTokenizer) -> Dict[str, int]:
+    """Get the values to pad the tokenizer outputs with (as tokenizer.pad() does)."""
+    pad_values: Dict[str, int] = {
+        "attention_mask": 0,
+        "token_type_ids": tokenizer.pad_token_type_id,
+        "special_tokens_mask": 1,
+    }
+    if tokenizer.pad_token_id is not None:
+        pad_values["input_ids"] = tokenizer.pad_token_id
+    return pad_values
+
+
+def pad_with_tokenizer_config(
+    tokenizer: PreTrainedTokenizer,
+    features: Sequence[Mapping[str, Any]],
+    padding: Union[bool, str, PaddingStrategy] = True,
+    max_length: Optional[int] = None,
+    pad_to_multiple_of: Optional[int] = None,
+) -> BatchEncoding:
+    """A fast replacement for tokenizer.pad(features, ..., return_tensors="pt"). It uses the pad
+    values, the padding side and the model input names of the tokenizer, but pads all features
+    in one step with pad_features(). The features may contain lists or (int32) arrays.
+    """
+    if "input_ids" in features[0] and tokenizer.pad_token_id is None:
+        raise ValueError("the tokenizer has no pad token, so the input_ids can not be padded")
+    if max_length is None and padding == PaddingStrategy.MAX_LENGTH:
+        max_length = tokenizer.model_max_length
+    padded = pad_features(
+        features,
+        pad_values=get_tokenizer_pad_values(tokenizer),
+        padding=padding,
+        max_length=max_length,
+        pad_to_multiple_of=pad_to_multiple_of,
+        padding_side=tokenizer.padding_side,
+        return_attention_mask="attention_mask" in tokenizer.model_input_names,
+    )
+    return BatchEncoding(padded)
@@ -0,0 +1,233 @@
+import dataclasses
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from pie_core import Annotation, Document, TaskEncoding, TaskModule
+
+# the taskmodule of the worker process, see _init_worker()
+_WORKER_TASKMODULE: Optional[TaskModule] = None
+
+
+class AnnotationReference(NamedTuple):
+    """A reference to an annotation of the encoded document by its layer and index. It replaces
+    the annotation when sending a task encoding from a worker process back to the main process,
+    because a pickled annotation would also contain its targets, i.e. the whole document."""
+
+    layer: str
+    is_prediction: bool
+    index: int
+
+
+# encoded task encoding: (document index, inputs, targets, metadata)
+EncodedTaskEncoding = Tuple[int, Any, Any, Dict[str, Any]]
+
+
+def _get_annotation_references(document: Document) -> Dict[int, AnnotationReference]:
+    references = {}
+    for field in document.annotation_fields():
+        layer = getattr(document, field.name)
+        for is_prediction, annotations in [(False, layer), (True, layer.predictions)]:
+            for idx, annotation in enumerate(annotations):
+                references[id(annotation)] = AnnotationReference(field.name, is_prediction, idx)
+    return references
+
+
+def _map_annotations(obj: Any, func) -> Any:
+    """Apply func to all annotations in obj (which may be nested in lists, tuples, dicts and
+    fields of other annotations). func returns either a replacement or None to recurse into the
+    fields of the annotation."""
+    if isinstance(obj, (Annotation, AnnotationReference)):
+        replacement = func(obj)
+        if replacement is not None:
+            return replacement
+        if isinstance(obj, AnnotationReference):
+            return obj
+        changes = {}
+        for field in dataclasses.fields(obj):
+            if not field.init:
+                continue
+            value = getattr(obj, field.name)
+            new_value = _map_annotations(value, func)
+            if new_value is not value:
+                changes[field.name] = new_value
+        return dataclasses.replace(obj, **changes) if len(changes) > 0 else obj
+    if isinstance(obj, list):
+        new_list = [_map_annotations(entry, func) for entry in obj]
+        return obj if all(a is b for a, b in zip(new_list, obj)) else new_list
+    if isinstance(obj, tuple) and not hasattr(obj, "_fields"):
+        new_tuple = tuple(_map_annotations(entry, func) for entry in obj)
+        return obj if all(a is b for a, b in zip(new_tuple, obj)) else new_tuple
+    if isinstance(obj, dict):
+        new_dict = {key: _map_annotations(value, func) for key, value in obj.items()}
+        return obj if all(new_dict[key] is value for key, value in obj.items()) else new_dict
+    return obj
+
+
+def _init_worker(taskmodule: TaskModule) -> None:
+    global _WORKER_TASKMODULE
+    _WORKER_TASKMODULE = taskmodule
+
+
+def _encode_shard(
+    documents: Sequence[Document], offset: int, encode_target: bool
+) -> Tuple[List[EncodedTaskEncoding], List[int]]:
+    """Encode the documents in a worker process and return the task encodings without the
+    documents (which are referenced by their index, shifted by offset) and the indices of the
+    documents in order."""
+    taskmodule = _WORKER_TASKMODULE
+    if taskmodule is None:
+        raise RuntimeError("the worker process was not initialized with a taskmodule")
+    task_encodings, documents_in_order = taskmodule.batch_encode(
+        documents=documents, encode_target=encode_target
+    )
+    document2idx = {id(document): idx for idx, document in enumerate(documents)}
+    references: Dict[int, Dict[int, AnnotationReference]] = {}
+
+    encoded: List[EncodedTaskEncoding] = []
+    for task_encoding in task_encodings:
+        document = task_encoding.document
+        if id(document) not in document2idx:
+            raise ValueError(
+                "the task encodings need to reference the encoded documents to be sent back from "
+                "the worker processes"
+            )
+        document_idx = document2idx[id(document)]
+        if document_idx not in references:
+            references[document_idx] = _get_annotation_references(document)
+        document_references = references[document_idx]
+
+        def to_reference(annotation: Annotation) -> Optional[AnnotationReference]:
+            return document_references.get(id(annotation))
+
+        encoded.append(
+            (
+                offset + document_idx,
+                _map_annotations(task_encoding.inputs, to_reference),
+                _map_annotations(task_encoding._targets, to_reference),
+                _map_annotations(task_encoding.metadata, to_reference),
+            )
+        )
+    documents_in_order_indices = [
+        offset + document2idx[id(document)] for document in documents_in_order
+    ]
+    return encoded, documents_in_order_indices
+
+
+def _count_shard(documents: Sequence[Document], encode_target: bool) -> List[int]:
+    """Get the number of task encodings of each document in a worker process, see
+    count_encodings_in_parallel()."""
+    taskmodule = _WORKER_TASKMODULE
+    if taskmodule is None:
+        raise RuntimeError("the worker process was not initialized with a taskmodule")
+    counts = []
+    for document in documents:
+        task_encodings, _ = taskmodule.encode_inputs([document])
+        if encode_target:
+            task_encodings = taskmodule.encode_targets(task_encodings)
+        counts.append(len(task_encodings))
+    return counts
+
+
+def _get_shards(
+    documents: Sequence[Document], num_shards: int
+) -> Tuple[List[Sequence[Document]], List[int]]:
+    shard_size = max(math.ceil(len(documents) / num_shards), 1)
+    offsets = list(range(0, len(documents), shard_size))
+    return [documents[offset : offset + shard_size] for offset in offsets], offsets
+
+
+def count_encodings_in_parallel(
+    taskmodule: TaskModule,
+    documents: Sequence[Document],
+    num_workers: int,
+    encode_target: bool = False,
+    num_shards: Optional[int] = None,
+) -> List[int]:
+    """Get the number of task encodings of each document with a pool of worker processes. Each
+    document is encoded on its own (as by a LazyTaskEncodingDataset) and only the counts are sent
+    back to the main process. The on_encode_start() and on_encode_end() hooks are not called.
+
+    Args:
+        taskmodule: The (prepared) taskmodule.
+        documents: The documents to encode.
+        num_workers: The number of worker processes.
+        encode_target: Whether to encode the targets, i.e. to not count encodings without target.
+        num_shards: The number of shards. Defaults to four shards per worker to balance the load.
+    """
+    taskmodule.assert_is_prepared()
+    if num_shards is None:
+        num_shards = num_workers * 4
+    shards, _ = _get_shards(documents, num_shards)
+    with ProcessPoolExecutor(
+        max_workers=num_workers, initializer=_init_worker, initargs=(taskmodule,)
+    ) as executor:
+        results = executor.map(_count_shard, shards, [encode_target] * len(shards))
+        return [count for counts in results for count in counts]
+
+
+def encode_in_parallel(
+    taskmodule: TaskModule,
+    documents: Sequence[Document],
+    num_workers: int,
+    encode_target: bool = False,
+    num_shards: Optional[int] = None,
+) -> Tuple[List[TaskEncoding], List[Document]]:
+    """Encode the documents with a pool of worker processes and return the task encodings and the
+    documents in order as taskmodule.batch_encode() does.
+
+    The documents are split into shards that are encoded by taskmodule.batch_encode() in the
+    worker processes. The taskmodule is sent only once to each worker. The task encodings are sent
+    back without their documents: they are re-attached from the input documents in the main
+    process. Annotations of the documents in the inputs, targets or metadata (e.g. candidate
+    relations) are also exchanged with the annotations of the input documents. The result is
+    the same as for encoding the documents in a single process, but modifications of the
+    documents during encoding do not affect the input documents. As for taskmodule.encode(),
+    on_encode_start() and on_encode_end() are called, but only in the main process.
+
+    Args:
+        taskmodule: The (prepared) taskmodule.
+        documents: The documents to encode.
+        num_workers: The number of worker processes.
+        encode_target: Whether to encode the targets.
+        num_shards: The number of shards. Defaults to four shards per worker to balance the load.
+    """
+    taskmodule.assert_is_prepared()
+    taskmodule.on_encode_start()
+
+    if num_shards is None:
+        num_shards = num_workers * 4
+    shards, offsets = _get_shards(documents, num_shards)
+
+    with ProcessPoolExecutor(
+        max_workers=num_workers, initializer=_init_worker, initargs=(taskmodule,)
+    ) as executor:
+        results = list(executor.map(_encode_shard, shards, offsets, [encode_target] * len(shards)))
+
+    def get_annotation(document_idx: int, reference: AnnotationReference) -> Annotation:
+        layer = getattr(documents[document_idx], reference.layer)
+        annotations = layer.predictions if reference.is_prediction else layer
+        return annotations[reference.index]
+
+    task_encodings: List[TaskEncoding] = []
+    documents_in_order: List[Document] = []
+    for encoded_task_encodings, documents_in_order_indices in results:
+        for document_idx, inputs, targets, metadata in encoded_task_encodings:
+
+            def from_reference(obj: Any) -> Optional[Annotation]:
+                if isinstance(obj, AnnotationReference):
+                    return get_annotation(document_idx, obj)
+                return None
+
+            task_encodings.append(
+                TaskEncoding(
+                    document=documents[document_idx],
+                    inputs=_map_annotations(inputs, from_reference),
+                    targets=_map_annotations(targets, from_reference),
+                    metadata=_map_annotations(metadata, from_reference),
+                )
+            )
+        documents_in_order.extend(documents[idx] for idx in documents_in_order_indices)
+
+    taskmodule.on_encode_end()
+    return task_encodings, documents_in_order
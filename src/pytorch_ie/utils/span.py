@@ -1,3 +1,4 @@
+import dataclasses
 import functools
 import logging
 from typing import (
@@ -13,6 +14,7 @@ from typing import (
     Tuple,
 )
 
+import numpy as np
 from transformers import PreTrainedTokenizer
 
 from pytorch_ie.annotations import LabeledSpan, Span
@@ -213,6 +215,237 @@ def convert_span_annotations_to_tag_sequence(
     return tag_sequence
 
 
+@dataclasses.dataclass(frozen=True)
+class TagIdMapping:
+    """Integer lookup tables to convert between tag ids and spans without any string processing.
+
+    The span labels (without BIO prefix) are indexed by their position in `labels`. Tags without
+    "B-" / "I-" prefix (i.e. IO encoding) are also supported: consecutive tokens with the same
+    such tag form a single span. Tag ids that are not in the mapping (e.g. the label pad id) are
+    treated like the outside tag.
+    """
+
+    labels: List[str]
+    label_to_index: Dict[str, int]
+    # tag id -> label index, -1 for the outside tag
+    tag_id_to_label_index: np.ndarray
+    # tag id -> whether the tag starts a span ("B-" prefix)
+    tag_id_is_begin: np.ndarray
+    # tag id -> whether the tag continues a span ("I-" prefix)
+    tag_id_is_inside: np.ndarray
+    # label index -> id of the tag that starts a span with that label
+    label_index_to_begin_tag_id: np.ndarray
+    # label index -> id of the tag that continues a span with that label
+    label_index_to_inside_tag_id: np.ndarray
+    outside_tag_id: int
+
+    @classmethod
+    def from_label_to_id(
+        cls, label_to_id: Dict[str, int], outside_tag: str = "O"
+    ) -> "TagIdMapping":
+        if outside_tag not in label_to_id:
+            raise ValueError(f"outside tag {outside_tag} is not in label_to_id: {label_to_id}")
+        size = max(label_to_id.values()) + 1
+        labels: List[str] = []
+        label_to_index: Dict[str, int] = {}
+        tag_id_to_label_index = np.full(size, -1, dtype=np.int64)
+        tag_id_is_begin = np.zeros(size, dtype=bool)
+        tag_id_is_inside = np.zeros(size, dtype=bool)
+        begin_tag_ids: Dict[str, int] = {}
+        inside_tag_ids: Dict[str, int] = {}
+        for tag, tag_id in sorted(label_to_id.items(), key=lambda tag_and_id: tag_and_id[1]):
+            if tag == outside_tag:
+                continue
+            if tag[:2] in ("B-", "I-"):
+                label = tag[2:]
+                if tag[0] == "B":
+                    tag_id_is_begin[tag_id] = True
+                    begin_tag_ids[label] = tag_id
+                else:
+                    tag_id_is_inside[tag_id] = True
+                    inside_tag_ids[label] = tag_id
+            else:
+                label = tag
+                begin_tag_ids[label] = tag_id
+                inside_tag_ids[label] = tag_id
+            if label not in label_to_index:
+                label_to_index[label] = len(labels)
+                labels.append(label)
+            tag_id_to_label_index[tag_id] = label_to_index[label]
+
+        missing = [
+            label for label in labels if label not in begin_tag_ids or label not in inside_tag_ids
+        ]
+        if len(missing) > 0:
+            raise ValueError(f"missing begin or inside tags for labels: {missing}")
+        return cls(
+            labels=labels,
+            label_to_index=label_to_index,
+            tag_id_to_label_index=tag_id_to_label_index,
+            tag_id_is_begin=tag_id_is_begin,
+            tag_id_is_inside=tag_id_is_inside,
+            label_index_to_begin_tag_id=np.array(
+                [begin_tag_ids[label] for label in labels], dtype=np.int64
+            ),
+            label_index_to_inside_tag_id=np.array(
+                [inside_tag_ids[label] for label in labels], dtype=np.int64
+            ),
+            outside_tag_id=label_to_id[outside_tag],
+        )
+
+
+def token_spans_to_tag_ids(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    label_indices: np.ndarray,
+    tag_id_mapping: TagIdMapping,
+    length: int,
+) -> Optional[np.ndarray]:
+    """Vectorized conversion of token spans into a sequence of tag ids (BIO encoding, or IO for
+    labels without prefix).
+
+    The spans are given by their token start and (inclusive) end indices and their label indices
+    with respect to `tag_id_mapping.labels`. All positions that are not covered by a span get the
+    outside tag id. Returns None if spans overlap.
+    """
+    tag_ids = np.full(length, tag_id_mapping.outside_tag_id, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    label_indices = np.asarray(label_indices, dtype=np.int64)
+    if len(starts) == 0:
+        return tag_ids
+
+    span_lengths = ends - starts + 1
+    coverage = np.zeros(length + 1, dtype=np.int64)
+    np.add.at(coverage, starts, 1)
+    np.add.at(coverage, ends + 1, -1)
+    if np.cumsum(coverage).max() > 1:
+        return None
+
+    # indices of all tokens covered by the spans, e.g. starts=[1, 5], ends=[2, 5] -> [1, 2, 5]
+    offsets_in_span = np.arange(span_lengths.sum()) - np.repeat(
+        np.cumsum(span_lengths) - span_lengths, span_lengths
+    )
+    token_indices = np.repeat(starts, span_lengths) + offsets_in_span
+    tag_ids[token_indices] = np.repeat(
+        tag_id_mapping.label_index_to_inside_tag_id[label_indices], span_lengths
+    )
+    tag_ids[starts] = tag_id_mapping.label_index_to_begin_tag_id[label_indices]
+    return tag_ids
+
+
+def convert_span_annotations_to_tag_ids(
+    spans: Sequence[LabeledSpan],
+    special_tokens_mask: Sequence[int],
+    char_to_token_mapper: Callable[[int], Optional[int]],
+    tag_id_mapping: TagIdMapping,
+    special_token_tag_id: int,
+    partition: Optional[Span] = None,
+    statistics: Optional[DefaultDict[str, Counter]] = None,
+) -> Optional[np.ndarray]:
+    """Same as `convert_span_annotations_to_tag_sequence`, but directly create an array of tag ids
+    (see `token_spans_to_tag_ids`). Special token positions get the `special_token_tag_id`.
+    Returns None if the spans overlap.
+    """
+    offset = partition.start if partition is not None else 0
+    starts: List[int] = []
+    ends: List[int] = []
+    label_indices: List[int] = []
+    for span in spans:
+        if partition is not None and (span.start < partition.start or span.end > partition.end):
+            continue
+
+        start_idx = char_to_token_mapper(span.start - offset)
+        end_idx = char_to_token_mapper(span.end - 1 - offset)
+        if start_idx is None or end_idx is None:
+            if statistics is not None:
+                statistics["skipped_unaligned"][span.label] += 1
+            else:
+                logger.warning(
+                    f"Entity annotation does not start or end with a token, it will be skipped: {span}"
+                )
+            continue
+
+        # negative numbers encode out-of-window tokens
+        if start_idx < 0 or end_idx < 0:
+            continue
+
+        starts.append(start_idx)
+        ends.append(end_idx)
+        label_indices.append(tag_id_mapping.label_to_index[span.label])
+        if statistics is not None:
+            statistics["added"][span.label] += 1
+
+    tag_ids = token_spans_to_tag_ids(
+        starts=np.array(starts, dtype=np.int64),
+        ends=np.array(ends, dtype=np.int64),
+        label_indices=np.array(label_indices, dtype=np.int64),
+        tag_id_mapping=tag_id_mapping,
+        length=len(special_tokens_mask),
+    )
+    if tag_ids is None:
+        logger.warning("tag already assigned (spans have an overlap).")
+        return None
+    tag_ids[np.asarray(special_tokens_mask, dtype=bool)] = special_token_tag_id
+    return tag_ids
+
+
+def tag_ids_to_spans(
+    tag_ids: np.ndarray,
+    tag_id_mapping: TagIdMapping,
+    include_ill_formed: bool = True,
+    mask: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Vectorized counterpart of `bio_tags_to_spans` (and `io_tags_to_spans` for tags without
+    prefix) that works directly on tag ids.
+
+    `tag_ids` can be a single sequence or a batch of sequences (2D). Positions where `mask` is
+    True (e.g. special tokens) are treated as outside. Returns an integer array with one row per
+    span: (label_index, start, end) for a single sequence, and (batch_index, label_index, start,
+    end) for a batch. The end index is inclusive and label_index refers to `tag_id_mapping.labels`.
+    """
+    tag_ids = np.asarray(tag_ids).astype(np.int64, copy=False)
+    is_batch = tag_ids.ndim == 2
+    if not is_batch:
+        tag_ids = tag_ids[None, :]
+
+    known = (tag_ids >= 0) & (tag_ids < len(tag_id_mapping.tag_id_to_label_index))
+    safe_tag_ids = np.where(known, tag_ids, tag_id_mapping.outside_tag_id)
+    label_indices = np.where(known, tag_id_mapping.tag_id_to_label_index[safe_tag_ids], -1)
+    if mask is not None:
+        label_indices = np.where(
+            np.asarray(mask, dtype=bool).reshape(label_indices.shape), -1, label_indices
+        )
+    is_begin = tag_id_mapping.tag_id_is_begin[safe_tag_ids]
+    is_active = label_indices != -1
+
+    previous_label_indices = np.full_like(label_indices, -1)
+    previous_label_indices[:, 1:] = label_indices[:, :-1]
+    is_start = is_active & (is_begin | (previous_label_indices != label_indices))
+    # a span ends where the next token does not continue it
+    is_end = np.ones_like(is_start)
+    is_end[:, :-1] = is_start[:, 1:] | (label_indices[:, 1:] != label_indices[:, :-1])
+    is_end &= is_active
+
+    batch_indices, start_indices = np.nonzero(is_start)
+    end_indices = np.nonzero(is_end)[1]
+    span_label_indices = label_indices[batch_indices, start_indices]
+    if not include_ill_formed:
+        # spans that start with an "I-" tag
+        is_well_formed = ~tag_id_mapping.tag_id_is_inside[
+            safe_tag_ids[batch_indices, start_indices]
+        ]
+        batch_indices = batch_indices[is_well_formed]
+        start_indices = start_indices[is_well_formed]
+        end_indices = end_indices[is_well_formed]
+        span_label_indices = span_label_indices[is_well_formed]
+
+    columns = [span_label_indices, start_indices, end_indices]
+    if is_batch:
+        columns.insert(0, batch_indices)
+    return np.stack(columns, axis=-1).astype(np.int64)
+
+
 def get_token_slice(
     character_slice: Tuple[int, int],
     char_to_token_mapper: Callable[[int], Optional[int]],
@@ -270,12 +503,85 @@ def get_char_to_token_mapper(
     )
 
 
-def get_special_token_mask(token_ids_0: List[int], tokenizer: PreTrainedTokenizer) -> List[int]:
+def _offsets_char_to_token_mapper(
+    char_idx: int,
+    token_starts: np.ndarray,
+    token_ends: np.ndarray,
+    token_slice_start: int = 0,
+    token_slice_end: Optional[int] = None,
+    token_positions: Optional[np.ndarray] = None,
+    char_start: Optional[int] = None,
+    char_end: Optional[int] = None,
+) -> Optional[int]:
+    if char_start is not None and char_idx < char_start:
+        # return negative number to encode out-ot-window
+        return -1
+    if char_end is not None and char_idx >= char_end:
+        # return negative number to encode out-ot-window
+        return -2
+    # the last token that starts at or before char_idx (this is also what the dict based mapping
+    # returns if multiple tokens have the same offsets)
+    token_idx = int(np.searchsorted(token_starts, char_idx, side="right")) - 1
+    if token_slice_end is None:
+        token_slice_end = len(token_starts)
+    if token_idx < token_slice_start or token_idx >= token_slice_end:
+        return None
+    if token_ends[token_idx] <= char_idx:
+        return None
+    token_idx -= token_slice_start
+    if token_positions is not None:
+        return int(token_positions[token_idx])
+    return token_idx
+
+
+def get_char_to_token_mapper_from_offsets(
+    token_starts: np.ndarray,
+    token_ends: np.ndarray,
+    token_slice: Optional[Tuple[int, int]] = None,
+    token_positions: Optional[np.ndarray] = None,
+    char_start: Optional[int] = None,
+    char_end: Optional[int] = None,
+) -> Callable[[int], Optional[int]]:
+    """Create a character to token mapper from the token start and end offsets (as obtained from
+    the offset mapping of the tokenizer). In contrast to `get_char_to_token_mapper`, this does not
+    require a mapping entry per character, so the offset arrays can be shared between all windows
+    of the same text.
+
+    The token offsets need to be sorted (by start). If `token_slice` is provided, only tokens
+    within that slice are considered and the returned indices are relative to its start. If
+    `token_positions` is provided, the (relative) token indices are mapped through it, e.g. to
+    account for special tokens. Character positions before `char_start` or at / after `char_end`
+    are mapped to -1 and -2, respectively, to encode out-of-window positions.
+    """
+    token_slice_start, token_slice_end = token_slice if token_slice is not None else (0, None)
+    return functools.partial(
+        _offsets_char_to_token_mapper,
+        token_starts=token_starts,
+        token_ends=token_ends,
+        token_slice_start=token_slice_start,
+        token_slice_end=token_slice_end,
+        token_positions=token_positions,
+        char_start=char_start,
+        char_end=char_end,
+    )
+
+
+def get_special_token_ids(tokenizer: PreTrainedTokenizer) -> Set[int]:
+    # exclude unknown token id since this indicate a real input token
+    return set(tokenizer.all_special_ids) - {tokenizer.unk_token_id}
+
+
+def get_special_token_mask(
+    token_ids_0: List[int],
+    tokenizer: PreTrainedTokenizer,
+    special_ids: Optional[Set[int]] = None,
+) -> List[int]:
     # TODO: check why we can not just use tokenizer.get_special_tokens_mask()
     #  (this checks if token_ids_1 is not None and raises an exception)
 
-    # exclude unknown token id since this indicate a real input token
-    special_ids = set(tokenizer.all_special_ids) - {tokenizer.unk_token_id}
+    # pass special_ids (see get_special_token_ids) when calling this repeatedly with the same tokenizer
+    if special_ids is None:
+        special_ids = get_special_token_ids(tokenizer)
     return [1 if token_id in special_ids else 0 for token_id in token_ids_0]
 
 
@@ -0,0 +1,150 @@
+import copy
+import json
+import logging
+import threading
+from typing import Any, Dict, Tuple, Type
+
+from transformers import AutoTokenizer, PreTrainedTokenizerBase, PreTrainedTokenizerFast
+
+logger = logging.getLogger(__name__)
+
+# Process-wide registry of loaded tokenizers. The entries are never handed out directly, callers get
+# shallow copies that share the (large) vocabulary and backend with the cached tokenizer.
+_TOKENIZER_CACHE: Dict[Tuple[str, str], PreTrainedTokenizerBase] = {}
+_TOKENIZER_CACHE_LOCK = threading.Lock()
+# tokenizer class -> the class of its copies that share state with a cached tokenizer
+_SHARED_TOKENIZER_CLASSES: Dict[type, type] = {}
+
+# small mutable containers that are copied for each handed out tokenizer, so that changing e.g. the
+# special tokens of one copy does not affect the other copies
+_PER_COPY_ATTRIBUTES = [
+    "init_kwargs",
+    "init_inputs",
+    "_special_tokens_map",
+    "model_input_names",
+    "deprecation_warnings",
+]
+# attributes of slow (Python) tokenizers that are modified in place when adding tokens
+_SLOW_TOKENIZER_ADDED_TOKENS_ATTRIBUTES = [
+    "_added_tokens_decoder",
+    "_added_tokens_encoder",
+    "tokens_trie",
+]
+
+
+def _cache_key(tokenizer_name_or_path: str, kwargs: Dict[str, Any]) -> Tuple[str, str]:
+    return tokenizer_name_or_path, json.dumps(kwargs, sort_keys=True, default=repr)
+
+
+def _new_tokenizer(cls: type) -> PreTrainedTokenizerBase:
+    return cls.__new__(cls)
+
+
+class _SharedTokenizerMixin:
+    """Mixin for the tokenizers handed out by `get_tokenizer()` that share their vocabulary and
+    backend with a cached tokenizer.
+
+    Adding tokens detaches the tokenizer first (see `detach_tokenizer()`), so it never changes the
+    cached tokenizer. The encoding methods of fast tokenizers modify the truncation and padding
+    settings of the backend, so all copies of a cached tokenizer serialize them with a shared lock.
+    Pickled and deep copied tokenizers do not share any state and get the original class.
+    """
+
+    _base_class: Type[PreTrainedTokenizerBase]
+    _backend_lock: threading.RLock
+
+    def _add_tokens(self, *args, **kwargs) -> int:
+        detach_tokenizer(self)  # type: ignore
+        # the tokenizer has its original class now
+        return self._add_tokens(*args, **kwargs)
+
+    def _batch_encode_plus(self, *args, **kwargs):
+        with self._backend_lock:
+            return super()._batch_encode_plus(*args, **kwargs)  # type: ignore
+
+    def __copy__(self) -> PreTrainedTokenizerBase:
+        return _shallow_copy(self)  # type: ignore
+
+    def __reduce_ex__(self, protocol):
+        state = dict(vars(self))
+        state.pop("_backend_lock", None)
+        return _new_tokenizer, (self._base_class,), state
+
+
+def _get_shared_class(cls: type) -> type:
+    if issubclass(cls, _SharedTokenizerMixin):
+        return cls
+    shared_cls = _SHARED_TOKENIZER_CLASSES.get(cls)
+    if shared_cls is None:
+        # keep the name, e.g. save_pretrained() stores it as tokenizer_class
+        shared_cls = type(
+            cls.__name__,
+            (_SharedTokenizerMixin, cls),
+            {"__module__": cls.__module__, "__qualname__": cls.__qualname__, "_base_class": cls},
+        )
+        _SHARED_TOKENIZER_CLASSES[cls] = shared_cls
+    return shared_cls
+
+
+def _shallow_copy(tokenizer: PreTrainedTokenizerBase) -> PreTrainedTokenizerBase:
+    result = _new_tokenizer(_get_shared_class(type(tokenizer)))
+    vars(result).update(vars(tokenizer))
+    for name in _PER_COPY_ATTRIBUTES:
+        if name in vars(result):
+            setattr(result, name, copy.copy(getattr(result, name)))
+    return result
+
+
+def get_tokenizer(tokenizer_name_or_path: str, **kwargs) -> PreTrainedTokenizerBase:
+    """Get a tokenizer as with `AutoTokenizer.from_pretrained(tokenizer_name_or_path, **kwargs)`,
+    but load the tokenizer files only once per process.
+
+    The loaded tokenizer is kept in a thread-safe registry that is keyed by the name and the
+    keyword arguments. Each call returns a new, cheap copy that shares the vocabulary and the
+    backend tokenizer with the cached one. Setting attributes such as `padding_side` on the copy
+    does not affect other copies. Operations that modify the vocabulary (`add_tokens()` and
+    `add_special_tokens()`) detach the copy first, i.e. they give it a private vocabulary and
+    backend (copy-on-write, see `detach_tokenizer()`). The copies can be used from several
+    threads, but as long as they share the backend, their calls to encode texts are serialized.
+    """
+    key = _cache_key(tokenizer_name_or_path, kwargs)
+    with _TOKENIZER_CACHE_LOCK:
+        tokenizer = _TOKENIZER_CACHE.get(key)
+        if tokenizer is None:
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_name_or_path, **kwargs)
+            # shared by all copies of the cached tokenizer, see _SharedTokenizerMixin
+            tokenizer._backend_lock = threading.RLock()
+            _TOKENIZER_CACHE[key] = tokenizer
+        return _shallow_copy(tokenizer)
+
+
+def is_shared_tokenizer(tokenizer: PreTrainedTokenizerBase) -> bool:
+    """Check if the tokenizer shares its vocabulary with a cached tokenizer."""
+    return isinstance(tokenizer, _SharedTokenizerMixin)
+
+
+def detach_tokenizer(tokenizer: PreTrainedTokenizerBase) -> PreTrainedTokenizerBase:
+    """Give a tokenizer obtained with `get_tokenizer()` its own copy of all state that is modified
+    when adding tokens or encoding texts. This is a no-op for tokenizers that do not share any
+    state. It is called automatically when tokens are added to the tokenizer.
+
+    Returns the (now detached) tokenizer itself.
+    """
+    if not isinstance(tokenizer, _SharedTokenizerMixin):
+        return tokenizer
+    with tokenizer._backend_lock:
+        if isinstance(tokenizer, PreTrainedTokenizerFast):
+            tokenizer._tokenizer = copy.deepcopy(tokenizer._tokenizer)
+        else:
+            for name in _SLOW_TOKENIZER_ADDED_TOKENS_ATTRIBUTES:
+                if name in vars(tokenizer):
+                    setattr(tokenizer, name, copy.deepcopy(getattr(tokenizer, name)))
+        del tokenizer._backend_lock
+        tokenizer.__class__ = tokenizer._base_class
+    return tokenizer
+
+
+def clear_tokenizer_cache() -> None:
+    """Remove all tokenizers from the registry. Already handed out tokenizers stay valid."""
+    with _TOKENIZER_CACHE_LOCK:
+        _TOKENIZER_CACHE.clear()
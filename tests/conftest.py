@@ -3,10 +3,12 @@ import json
 from typing import Dict, Optional
 
 import pytest
+import torch
 from pie_core import Annotation, AnnotationLayer, annotation_field
 
 from pytorch_ie.annotations import BinaryRelation, LabeledSpan, Span
 from pytorch_ie.documents import TextDocument
+from pytorch_ie.taskmodules import TransformerTokenClassificationTaskModule
 from tests import FIXTURES_ROOT
 
 
@@ -58,6 +60,24 @@ def documents(document_dataset):
     return document_dataset["train"]
 
 
+@pytest.fixture
+def taskmodule(documents):
+    taskmodule = TransformerTokenClassificationTaskModule(
+        tokenizer_name_or_path="bert-base-cased", entity_annotation="entities"
+    )
+    taskmodule.prepare(documents)
+    return taskmodule
+
+
+def _assert_equal_batches(batch, expected_batch):
+    inputs, targets = batch
+    expected_inputs, expected_targets = expected_batch
+    assert set(inputs) == set(expected_inputs)
+    for key in expected_inputs:
+        torch.testing.assert_close(inputs[key], expected_inputs[key])
+    torch.testing.assert_close(targets, expected_targets)
+
+
 def test_documents(documents):
     assert len(documents) == 8
     assert all(isinstance(doc, TestDocument) for doc in documents)
@@ -3,9 +3,10 @@ from dataclasses import dataclass
 import pytest
 from pie_core import AnnotationLayer, annotation_field
 
-from pytorch_ie.annotations import LabeledSpan
+from pytorch_ie.annotations import BinaryRelation, LabeledSpan
 from pytorch_ie.documents import TextBasedDocument
 from pytorch_ie.metrics import ConfusionMatrix
+from pytorch_ie.metrics.confusion_matrix import get_annotation_key_function
 
 
 @pytest.fixture
@@ -58,3 +59,60 @@ def test_confusion_matrix(documents):
         "UNDETECTED": {"company": 1},
         "company": {"company": 1},
     }
+
+
+def test_get_annotation_key_function():
+    get_key = get_annotation_key_function(LabeledSpan, "label")
+    # the score is not a comparison field
+    assert get_key(LabeledSpan(start=1, end=3, label="a", score=0.5)) == (LabeledSpan, 1, 3)
+    assert get_key(LabeledSpan(start=1, end=3, label="a")) == get_key(
+        LabeledSpan(start=1, end=3, label="b")
+    )
+
+    get_relation_key = get_annotation_key_function(BinaryRelation, "label")
+    head = LabeledSpan(start=1, end=3, label="a")
+    tail = LabeledSpan(start=5, end=7, label="b")
+    assert get_relation_key(BinaryRelation(head=head, tail=tail, label="r")) == (
+        BinaryRelation,
+        head,
+        tail,
+    )
+    # the labels of the arguments are not ignored
+    assert get_relation_key(BinaryRelation(head=head, tail=tail, label="r")) != get_relation_key(
+        BinaryRelation(head=head, tail=tail.copy(label="c"), label="r")
+    )
+
+
+def test_confusion_matrix_relations():
+    @dataclass
+    class TextDocumentWithRelations(TextBasedDocument):
+        entities: AnnotationLayer[LabeledSpan] = annotation_field(target="text")
+        relations: AnnotationLayer[BinaryRelation] = annotation_field(target="entities")
+
+    document = TextDocumentWithRelations(text="Alice works for Acme in Berlin.")
+    alice = LabeledSpan(start=0, end=5, label="person")
+    acme = LabeledSpan(start=16, end=20, label="org")
+    berlin = LabeledSpan(start=24, end=30, label="loc")
+    document.entities.extend([alice, acme, berlin])
+    document.relations.append(BinaryRelation(head=alice, tail=acme, label="works_for"))
+    document.relations.append(BinaryRelation(head=acme, tail=berlin, label="based_in"))
+
+    document.entities.predictions.extend([alice.copy(), acme.copy(), berlin.copy()])
+    alice_pred, acme_pred, berlin_pred = document.entities.predictions
+    document.relations.predictions.append(
+        BinaryRelation(head=alice_pred, tail=acme_pred, label="works_for")
+    )
+    document.relations.predictions.append(
+        BinaryRelation(head=acme_pred, tail=berlin_pred, label="located_in")
+    )
+    document.relations.predictions.append(
+        BinaryRelation(head=alice_pred, tail=berlin_pred, label="lives_in")
+    )
+
+    metric = ConfusionMatrix(layer="relations")
+    metric(document)
+    assert dict(metric.counts) == {
+        ("works_for", "works_for"): 1,
+        ("based_in", "located_in"): 1,
+        ("UNDETECTED", "lives_in"): 1,
+    }
@@ -93,6 +93,31 @@ def test_f1_per_label_inferred(documents):
     }
 
 
+def test_f1_per_label_with_annotation_processor(documents):
+    # ignore the label when comparing annotations, but still count per label
+    metric = F1Metric(
+        layer="entities",
+        labels=["animal", "cat"],
+        annotation_processor=lambda ann: (ann.start, ann.end),
+    )
+    metric(documents)
+    # the wrongly labeled prediction is correct for micro, but not for its own label
+    assert dict(metric.counts) == {"MICRO": (2, 0, 0), "animal": (2, 0, 0), "cat": (0, 1, 0)}
+
+
+def test_calculate_counts_per_label(documents):
+    metric = F1Metric(layer="entities", labels="INFERRED")
+    micro_counts, counts_per_label = metric.calculate_counts_per_label(documents[0])
+    assert micro_counts == metric.calculate_counts(documents[0]) == (2, 1, 0)
+    assert counts_per_label == {"animal": (2, 0, 0), "cat": (0, 1, 0)}
+
+    micro_counts, counts_per_label = metric.calculate_counts_per_label(
+        documents[0], labels={"cat"}
+    )
+    assert micro_counts == (0, 1, 0)
+    assert counts_per_label == {"cat": (0, 1, 0)}
+
+
 def test_f1_per_label_no_labels(documents):
     with pytest.raises(ValueError) as excinfo:
         F1Metric(layer="entities", labels=[])
@@ -126,3 +151,58 @@ def test_f1_per_label_not_allowed():
 #        "| company | 0.667 | 0.5 | 1     |\n"
 #        "| cat     | 0     | 0   | 0     |"
 #    )
+
+
+def test_f1_bootstrap(documents):
+    metric = F1Metric(
+        layer="entities", labels=["animal", "company", "cat"], keep_document_counts=True
+    )
+    metric(documents)
+    assert metric.num_documents == 2
+    result = metric.compute(bootstrap=200, seed=42)
+    for label in ["MACRO", "MICRO", "animal", "company", "cat"]:
+        for name in ["f1", "p", "r"]:
+            lower, upper = result[label][f"{name}_ci"]
+            assert 0.0 <= lower <= upper <= 1.0
+    # the resamples contain only the first document, only the second document (without any
+    # animals), or both (which gives the original values)
+    assert result["animal"]["f1_ci"] == (0.0, 1.0)
+    # the cat predictions are always wrong
+    assert result["cat"]["f1_ci"] == (0.0, 0.0)
+    assert result["MICRO"]["f1_ci"][0] == pytest.approx(2 / 3)
+    assert result["MICRO"]["f1_ci"][1] == pytest.approx(0.8)
+    # the metric is reset afterwards
+    assert metric.num_documents == 0
+
+
+def test_f1_bootstrap_chunks(documents):
+    metric = F1Metric(layer="entities", labels="INFERRED", keep_document_counts=True)
+    metric(documents)
+    expected = metric.compute(bootstrap=50, seed=3, reset=False)
+    # the resamples are drawn in chunks of max_weights_size // num_documents, this does not
+    # change the results
+    metric_values = metric._compute()
+    metric._add_bootstrap_intervals(
+        metric_values, num_resamples=50, confidence_level=0.95, seed=3, max_weights_size=3
+    )
+    assert metric_values == expected
+
+
+def test_f1_bootstrap_merge_state(documents):
+    metric = F1Metric(layer="entities", keep_document_counts=True)
+    metric(documents)
+    expected = metric.compute(bootstrap=100, seed=1)
+
+    merged_metric = F1Metric(layer="entities", keep_document_counts=True)
+    for document in documents:
+        document_metric = F1Metric(layer="entities", keep_document_counts=True)
+        document_metric(document)
+        merged_metric.merge_state(document_metric.get_state())
+    assert merged_metric.compute(bootstrap=100, seed=1) == expected
+
+
+def test_f1_bootstrap_requires_document_counts(documents):
+    metric = F1Metric(layer="entities")
+    metric(documents)
+    with pytest.raises(ValueError, match="keep_document_counts=True"):
+        metric.compute(bootstrap=10)
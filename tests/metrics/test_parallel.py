@@ -0,0 +1,82 @@
+import pickle
+from dataclasses import dataclass
+
+import pytest
+from pie_core import AnnotationLayer, annotation_field
+
+from pytorch_ie.annotations import LabeledSpan
+from pytorch_ie.documents import TextBasedDocument
+from pytorch_ie.metrics import (
+    ConfusionMatrix,
+    F1Metric,
+    calculate_metric_state,
+    evaluate_in_parallel,
+)
+
+
+# the document type needs to be defined on module level to be picklable
+@dataclass
+class TextDocumentWithEntities(TextBasedDocument):
+    entities: AnnotationLayer[LabeledSpan] = annotation_field(target="text")
+
+
+@pytest.fixture(scope="module")
+def documents():
+    labels = ["animal", "company", "cat", "person"]
+    documents = []
+    for idx in range(20):
+        document = TextDocumentWithEntities(text="The quick brown fox jumps over the lazy dog.")
+        for start in range(0, 40, 5):
+            document.entities.append(
+                LabeledSpan(start=start, end=start + 3, label=labels[(idx + start) % 3])
+            )
+            if (start + idx) % 4 != 0:
+                document.entities.predictions.append(
+                    LabeledSpan(start=start, end=start + 3, label=labels[(idx * start) % 4])
+                )
+        documents.append(document)
+    return documents
+
+
+@pytest.mark.parametrize(
+    "metric",
+    [
+        F1Metric(layer="entities"),
+        F1Metric(layer="entities", labels=["animal", "company"]),
+        F1Metric(layer="entities", labels="INFERRED"),
+        ConfusionMatrix(layer="entities"),
+    ],
+)
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_evaluate_in_parallel(documents, metric, num_workers):
+    metric.reset()
+    expected = metric(documents)
+    expected_counts = dict(metric.counts)
+
+    metric.reset()
+    result = evaluate_in_parallel(metric, documents, num_workers=num_workers, num_shards=3)
+    assert result == expected
+    assert dict(metric.counts) == expected_counts
+
+
+def test_merge_state(documents):
+    metric = F1Metric(layer="entities", labels="INFERRED")
+    expected = metric(documents)
+
+    states = [
+        calculate_metric_state(F1Metric(layer="entities", labels="INFERRED"), documents[:5]),
+        calculate_metric_state(F1Metric(layer="entities", labels="INFERRED"), documents[5:]),
+    ]
+    # the states can be sent to other processes or nodes
+    states = [pickle.loads(pickle.dumps(state)) for state in states]
+
+    merged_metric = F1Metric(layer="entities", labels="INFERRED")
+    for state in states:
+        merged_metric.merge_state(state)
+    assert merged_metric.labels == metric.labels
+    assert merged_metric.compute() == expected
+
+
+def test_evaluate_in_parallel_unsupported_metric(documents):
+    with pytest.raises(TypeError, match="does not implement get_state"):
+        evaluate_in_parallel(object(), documents)  # type: ignore
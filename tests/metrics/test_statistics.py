@@ -1,9 +1,16 @@
+import pytest
+from pie_core.utils.dictionary import flatten_dict
+
+from pytorch_ie.metrics import evaluate_in_parallel
 from pytorch_ie.metrics.statistics import (
+    _TOKEN_COUNT_CACHE,
+    TOKEN_COUNT_CACHE_FILE_NAME,
     DummyCollector,
     FieldLengthCollector,
     LabelCountCollector,
     SubFieldLengthCollector,
     TokenCountCollector,
+    clear_token_count_cache,
 )
 
 
@@ -85,3 +92,171 @@ def test_statistics_with_tokenize(document_dataset):
         "train": {"max": 14, "mean": 7.75, "min": 4, "std": 3.6314597615834874},
         "val": {"max": 13, "mean": 8.5, "min": 4, "std": 4.5},
     }
+
+
+def test_statistics_with_tokenize_batched_and_cached(document_dataset, monkeypatch):
+    clear_token_count_cache()
+    statistic = TokenCountCollector(
+        text_field="text",
+        tokenizer="bert-base-uncased",
+        tokenizer_kwargs=dict(add_special_tokens=False),
+        batch_size=3,
+        use_cache=True,
+    )
+    tokenized_texts = []
+    original_tokenize_and_count = TokenCountCollector._tokenize_and_count
+
+    def tokenize_and_count(self, texts):
+        tokenized_texts.append(list(texts))
+        return original_tokenize_and_count(self, texts)
+
+    monkeypatch.setattr(TokenCountCollector, "_tokenize_and_count", tokenize_and_count)
+
+    expected = {"max": 14, "mean": 7.75, "min": 4, "std": 3.6314597615834874}
+    assert statistic(document_dataset["train"]) == expected
+    # the texts are tokenized in batches
+    assert [len(texts) for texts in tokenized_texts] == [3, 3, 1]
+
+    # another collector with the same tokenizer and kwargs reuses the cached counts
+    tokenized_texts.clear()
+    other_statistic = TokenCountCollector(
+        text_field="text",
+        tokenizer="bert-base-uncased",
+        tokenizer_kwargs=dict(add_special_tokens=False),
+        use_cache=True,
+    )
+    assert other_statistic(document_dataset["train"]) == expected
+    assert tokenized_texts == []
+
+    # the cache is not used by default
+    uncached_statistic = TokenCountCollector(
+        text_field="text",
+        tokenizer="bert-base-uncased",
+        tokenizer_kwargs=dict(add_special_tokens=False),
+    )
+    assert uncached_statistic(document_dataset["train"]) == expected
+    assert len(tokenized_texts) == 1
+    tokenized_texts.clear()
+
+    # different kwargs result in different counts
+    with_special_tokens = TokenCountCollector(
+        text_field="text", tokenizer="bert-base-uncased", use_cache=True
+    )
+    assert with_special_tokens(document_dataset["train"])["max"] == 16
+    assert len(tokenized_texts) == 1
+    clear_token_count_cache()
+
+
+def test_statistics_with_tokenize_persistent_cache(document_dataset, monkeypatch, tmp_path):
+    clear_token_count_cache()
+    tokenized_texts = []
+    original_tokenize_and_count = TokenCountCollector._tokenize_and_count
+
+    def tokenize_and_count(self, texts):
+        tokenized_texts.append(list(texts))
+        return original_tokenize_and_count(self, texts)
+
+    monkeypatch.setattr(TokenCountCollector, "_tokenize_and_count", tokenize_and_count)
+
+    def create_statistic():
+        return TokenCountCollector(
+            text_field="text",
+            tokenizer="bert-base-uncased",
+            tokenizer_kwargs=dict(add_special_tokens=False),
+            cache_max_size=2,
+            cache_dir=str(tmp_path),
+        )
+
+    expected = {"max": 14, "mean": 7.75, "min": 4, "std": 3.6314597615834874}
+    statistic = create_statistic()
+    assert statistic.use_cache
+    assert statistic(document_dataset["train"]) == expected
+    assert sum(len(texts) for texts in tokenized_texts) == 8
+    assert (tmp_path / TOKEN_COUNT_CACHE_FILE_NAME).exists()
+    # the in-memory cache is bounded by cache_max_size
+    assert len(_TOKEN_COUNT_CACHE) == 2
+
+    # the counts are loaded from the cache_dir, e.g. in another run
+    clear_token_count_cache()
+    tokenized_texts.clear()
+    assert create_statistic()(document_dataset["train"]) == expected
+    assert tokenized_texts == []
+    clear_token_count_cache()
+
+
+def test_statistics_streaming(document_dataset):
+    for statistic, streaming_statistic in [
+        (DummyCollector(), DummyCollector(streaming=True)),
+        (
+            LabelCountCollector(field="entities", labels=["LOC", "PER", "ORG"]),
+            LabelCountCollector(field="entities", labels=["LOC", "PER", "ORG"], streaming=True),
+        ),
+        (FieldLengthCollector(field="text"), FieldLengthCollector(field="text", streaming=True)),
+        (
+            SubFieldLengthCollector(field="entities", subfield="label"),
+            SubFieldLengthCollector(field="entities", subfield="label", streaming=True),
+        ),
+    ]:
+        expected = flatten_dict(statistic(document_dataset))
+        assert flatten_dict(streaming_statistic(document_dataset)) == pytest.approx(expected)
+
+    # with streaming, the zero counts are filled in also for inferred labels
+    statistic = LabelCountCollector(field="entities", labels="INFERRED", streaming=True)
+    values = statistic(document_dataset)
+    assert values["train"] == {
+        "PER": {
+            "mean": 0.875,
+            "std": pytest.approx(0.5994789),
+            "min": 0,
+            "max": 2,
+            "len": 8,
+            "sum": 7,
+        },
+        "ORG": {
+            "mean": 1.125,
+            "std": pytest.approx(0.7806247),
+            "min": 0,
+            "max": 2,
+            "len": 8,
+            "sum": 9,
+        },
+    }
+    assert values["test"] == {
+        "PER": {"mean": 0.5, "std": 0.5, "min": 0, "max": 1, "len": 2, "sum": 1},
+        "ORG": {"mean": 1.0, "std": 1.0, "min": 0, "max": 2, "len": 2, "sum": 2},
+    }
+
+
+def test_statistics_streaming_quantiles_and_histogram(document_dataset):
+    statistic = FieldLengthCollector(
+        field="text",
+        streaming=True,
+        aggregation_functions=["median", "p90", "histogram"],
+        histogram_bin_edges=[0, 20, 40],
+    )
+    values = statistic(document_dataset["train"])
+    assert values == {
+        "median": 20,
+        "p90": 54,
+        "histogram": {"bin_edges": [0, 20, 40], "counts": [4, 2], "underflow": 0, "overflow": 2},
+    }
+    # the quantiles are exact as long as the sketch does not need to compact the values
+    assert FieldLengthCollector(field="text", aggregation_functions=["median"])(
+        document_dataset["train"]
+    ) == {"median": 20}
+
+    with pytest.raises(ValueError, match="not supported for streaming"):
+        FieldLengthCollector(field="text", streaming=True, aggregation_functions=["sorted"])
+    with pytest.raises(ValueError, match="requires bin_edges"):
+        FieldLengthCollector(field="text", streaming=True, aggregation_functions=["histogram"])
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_statistics_streaming_in_parallel(document_dataset, num_workers):
+    documents = list(document_dataset["train"])
+    statistic = LabelCountCollector(field="entities", labels="INFERRED", streaming=True)
+    expected = statistic(documents)
+
+    statistic.reset()
+    result = evaluate_in_parallel(statistic, documents, num_workers=num_workers, num_shards=3)
+    assert flatten_dict(result) == pytest.approx(flatten_dict(expected))
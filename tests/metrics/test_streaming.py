@@ -0,0 +1,140 @@
+import pickle
+import random
+
+import numpy as np
+import pytest
+
+from pytorch_ie.metrics.streaming import (
+    FixedBinHistogram,
+    QuantileSketch,
+    RunningMoments,
+    StreamingAggregator,
+)
+
+
+@pytest.fixture(scope="module")
+def values():
+    rng = random.Random(42)
+    return [rng.lognormvariate(3, 1) for _ in range(50_000)]
+
+
+def test_running_moments(values):
+    moments = RunningMoments()
+    for value in values:
+        moments.update(value)
+    assert moments.count == len(values)
+    assert moments.sum == pytest.approx(np.sum(values))
+    assert moments.mean == pytest.approx(np.mean(values))
+    assert moments.std == pytest.approx(np.std(values))
+    assert (moments.min, moments.max) == (min(values), max(values))
+
+    # merging the moments of shards gives the same result
+    merged = RunningMoments()
+    for start in range(0, len(values), 7_000):
+        shard = RunningMoments()
+        for value in values[start : start + 7_000]:
+            shard.update(value)
+        merged.merge(pickle.loads(pickle.dumps(shard)))
+    assert merged.count == moments.count
+    assert merged.mean == pytest.approx(moments.mean)
+    assert merged.std == pytest.approx(moments.std)
+    assert (merged.min, merged.max) == (moments.min, moments.max)
+
+    # a weight is the same as adding the value multiple times
+    weighted = RunningMoments()
+    weighted.update(2, weight=3)
+    weighted.update(5)
+    assert (weighted.count, weighted.sum, weighted.mean) == (4, 11, 2.75)
+    assert weighted.std == pytest.approx(np.std([2, 2, 2, 5]))
+
+    assert RunningMoments().std is None
+
+
+def test_quantile_sketch(values):
+    sketch = QuantileSketch()
+    for value in values:
+        sketch.update(value)
+    # the sketch stays small
+    assert sketch.size < 3 * sketch.k
+    sorted_values = sorted(values)
+    for q in [0.0, 0.1, 0.5, 0.9, 0.99, 1.0]:
+        # the rank error is small
+        rank = np.searchsorted(sorted_values, sketch.quantile(q))
+        assert abs(rank / len(values) - q) < 0.02
+
+    # merging the sketches of shards has the same accuracy
+    merged = QuantileSketch()
+    for start in range(0, len(values), 7_000):
+        shard = QuantileSketch(seed=start)
+        for value in values[start : start + 7_000]:
+            shard.update(value)
+        merged.merge(pickle.loads(pickle.dumps(shard)))
+    assert merged.count == len(values)
+    assert merged.size < 3 * merged.k
+    for q in [0.1, 0.5, 0.9]:
+        rank = np.searchsorted(sorted_values, merged.quantile(q))
+        assert abs(rank / len(values) - q) < 0.02
+
+    # weighted updates (e.g. for many zeros)
+    sketch = QuantileSketch()
+    sketch.update(0, weight=30_000)
+    for value in values[:20_000]:
+        sketch.update(value)
+    assert sketch.count == 50_000
+    assert sketch.quantile(0.5) == 0
+    assert sketch.quantile(0.7) > 0
+
+    assert QuantileSketch().quantile(0.5) is None
+    with pytest.raises(ValueError, match="q must be between 0 and 1"):
+        sketch.quantile(1.5)
+
+
+def test_fixed_bin_histogram():
+    histogram = FixedBinHistogram([0, 10, 20])
+    for value in [-1, 0, 5, 10, 19, 20, 21]:
+        histogram.update(value)
+    histogram.update(3, weight=2)
+    assert histogram.to_dict() == {
+        "bin_edges": [0, 10, 20],
+        "counts": [4, 3],
+        "underflow": 1,
+        "overflow": 1,
+    }
+    other = FixedBinHistogram([0, 10, 20])
+    other.update(15)
+    histogram.merge(other)
+    assert histogram.counts == [4, 4]
+
+    with pytest.raises(ValueError, match="different bin edges"):
+        histogram.merge(FixedBinHistogram([0, 5, 20]))
+    with pytest.raises(ValueError, match="strictly increasing"):
+        FixedBinHistogram([0, 0, 1])
+
+
+def test_streaming_aggregator():
+    aggregator = StreamingAggregator(
+        aggregation_functions=["len", "sum", "mean", "median", "p75", "histogram"],
+        bin_edges=[0, 2, 4],
+    )
+    for value in [1, 2, 3, 4]:
+        aggregator.update(value)
+    assert aggregator.compute() == {
+        "len": 4,
+        "sum": 10,
+        "mean": 2.5,
+        "median": 3,
+        "p75": 4,
+        "histogram": {"bin_edges": [0, 2, 4], "counts": [1, 3], "underflow": 0, "overflow": 0},
+    }
+    # without values
+    assert StreamingAggregator(["len", "mean", "min", "median"]).compute() == {
+        "len": 0,
+        "mean": None,
+        "min": None,
+        "median": None,
+    }
+    # the sketch is only created if required
+    assert StreamingAggregator(["mean"]).sketch is None
+
+    with pytest.raises(ValueError, match="not supported for streaming"):
+        StreamingAggregator(["mode"])
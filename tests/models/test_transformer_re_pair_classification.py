@@ -0,0 +1,150 @@
+import pytest
+import torch
+import transformers
+from torch import nn
+from transformers.modeling_outputs import BaseModelOutputWithPooling
+
+from pytorch_ie.models import TransformerREPairClassificationModel
+
+HIDDEN_SIZE = 8
+NUM_CLASSES = 4
+
+
+class MockConfig:
+    def __init__(self, hidden_size: int = HIDDEN_SIZE, classifier_dropout: float = 0.0) -> None:
+        self.hidden_size = hidden_size
+        self.classifier_dropout = classifier_dropout
+
+
+class MockModel(nn.Module):
+    def __init__(self, hidden_size: int = HIDDEN_SIZE) -> None:
+        super().__init__()
+        self.embeddings = nn.Embedding(20, hidden_size)
+        self.num_calls = 0
+
+    def forward(self, input_ids, attention_mask=None, **kwargs):
+        self.num_calls += 1
+        return BaseModelOutputWithPooling(last_hidden_state=self.embeddings(input_ids))
+
+
+@pytest.fixture
+def mock_transformers(monkeypatch):
+    torch.manual_seed(42)
+    monkeypatch.setattr(
+        transformers.AutoConfig, "from_pretrained", lambda model_name_or_path: MockConfig()
+    )
+    monkeypatch.setattr(
+        transformers.AutoModel,
+        "from_pretrained",
+        lambda model_name_or_path, config: MockModel(),
+    )
+
+
+def get_model(**kwargs):
+    return TransformerREPairClassificationModel(
+        model_name_or_path="some-model-name",
+        num_classes=NUM_CLASSES,
+        warmup_proportion=0.0,
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def batch():
+    inputs = {
+        "input_ids": torch.tensor([[1, 5, 6, 7, 2, 0], [1, 8, 9, 10, 11, 2]]),
+        "attention_mask": torch.tensor([[1, 1, 1, 1, 1, 0], [1, 1, 1, 1, 1, 1]]),
+        # rows: (batch index, start, end)
+        "entity_spans": torch.tensor([[0, 1, 3], [0, 3, 4], [1, 1, 2], [1, 2, 5]]),
+        "pair_indices": torch.tensor([[0, 1], [1, 0], [2, 3], [3, 2]]),
+    }
+    targets = torch.tensor([1, 0, 3, 2])
+    return inputs, targets
+
+
+def test_invalid_parameters(mock_transformers):
+    with pytest.raises(ValueError, match="span_pooling must be one of"):
+        get_model(span_pooling="min")
+    with pytest.raises(ValueError, match="pair_head must be one of"):
+        get_model(pair_head="linear")
+
+
+@pytest.mark.parametrize("span_pooling", ["max", "mean", "start"])
+def test_pool_spans(mock_transformers, batch, span_pooling):
+    model = get_model(span_pooling=span_pooling)
+    inputs, _ = batch
+    hidden_state = model.model(inputs["input_ids"]).last_hidden_state
+    pooled = model.pool_spans(hidden_state, inputs["entity_spans"])
+    assert pooled.shape == (4, HIDDEN_SIZE)
+    for entity_idx, (batch_idx, start, end) in enumerate(inputs["entity_spans"].tolist()):
+        span_states = hidden_state[batch_idx, start:end]
+        if span_pooling == "max":
+            expected = span_states.max(dim=0).values
+        elif span_pooling == "mean":
+            expected = span_states.mean(dim=0)
+        else:
+            expected = span_states[0]
+        torch.testing.assert_close(pooled[entity_idx], expected)
+
+
+def test_pool_spans_mean_half_precision(mock_transformers):
+    model = get_model(span_pooling="mean")
+    # a large prefix makes the cumulative sums imprecise in bfloat16
+    hidden_state = torch.cat([torch.full((1, 100, 1), 1000.0), torch.rand(1, 4, 1)], dim=1)
+    entity_spans = torch.tensor([[0, 100, 104], [0, 102, 103]])
+    pooled = model.pool_spans(hidden_state.to(torch.bfloat16), entity_spans)
+    assert pooled.dtype == torch.bfloat16
+    expected = torch.stack(
+        [
+            hidden_state[0, 100:104].to(torch.bfloat16).float().mean(dim=0),
+            hidden_state[0, 102:103].to(torch.bfloat16).float().mean(dim=0),
+        ]
+    )
+    torch.testing.assert_close(pooled.float(), expected, atol=1e-2, rtol=1e-2)
+
+
+def test_step_with_ignore_index(mock_transformers, batch):
+    model = get_model(ignore_index=0)
+    inputs, targets = batch
+    loss = model.step("train", batch)
+    # the pair with the target 0 does not contribute to the loss
+    logits = model(inputs)["logits"]
+    expected = nn.functional.cross_entropy(logits[targets != 0], targets[targets != 0])
+    torch.testing.assert_close(loss, expected)
+
+
+@pytest.mark.parametrize("pair_head", ["mlp", "bilinear"])
+def test_forward(mock_transformers, batch, pair_head):
+    model = get_model(pair_head=pair_head)
+    model.eval()
+    inputs, _ = batch
+    output = model(inputs)
+    # the transformer is called once for all pairs
+    assert model.model.num_calls == 1
+    assert output["logits"].shape == (4, NUM_CLASSES)
+    assert output["pair_batch_indices"].tolist() == [0, 0, 1, 1]
+
+    # the logits of a pair do not depend on the other pairs
+    single_pair_inputs = dict(inputs, pair_indices=inputs["pair_indices"][2:3])
+    torch.testing.assert_close(model(single_pair_inputs)["logits"], output["logits"][2:3])
+
+
+@pytest.mark.parametrize("pair_head", ["mlp", "bilinear"])
+def test_step(mock_transformers, batch, pair_head):
+    model = get_model(pair_head=pair_head)
+    loss = model.step("train", batch)
+    assert loss.shape == ()
+    loss.backward()
+    assert model.model.embeddings.weight.grad is not None
+
+
+def test_configure_optimizers(mock_transformers):
+    model = get_model(learning_rate=1e-5, task_learning_rate=1e-3)
+    optimizer = model.configure_optimizers()
+    encoder_group, task_group = optimizer.param_groups
+    assert encoder_group["lr"] == 1e-5
+    assert task_group["lr"] == 1e-3
+    assert len(encoder_group["params"]) == len(list(model.model.parameters()))
+    assert len(encoder_group["params"]) + len(task_group["params"]) == len(
+        list(model.parameters())
+    )
@@ -196,3 +196,55 @@ def test_validation_step(mock_model, batch):
 def test_test_step(mock_model, batch):
     loss = mock_model.test_step(batch, batch_idx=0)
     torch.testing.assert_close(loss, LOSS)
+
+
+def test_predict_with_generation_kwargs(monkeypatch, batch):
+    generate_calls = []
+
+    class MockModelWithConfig(MockModel):
+        config = transformers.PretrainedConfig(pad_token_id=1)
+
+        def generate(self, **kwargs):
+            generate_calls.append(kwargs)
+            return torch.tensor([[2, 0, 5, 6, 2, 1, 1]])
+
+    monkeypatch.setattr(
+        transformers.AutoModelForSeq2SeqLM,
+        "from_pretrained",
+        lambda pretrained_model_name_or_path: MockModelWithConfig(),
+    )
+    model = TransformerSeq2SeqModel(
+        model_name_or_path="some-model-name", generation_kwargs={"num_beams": 3}
+    )
+    inputs = batch[0].data
+
+    model.predict(inputs=inputs, max_target_length=20)
+    assert set(generate_calls[-1]) == {
+        "input_ids",
+        "attention_mask",
+        "num_beams",
+        "max_new_tokens",
+    }
+    assert generate_calls[-1]["num_beams"] == 3
+    assert generate_calls[-1]["max_new_tokens"] == 20
+
+    # explicit generation parameters take precedence and the budget is not used if a length is set
+    model.predict(
+        inputs=inputs, generation_kwargs={"num_beams": 1, "max_length": 10}, max_target_length=20
+    )
+    assert generate_calls[-1]["num_beams"] == 1
+    assert generate_calls[-1]["max_length"] == 10
+    assert "max_new_tokens" not in generate_calls[-1]
+
+    assert len(model.generation_statistics) == 2
+    statistics = model.generation_statistics[0]
+    assert statistics["batch_size"] == 1
+    # padding tokens are not counted
+    assert statistics["generated_tokens"] == 5
+    assert statistics["time"] >= 0.0
+
+    # only the most recent statistics are kept
+    assert model.generation_statistics.maxlen == 1000
+
+    model.reset_generation_statistics()
+    assert len(model.generation_statistics) == 0
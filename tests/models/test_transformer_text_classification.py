@@ -0,0 +1,166 @@
+import pytest
+import torch
+import transformers
+from torch import nn
+from transformers.modeling_outputs import BaseModelOutputWithPooling
+
+from pytorch_ie.models import TransformerTextClassificationModel
+from pytorch_ie.models.modules.embedding_cache import (
+    EmbeddingCache,
+    get_example_keys,
+    get_model_fingerprint,
+)
+
+HIDDEN_SIZE = 8
+
+
+class MockConfig:
+    def __init__(self, hidden_size: int = HIDDEN_SIZE, classifier_dropout: float = 0.0) -> None:
+        self.hidden_size = hidden_size
+        self.classifier_dropout = classifier_dropout
+
+
+class MockModel(nn.Module):
+    def __init__(self, hidden_size: int = HIDDEN_SIZE) -> None:
+        super().__init__()
+        self.embeddings = nn.Embedding(20, hidden_size)
+        self.num_examples = 0
+
+    def forward(self, input_ids, attention_mask=None, **kwargs):
+        self.num_examples += len(input_ids)
+        last_hidden_state = self.embeddings(input_ids).cumsum(dim=1).flip(dims=[1])
+        return BaseModelOutputWithPooling(last_hidden_state=last_hidden_state)
+
+
+@pytest.fixture
+def mock_transformers(monkeypatch):
+    torch.manual_seed(42)
+    monkeypatch.setattr(
+        transformers.AutoConfig, "from_pretrained", lambda model_name_or_path: MockConfig()
+    )
+    monkeypatch.setattr(
+        transformers.AutoModel,
+        "from_pretrained",
+        lambda model_name_or_path, config: MockModel(),
+    )
+
+
+def get_model(**kwargs):
+    return TransformerTextClassificationModel(
+        model_name_or_path="some-model-name", num_classes=3, warmup_proportion=0.0, **kwargs
+    )
+
+
+def get_inputs(rows):
+    length = max(len(row) for row in rows)
+    input_ids = torch.tensor([row + [0] * (length - len(row)) for row in rows])
+    attention_mask = torch.tensor([[1] * len(row) + [0] * (length - len(row)) for row in rows])
+    return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+def test_get_example_keys():
+    keys = get_example_keys(get_inputs([[1, 5, 6], [1, 7], [1, 5, 6]]))
+    assert keys[0] == keys[2]
+    assert keys[0] != keys[1]
+    # the keys do not depend on the padding
+    assert get_example_keys(get_inputs([[1, 7]])) == [keys[1]]
+
+
+def test_cache_embeddings_requires_frozen_model(mock_transformers):
+    with pytest.raises(ValueError, match="cache_embeddings requires freeze_model=True"):
+        get_model(cache_embeddings=True)
+
+
+def test_cache_embeddings(mock_transformers):
+    model = get_model(freeze_model=True, cache_embeddings=True)
+    model.train()
+    inputs = get_inputs([[1, 5, 6], [1, 7]])
+    logits = model(inputs)["logits"]
+    expected_logits = model.classifier(model.model(**inputs).last_hidden_state[:, 0, :])
+    torch.testing.assert_close(logits, expected_logits)
+    assert len(model.embedding_cache) == 2
+    # the transformer is not in eval mode after computing the embeddings
+    assert model.model.training
+
+    # the encoder is called only for the examples that are not cached
+    model.model.num_examples = 0
+    torch.testing.assert_close(model(inputs)["logits"], logits)
+    assert model.model.num_examples == 0
+    model(get_inputs([[1, 7], [1, 8, 9, 10]]))
+    assert model.model.num_examples == 1
+    assert len(model.embedding_cache) == 3
+
+    # the classifier is trained with the cached embeddings
+    model.step("train", (inputs, torch.tensor([0, 2]))).backward()
+    assert model.classifier.weight.grad is not None
+
+
+def test_cache_embeddings_on_disk(mock_transformers, tmp_path):
+    cache_dir = str(tmp_path / "embeddings")
+    model = get_model(freeze_model=True, cache_embeddings=True, embedding_cache_dir=cache_dir)
+    inputs = get_inputs([[1, 5, 6], [1, 7]])
+    logits = model(inputs)["logits"]
+
+    # a new model with the same cache_dir re-uses the cached embeddings
+    other_model = get_model(
+        freeze_model=True, cache_embeddings=True, embedding_cache_dir=cache_dir
+    )
+    other_model.load_state_dict(model.state_dict())
+    torch.testing.assert_close(other_model(inputs)["logits"], logits)
+    assert len(other_model.embedding_cache) == 2
+    assert other_model.model.num_examples == 0
+
+    # a model with other transformer weights can not use the cache
+    different_model = get_model(
+        freeze_model=True, cache_embeddings=True, embedding_cache_dir=cache_dir
+    )
+    with pytest.raises(ValueError, match="was created with fingerprint"):
+        different_model(inputs)
+
+
+def test_get_model_fingerprint(mock_transformers):
+    model = get_model()
+    other_model = get_model()
+    assert get_model_fingerprint(model.model) != get_model_fingerprint(other_model.model)
+    other_model.load_state_dict(model.state_dict())
+    assert get_model_fingerprint(model.model) == get_model_fingerprint(other_model.model)
+
+
+def test_embedding_cache_with_interrupted_write(tmp_path):
+    cache_dir = str(tmp_path / "embeddings")
+    cache = EmbeddingCache(cache_dir=cache_dir)
+    cache.add(["a", "b", "a"], torch.arange(6, dtype=torch.float32).reshape(3, 2))
+    assert len(cache) == 2
+    torch.testing.assert_close(cache.get(["b", "a"]), torch.tensor([[2.0, 3.0], [0.0, 1.0]]))
+    with pytest.raises(ValueError, match="dimension"):
+        cache.add(["c"], torch.zeros(1, 3))
+    # rows without keys are dropped when loading the cache
+    embeddings_file_name = EmbeddingCache.EMBEDDINGS_FILE_NAME.format(rank=0)
+    with open(tmp_path / "embeddings" / embeddings_file_name, "ab") as f:
+        f.write(torch.zeros(1, 2).numpy().tobytes())
+    cache = EmbeddingCache(cache_dir=cache_dir)
+    assert len(cache) == 2
+    cache.add(["c"], torch.ones(1, 2))
+    torch.testing.assert_close(cache.get(["c", "a"]), torch.tensor([[1.0, 1.0], [0.0, 1.0]]))
+
+
+def test_embedding_cache_with_multiple_ranks(tmp_path):
+    cache_dir = str(tmp_path / "embeddings")
+    caches = [EmbeddingCache(cache_dir=cache_dir, fingerprint="abc", rank=rank) for rank in [0, 1]]
+    caches[0].add(["a", "b"], torch.tensor([[0.0, 1.0], [2.0, 3.0]]))
+    caches[1].add(["c", "a"], torch.tensor([[4.0, 5.0], [6.0, 7.0]]))
+    # each rank writes only to its own files
+    assert len(caches[0]) == 2
+    assert len(caches[1]) == 2
+
+    # the entries of all ranks are loaded
+    cache = EmbeddingCache(cache_dir=cache_dir, fingerprint="abc", rank=0)
+    assert len(cache) == 3
+    torch.testing.assert_close(
+        cache.get(["c", "a", "b"]), torch.tensor([[4.0, 5.0], [0.0, 1.0], [2.0, 3.0]])
+    )
+    cache.add(["d"], torch.tensor([[8.0, 9.0]]))
+    torch.testing.assert_close(cache.get(["d", "c"]), torch.tensor([[8.0, 9.0], [4.0, 5.0]]))
+
+    with pytest.raises(ValueError, match="was created with fingerprint abc"):
+        EmbeddingCache(cache_dir=cache_dir, fingerprint="def")
@@ -1,10 +1,13 @@
+import logging
 from dataclasses import dataclass
 
 import pytest
+import transformers
 from pie_core import AnnotationLayer, annotation_field
 
 from pytorch_ie.annotations import BinaryRelation, LabeledSpan
 from pytorch_ie.documents import TextDocument
+from pytorch_ie.metrics import F1Metric
 from pytorch_ie.models import TransformerSeq2SeqModel
 from pytorch_ie.pipeline import Pipeline
 from pytorch_ie.taskmodules import TransformerSeq2SeqTaskModule
@@ -55,3 +58,153 @@ def test_re_generative():
     assert relation2.score == pytest.approx(1.0)
     assert (relation2.head.start, relation2.head.end) == (126, 134)
     assert (relation2.tail.start, relation2.tail.end) == (96, 100)
+
+
+@pytest.fixture
+def generate_calls():
+    return []
+
+
+@pytest.fixture
+def mock_pipeline(monkeypatch, generate_calls):
+    model_name_or_path = "Babelscape/rebel-large"
+    taskmodule = TransformerSeq2SeqTaskModule(
+        tokenizer_name_or_path=model_name_or_path,
+        entity_annotation="entities",
+        relation_annotation="relations",
+        max_target_length=32,
+    )
+    tokenizer = taskmodule.tokenizer
+
+    class MockModel:
+        def generate(self, input_ids, attention_mask, **kwargs):
+            generate_calls.append((attention_mask.sum(dim=1).tolist(), kwargs))
+            # predict a relation between the first and the last word of each input
+            targets = []
+            for ids in input_ids:
+                words = tokenizer.decode(ids, skip_special_tokens=True).split()
+                targets.append(f"<triplet> {words[0]} <subj> {words[-1]} <obj> rel")
+            return tokenizer(targets, padding=True, return_tensors="pt")["input_ids"]
+
+    monkeypatch.setattr(
+        transformers.AutoModelForSeq2SeqLM,
+        "from_pretrained",
+        lambda pretrained_model_name_or_path: MockModel(),
+    )
+    model = TransformerSeq2SeqModel(model_name_or_path=model_name_or_path)
+    return Pipeline(model=model, taskmodule=taskmodule, device=-1)
+
+
+@pytest.mark.parametrize("sort_by_length", [True, None])
+def test_re_generative_sort_by_length(mock_pipeline, generate_calls, sort_by_length):
+    pipeline = mock_pipeline
+    documents = [
+        ExampleDocument("Eve and some other people visited Frank yesterday in Berlin"),
+        ExampleDocument("Alice knows a lot about Bob"),
+        ExampleDocument("Carol met Dave"),
+    ]
+    # the inputs of generative taskmodules are sorted by default
+    kwargs = {} if sort_by_length is None else {"sort_by_length": sort_by_length}
+    pipeline(documents, batch_size=2, generation_kwargs={"num_beams": 2}, **kwargs)
+
+    # the shortest two inputs are batched together
+    assert len(generate_calls) == 2
+    first_batch_lengths, generation_kwargs = generate_calls[0]
+    second_batch_lengths, _ = generate_calls[1]
+    assert max(first_batch_lengths) <= min(second_batch_lengths)
+    assert len(first_batch_lengths) == 2
+    # the max_target_length of the taskmodule is used as budget
+    assert generation_kwargs == {"num_beams": 2, "max_new_tokens": 32}
+
+    # the results are assigned to the correct documents
+    relations = [
+        [(str(rel.head), str(rel.tail)) for rel in document.relations.predictions]
+        for document in documents
+    ]
+    assert relations == [[("Eve", "Berlin")], [("Alice", "Bob")], [("Carol", "Dave")]]
+
+
+def test_re_generative_with_metrics(mock_pipeline, generate_calls):
+    def create_documents():
+        for text in ["Alice knows Bob", "Carol met Dave", "Eve visited Frank"]:
+            document = ExampleDocument(text)
+            head = LabeledSpan(start=0, end=text.index(" "), label="head")
+            tail = LabeledSpan(start=text.rindex(" ") + 1, end=len(text), label="tail")
+            document.entities.extend([head, tail])
+            # the last relation has a different label
+            label = "rel" if text != "Eve visited Frank" else "other"
+            document.relations.append(BinaryRelation(head=head, tail=tail, label=label))
+            yield document
+
+    compute_calls = []
+
+    class CountingF1Metric(F1Metric):
+        def compute(self, reset: bool = True, **kwargs):
+            compute_calls.append(True)
+            return super().compute(reset=reset, **kwargs)
+
+    metric = CountingF1Metric(layer="relations")
+    # the documents can be an iterable (here a generator)
+    result = mock_pipeline(
+        create_documents(),
+        metrics=[metric],
+        keep_documents=False,
+        document_chunk_size=1,
+        batch_size=2,
+    )
+    assert result == []
+    # a single stream of batches over all documents
+    assert [len(lengths) for lengths, _ in generate_calls] == [2, 1]
+    # the metric is called with each finished document and computed once more at the end
+    # (the pipeline logs the final values)
+    assert len(compute_calls) == 4
+    assert dict(metric.counts) == {"MICRO": (2, 1, 1)}
+
+    metric = F1Metric(layer="relations")
+    documents = mock_pipeline(list(create_documents()), metrics=[metric], batch_size=2)
+    assert len(documents) == 3
+    assert all(len(document.relations.predictions) == 1 for document in documents)
+    assert dict(metric.counts) == {"MICRO": (2, 1, 1)}
+
+
+def test_re_generative_with_metrics_keeps_order(mock_pipeline, generate_calls, caplog):
+    documents = [
+        ExampleDocument("Eve and some other people visited Frank yesterday in Berlin"),
+        ExampleDocument("Alice knows a lot about Bob"),
+        ExampleDocument("Carol met Dave"),
+    ]
+    metric = F1Metric(layer="relations")
+    with caplog.at_level(logging.INFO, logger="pytorch_ie.pipeline"):
+        result = mock_pipeline(
+            documents, metrics=[metric], batch_size=2, log_metrics_every_n_documents=2
+        )
+    # the inputs are processed ordered by length
+    assert [len(lengths) for lengths, _ in generate_calls] == [2, 1]
+    assert max(generate_calls[0][0]) <= min(generate_calls[1][0])
+    # but the documents are returned in the input order
+    assert len(result) == len(documents)
+    assert all(processed is document for processed, document in zip(result, documents))
+    relations = [
+        [(str(rel.head), str(rel.tail)) for rel in document.relations.predictions]
+        for document in result
+    ]
+    assert relations == [[("Eve", "Berlin")], [("Alice", "Bob")], [("Carol", "Dave")]]
+    # the intermediate metric values are logged after every two documents
+    messages = [record.getMessage() for record in caplog.records]
+    metric_messages = [message for message in messages if message.startswith("F1Metric after")]
+    assert len(metric_messages) == 1
+    assert metric_messages[0].startswith("F1Metric after 2 documents: {'MICRO': ")
+
+
+def test_re_generative_with_encode_workers(mock_pipeline):
+    documents = [
+        ExampleDocument("Alice knows a lot about Bob"),
+        ExampleDocument("Carol met Dave"),
+        ExampleDocument("Eve visited Frank"),
+    ]
+    mock_pipeline(documents, batch_size=2, num_encode_workers=2)
+    relations = [
+        [(str(rel.head), str(rel.tail)) for rel in document.relations.predictions]
+        for document in documents
+    ]
+    assert relations == [[("Alice", "Bob")], [("Carol", "Dave")], [("Eve", "Frank")]]
@@ -0,0 +1,321 @@
+import numpy
+import pytest
+import torch
+
+from pytorch_ie.annotations import LabeledSpan
+from pytorch_ie.taskmodules import (
+    TransformerREPairClassificationTaskModule,
+    TransformerRETextClassificationTaskModule,
+)
+
+
+def get_taskmodule(**kwargs):
+    return TransformerREPairClassificationTaskModule(
+        tokenizer_name_or_path="bert-base-cased", relation_annotation="relations", **kwargs
+    )
+
+
+@pytest.fixture
+def prepared_taskmodule(documents):
+    taskmodule = get_taskmodule()
+    taskmodule.prepare(documents)
+    return taskmodule
+
+
+def get_entity_tokens(taskmodule, task_encoding):
+    tokens = taskmodule.tokenizer.convert_ids_to_tokens(task_encoding.inputs["input_ids"])
+    return [tokens[start:end] for start, end in task_encoding.inputs["entity_spans"]]
+
+
+def get_gold_logits(taskmodule, task_encodings):
+    """Create logits that predict the gold label of each candidate with a probability of 0.7."""
+    label_ids = [
+        taskmodule.label_to_id[candidate.label]
+        for task_encoding in task_encodings
+        for candidate in task_encoding.metadata.get(
+            "candidate_annotations", [task_encoding.metadata.get("candidate_annotation")]
+        )
+    ]
+    num_labels = len(taskmodule.label_to_id)
+    probabilities = numpy.full((len(label_ids), num_labels), 0.3 / (num_labels - 1))
+    probabilities[numpy.arange(len(label_ids)), label_ids] = 0.7
+    return torch.from_numpy(numpy.log(probabilities))
+
+
+def test_prepare(documents):
+    taskmodule = get_taskmodule(add_entity_markers=True, add_type_to_marker=True)
+    assert not taskmodule.is_prepared
+    taskmodule.prepare(documents)
+    assert taskmodule.is_prepared
+
+    assert taskmodule.label_to_id == {
+        "no_relation": 0,
+        "org:founded_by": 1,
+        "per:employee_of": 2,
+        "per:founder": 3,
+    }
+    assert taskmodule.entity_labels == ["ORG", "PER"]
+    assert taskmodule.entity_markers == ["[/E:ORG]", "[/E:PER]", "[E:ORG]", "[E:PER]"]
+    assert set(taskmodule.entity_markers_to_id) == set(taskmodule.entity_markers)
+
+
+def test_encode(prepared_taskmodule, documents):
+    task_encodings = prepared_taskmodule.encode(documents, encode_target=True)
+    # one encoding per document with relations
+    assert len(task_encodings) == 3
+    task_encoding = task_encodings[1]
+    assert prepared_taskmodule.tokenizer.convert_ids_to_tokens(
+        task_encoding.inputs["input_ids"]
+    ) == [
+        "[CLS]",
+        "First",
+        "sentence",
+        ".",
+        "Entity",
+        "G",
+        "works",
+        "at",
+        "H",
+        ".",
+        "And",
+        "founded",
+        "I",
+        ".",
+        "[SEP]",
+    ]
+    assert get_entity_tokens(prepared_taskmodule, task_encoding) == [
+        ["Entity", "G"],
+        ["H"],
+        ["I"],
+    ]
+    assert task_encoding.inputs["pair_indices"] == [[0, 1], [0, 2], [2, 1]]
+    candidates = task_encoding.metadata["candidate_annotations"]
+    assert [candidate.label for candidate in candidates] == [
+        "per:employee_of",
+        "per:founder",
+        "org:founded_by",
+    ]
+    assert task_encoding.targets == [2, 3, 1]
+
+
+def test_encode_with_partition_and_relation_candidates(documents):
+    taskmodule = get_taskmodule(partition_annotation="sentences", create_relation_candidates=True)
+    taskmodule.prepare(documents)
+    task_encodings = taskmodule.encode(documents, encode_target=True)
+    # there is one encoding per sentence with at least two entities
+    assert len(task_encodings) == 7
+    task_encoding = task_encodings[0]
+    assert get_entity_tokens(taskmodule, task_encoding) == [["Entity", "A"], ["B"]]
+    # all pairs of entities are candidates
+    assert task_encoding.inputs["pair_indices"] == [[0, 1], [1, 0]]
+    assert task_encoding.targets == [2, 0]
+
+
+def test_encode_with_entity_markers(documents):
+    taskmodule = get_taskmodule(add_entity_markers=True)
+    taskmodule.prepare(documents)
+    task_encoding = taskmodule.encode(documents)[0]
+    assert taskmodule.tokenizer.convert_ids_to_tokens(task_encoding.inputs["input_ids"]) == [
+        "[CLS]",
+        "[E]",
+        "Entity",
+        "A",
+        "[/E]",
+        "works",
+        "at",
+        "[E]",
+        "B",
+        "[/E]",
+        ".",
+        "[SEP]",
+    ]
+    # the entity spans include the markers
+    assert task_encoding.inputs["entity_spans"] == [[1, 5], [7, 10]]
+
+
+def test_insert_entity_markers_with_nested_entities(documents):
+    taskmodule = get_taskmodule(add_entity_markers=True, add_type_to_marker=True)
+    taskmodule.prepare(documents)
+    entities = [
+        LabeledSpan(start=0, end=10, label="ORG"),
+        LabeledSpan(start=0, end=5, label="PER"),
+        LabeledSpan(start=10, end=15, label="PER"),
+    ]
+    input_ids, token_slices = taskmodule._insert_entity_markers(
+        input_ids=[100, 101, 102, 103, 104],
+        entities=entities,
+        token_slices=[(1, 3), (1, 2), (3, 4)],
+    )
+    marker_to_id = taskmodule.entity_markers_to_id
+    assert input_ids == [
+        100,
+        marker_to_id["[E:ORG]"],
+        marker_to_id["[E:PER]"],
+        101,
+        marker_to_id["[/E:PER]"],
+        102,
+        marker_to_id["[/E:ORG]"],
+        marker_to_id["[E:PER]"],
+        103,
+        marker_to_id["[/E:PER]"],
+        104,
+    ]
+    assert token_slices == [(1, 7), (2, 5), (7, 10)]
+
+
+def test_encode_with_entity_markers_and_max_length(documents):
+    taskmodule = get_taskmodule(add_entity_markers=True, max_length=14)
+    taskmodule.prepare(documents)
+    task_encodings = taskmodule.encode(documents)
+    assert all(len(task_encoding.inputs["input_ids"]) <= 14 for task_encoding in task_encodings)
+    task_encoding = task_encodings[1]
+    tokens = taskmodule.tokenizer.convert_ids_to_tokens(task_encoding.inputs["input_ids"])
+    assert tokens[-1] == "[SEP]"
+    # only the entities that fit completely into the input are kept
+    assert get_entity_tokens(taskmodule, task_encoding) == [
+        ["[E]", "Entity", "G", "[/E]"],
+        ["[E]", "H", "[/E]"],
+    ]
+    assert task_encoding.inputs["pair_indices"] == [[0, 1]]
+
+
+def test_encode_with_entity_markers_and_model_max_length(documents):
+    taskmodule = get_taskmodule(add_entity_markers=True, max_length=14)
+    taskmodule.prepare(documents)
+    expected = taskmodule.encode(documents)
+
+    # without max_length, the inputs with markers are truncated to the model_max_length
+    taskmodule = get_taskmodule(add_entity_markers=True)
+    taskmodule.prepare(documents)
+    taskmodule.tokenizer.model_max_length = 14
+    task_encodings = taskmodule.encode(documents)
+    assert [task_encoding.inputs for task_encoding in task_encodings] == [
+        task_encoding.inputs for task_encoding in expected
+    ]
+
+
+def test_collate(prepared_taskmodule, documents):
+    task_encodings = prepared_taskmodule.encode(documents, encode_target=True)
+    inputs, targets = prepared_taskmodule.collate(task_encodings)
+
+    assert inputs["input_ids"].shape == (3, 16)
+    assert inputs["attention_mask"].shape == (3, 16)
+    assert inputs["entity_spans"].tolist() == [
+        [0, 1, 3],
+        [0, 5, 6],
+        [1, 4, 6],
+        [1, 8, 9],
+        [1, 12, 13],
+        [2, 4, 6],
+        [2, 8, 9],
+        [2, 11, 12],
+        [2, 13, 14],
+    ]
+    # the pair indices refer to the rows of entity_spans
+    assert inputs["pair_indices"].tolist() == [
+        [0, 1],
+        [2, 3],
+        [2, 4],
+        [4, 3],
+        [5, 6],
+        [7, 8],
+        [8, 7],
+    ]
+    assert targets.tolist() == [2, 2, 3, 1, 2, 3, 1]
+
+    inputs, targets = prepared_taskmodule.collate(prepared_taskmodule.encode(documents))
+    assert targets is None
+
+
+def test_collate_with_left_padding(prepared_taskmodule, documents):
+    task_encodings = prepared_taskmodule.encode(documents)
+    prepared_taskmodule.tokenizer.padding_side = "left"
+    try:
+        inputs, _ = prepared_taskmodule.collate(task_encodings)
+    finally:
+        prepared_taskmodule.tokenizer.padding_side = "right"
+    # the entity spans are shifted by the amount of padding
+    assert inputs["entity_spans"][:2].tolist() == [[0, 9, 11], [0, 13, 14]]
+    input_ids = inputs["input_ids"][0].tolist()
+    assert prepared_taskmodule.tokenizer.convert_ids_to_tokens(input_ids[9:11]) == [
+        "Entity",
+        "A",
+    ]
+
+
+def test_unbatch_output(prepared_taskmodule, documents):
+    task_encodings = prepared_taskmodule.encode(documents, encode_target=True)
+    inputs, _ = prepared_taskmodule.collate(task_encodings)
+    model_output = {
+        "logits": get_gold_logits(prepared_taskmodule, task_encodings),
+        "pair_batch_indices": inputs["entity_spans"][inputs["pair_indices"][:, 0], 0],
+    }
+    task_outputs = prepared_taskmodule.unbatch_output(model_output)
+    assert len(task_outputs) == 3
+    assert task_outputs[1]["labels"] == ["per:employee_of", "per:founder", "org:founded_by"]
+    numpy.testing.assert_allclose(task_outputs[1]["probabilities"], [0.7, 0.7, 0.7])
+
+
+def test_decode_matches_text_classification_taskmodule(documents):
+    """Given the same predictions for the relation candidates, the relations are the same as the
+    ones created by the TransformerRETextClassificationTaskModule."""
+    kwargs = dict(
+        tokenizer_name_or_path="bert-base-cased",
+        relation_annotation="relations",
+        partition_annotation="sentences",
+        create_relation_candidates=True,
+    )
+    annotations = {}
+    for taskmodule in [
+        TransformerREPairClassificationTaskModule(**kwargs),
+        TransformerRETextClassificationTaskModule(**kwargs),
+    ]:
+        taskmodule.prepare(documents)
+        task_encodings = taskmodule.encode(documents)
+        model_output = {"logits": get_gold_logits(taskmodule, task_encodings)}
+        if isinstance(taskmodule, TransformerREPairClassificationTaskModule):
+            inputs, _ = taskmodule.collate(task_encodings)
+            model_output["pair_batch_indices"] = inputs["entity_spans"][
+                inputs["pair_indices"][:, 0], 0
+            ]
+        task_outputs = taskmodule.unbatch_output(model_output)
+        annotations[type(taskmodule)] = [
+            (name, relation.head, relation.tail, relation.label, round(relation.score, 6))
+            for task_encoding, task_output in zip(task_encodings, task_outputs)
+            for name, relation in taskmodule.create_annotations_from_output(
+                task_encoding, task_output
+            )
+        ]
+
+    pair_annotations = annotations[TransformerREPairClassificationTaskModule]
+    assert len(pair_annotations) == 5
+    assert sorted(pair_annotations, key=str) == sorted(
+        annotations[TransformerRETextClassificationTaskModule], key=str
+    )
+
+
+def test_create_annotations_from_output_with_reversed_relations(documents):
+    taskmodule = get_taskmodule(reversed_relation_label_suffix="_reversed")
+    taskmodule.prepare(documents)
+    task_encoding = taskmodule.encode(documents)[0]
+    candidate = task_encoding.metadata["candidate_annotations"][0]
+    annotations = list(
+        taskmodule.create_annotations_from_output(
+            task_encoding, {"labels": ["per:employee_of_reversed"], "probabilities": [0.9]}
+        )
+    )
+    assert len(annotations) == 1
+    name, relation = annotations[0]
+    assert name == "relations"
+    assert relation.head == candidate.tail
+    assert relation.tail == candidate.head
+    assert relation.label == "per:employee_of"
+    assert relation.score == 0.9
+
+    # the none label is not added
+    annotations = list(
+        taskmodule.create_annotations_from_output(
+            task_encoding, {"labels": ["no_relation"], "probabilities": [0.9]}
+        )
+    )
+    assert annotations == []
@@ -197,6 +197,38 @@ def test_unpatch_output(unbatched_outputs):
     ]
 
 
+def test_unbatch_output_from_encoded_targets(taskmodule):
+    target_strings = [
+        "<triplet> SOSV <subj> IndieBio <obj> subsidiary",
+        "<triplet> SOSV <subj> IndieBio <obj> subsidiary <subj> Po Bronson <obj> employer",
+        "",
+    ]
+    sequences = [taskmodule.encode_text(target)["input_ids"] for target in target_strings]
+    max_length = max(len(sequence) for sequence in sequences)
+    padded = torch.tensor(
+        [
+            sequence + [taskmodule.tokenizer.pad_token_id] * (max_length - len(sequence))
+            for sequence in sequences
+        ]
+    )
+
+    unbatched_outputs = taskmodule.unbatch_output(padded)
+    assert unbatched_outputs == [
+        [{"head": "SOSV", "type": "subsidiary", "tail": "IndieBio"}],
+        [
+            {"head": "SOSV", "type": "subsidiary", "tail": "IndieBio"},
+            {"head": "SOSV", "type": "employer", "tail": "Po Bronson"},
+        ],
+        [],
+    ]
+    # the batched path gives the same result as parsing the individually decoded strings
+    for sequence, unbatched_output in zip(sequences, unbatched_outputs):
+        decoded_string = taskmodule.tokenizer.decode(
+            sequence, skip_special_tokens=False, clean_up_tokenization_spaces=True
+        )
+        assert taskmodule._extract_triplets(decoded_string) == unbatched_output
+
+
 @pytest.fixture(scope="module")
 def annotations_from_output(taskmodule, task_encoding_without_targets, unbatched_outputs):
     task_encodings = [task_encoding_without_targets]
@@ -384,3 +416,138 @@ def test_collate(batch):
     torch.testing.assert_close(batch_encoding.input_ids, encoding_expected.input_ids)
     torch.testing.assert_close(batch_encoding.attention_mask, encoding_expected.attention_mask)
     torch.testing.assert_close(batch_encoding.labels, encoding_expected.labels)
+
+
+def test_annotations_from_output_closest_mentions(document):
+    taskmodule = TransformerSeq2SeqTaskModule(
+        tokenizer_name_or_path="Babelscape/rebel-large",
+        entity_annotation="entities",
+        relation_annotation="relations",
+        mention_alignment="closest",
+    )
+    task_encoding = taskmodule.encode_input(document)
+    task_output = [
+        {"head": "IndieBio", "type": "parent organization", "tail": "SOSV"},
+        # regex metacharacters are not a problem
+        {"head": "alt-chicken (wing", "type": "no match", "tail": "SOSV"},
+        {"head": "super tasty", "type": "no_relation", "tail": "alt-chicken wing"},
+    ]
+    annotations = list(taskmodule.create_annotations_from_output(task_encoding, task_output))
+    assert annotations == [
+        ("entities", LabeledSpan(start=126, end=134, label="head")),
+        ("entities", LabeledSpan(start=96, end=100, label="tail")),
+        (
+            "relations",
+            BinaryRelation(
+                head=LabeledSpan(start=126, end=134, label="head"),
+                tail=LabeledSpan(start=96, end=100, label="tail"),
+                label="parent organization",
+            ),
+        ),
+    ]
+
+
+def test_encode_chunks():
+    taskmodule = TransformerSeq2SeqTaskModule(
+        tokenizer_name_or_path="Babelscape/rebel-large",
+        entity_annotation="entities",
+        relation_annotation="relations",
+        chunk_size=6,
+        chunk_overlap=2,
+    )
+    document = ExampleDocument("Alice works for Acme. Bob lives in Paris. Acme is based in Paris.")
+    acme = LabeledSpan(start=16, end=20, label="org")
+    paris = LabeledSpan(start=35, end=40, label="loc")
+    document.entities.extend([acme, paris])
+    document.relations.append(BinaryRelation(head=acme, tail=paris, label="based_in"))
+
+    task_encodings = taskmodule.encode(document, encode_target=True)
+    chunk_spans = [task_encoding.metadata["chunk_span"] for task_encoding in task_encodings]
+    chunk_texts = [document.text[start:end] for start, end in chunk_spans]
+    tokenizer = taskmodule.tokenizer
+    input_ids = tokenizer(document.text, add_special_tokens=False)["input_ids"]
+    # windows of 6 tokens with a stride of 4 tokens
+    assert len(task_encodings) == len(range(0, len(input_ids) - 2, 4))
+    for idx, task_encoding in enumerate(task_encodings):
+        assert task_encoding.inputs["input_ids"] == tokenizer.build_inputs_with_special_tokens(
+            input_ids[idx * 4 : idx * 4 + 6]
+        )
+    assert chunk_texts[0].startswith("Alice")
+    assert chunk_texts[-1].endswith("Paris.")
+    # consecutive chunks overlap
+    for (_, previous_end), (start, _) in zip(chunk_spans, chunk_spans[1:]):
+        assert start < previous_end
+
+    # only chunks that contain both arguments have the relation as target
+    target_strings = [
+        tokenizer.decode(task_encoding.targets["labels"], skip_special_tokens=True)
+        for task_encoding in task_encodings
+    ]
+    for (start, end), target_string in zip(chunk_spans, target_strings):
+        if start <= acme.start and paris.end <= end:
+            assert target_string == "<triplet> Acme <subj> Paris <obj> based_in"
+        else:
+            assert target_string == ""
+
+
+def test_decode_chunks():
+    taskmodule = TransformerSeq2SeqTaskModule(
+        tokenizer_name_or_path="Babelscape/rebel-large",
+        entity_annotation="entities",
+        relation_annotation="relations",
+        partition_annotation="sentences",
+    )
+
+    @dataclass
+    class ExampleDocumentWithSentences(ExampleDocument):
+        sentences: AnnotationLayer[LabeledSpan] = annotation_field(target="text")
+
+    document = ExampleDocumentWithSentences(
+        "Bob lives in Paris. Alice works for Acme. Acme is based in Paris."
+    )
+    document.sentences.extend(
+        [
+            LabeledSpan(start=0, end=19, label="sentence"),
+            LabeledSpan(start=20, end=41, label="sentence"),
+            LabeledSpan(start=42, end=65, label="sentence"),
+        ]
+    )
+    task_encodings = taskmodule.encode(document, encode_target=False)
+    assert [task_encoding.metadata["chunk_span"] for task_encoding in task_encodings] == [
+        (0, 19),
+        (20, 41),
+        (42, 65),
+    ]
+
+    task_outputs = [
+        [{"head": "Bob", "type": "lives_in", "tail": "Paris"}],
+        [{"head": "Alice", "type": "works_for", "tail": "Acme"}],
+        [
+            {"head": "Acme", "type": "based_in", "tail": "Paris"},
+            # duplicates are added only once
+            {"head": "Acme", "type": "based_in", "tail": "Paris"},
+        ],
+    ]
+    taskmodule.decode(task_encodings=task_encodings, task_outputs=task_outputs)
+
+    # the mentions are searched in the respective chunk only
+    relations = [
+        (rel.head.start, rel.head.end, rel.label, rel.tail.start, rel.tail.end)
+        for rel in document.relations.predictions
+    ]
+    assert relations == [
+        (0, 3, "lives_in", 13, 18),
+        (20, 25, "works_for", 36, 40),
+        (42, 46, "based_in", 59, 64),
+    ]
+    assert len(document.entities.predictions) == 6
+    for relation in document.relations.predictions:
+        assert relation.head in document.entities.predictions
+        assert relation.tail in document.entities.predictions
+
+
+def test_chunk_overlap_validation():
+    with pytest.raises(ValueError, match="chunk_overlap has to be at least 0"):
+        TransformerSeq2SeqTaskModule(
+            tokenizer_name_or_path="Babelscape/rebel-large", chunk_size=4, chunk_overlap=4
+        )
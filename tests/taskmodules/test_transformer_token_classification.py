@@ -4,6 +4,7 @@ from typing import Any, Dict, List
 import numpy as np
 import pytest
 import torch
+import transformers
 from transformers import BatchEncoding
 
 from pytorch_ie import AnnotationLayer, Document, annotation_field
@@ -667,23 +668,10 @@ def test_unbatch_output(unbatched_outputs, config):
     # Based on the config, perform assertions for each unbatched output
     if config == {}:
         # Assertions for the first unbatched output
-        assert unbatched_outputs[0]["tags"] == [
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-        ]
-        assert np.all(
-            unbatched_outputs[0]["probabilities"]
-            == np.array(
+        assert unbatched_outputs[0]["tag_ids"].tolist() == [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
+        np.testing.assert_allclose(
+            unbatched_outputs[0]["tag_probabilities"],
+            np.array(
                 [
                     [0.344457, 0.37422952, 0.2813134],
                     [0.33258897, 0.4067535, 0.26065755],
@@ -699,26 +687,14 @@ def test_unbatch_output(unbatched_outputs, config):
                     [0.29483712, 0.41835198, 0.2868109],
                 ],
                 dtype=np.float32,
-            )
+            ).max(axis=-1),
+            rtol=1e-3,
         )
         # Assertions for the second unbatched output
-        assert unbatched_outputs[1]["tags"] == [
-            "I-head",
-            "O",
-            "I-head",
-            "I-head",
-            "I-head",
-            "B-head",
-            "B-head",
-            "I-head",
-            "B-head",
-            "I-head",
-            "B-head",
-            "I-head",
-        ]
-        assert np.all(
-            unbatched_outputs[1]["probabilities"]
-            == np.array(
+        assert unbatched_outputs[1]["tag_ids"].tolist() == [2, 0, 2, 2, 2, 1, 1, 2, 1, 2, 1, 2]
+        np.testing.assert_allclose(
+            unbatched_outputs[1]["tag_probabilities"],
+            np.array(
                 [
                     [0.3340577, 0.2765008, 0.38944152],
                     [0.35078698, 0.30848682, 0.34072617],
@@ -734,24 +710,16 @@ def test_unbatch_output(unbatched_outputs, config):
                     [0.2840267, 0.33521372, 0.38075963],
                 ],
                 dtype=np.float32,
-            )
+            ).max(axis=-1),
+            rtol=1e-3,
         )
 
     elif config == {"max_window": 8, "window_overlap": 2}:
         # Assertions for the first unbatched output
-        assert unbatched_outputs[0]["tags"] == [
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-        ]
-        assert np.all(
-            unbatched_outputs[0]["probabilities"]
-            == np.array(
+        assert unbatched_outputs[0]["tag_ids"].tolist() == [1, 1, 1, 1, 1, 1, 1, 1]
+        np.testing.assert_allclose(
+            unbatched_outputs[0]["tag_probabilities"],
+            np.array(
                 [
                     [0.25920436, 0.4165126, 0.32428306],
                     [0.25796065, 0.3919785, 0.35006085],
@@ -763,22 +731,14 @@ def test_unbatch_output(unbatched_outputs, config):
                     [0.26410252, 0.43503976, 0.30085772],
                 ],
                 dtype=np.float32,
-            )
+            ).max(axis=-1),
+            rtol=1e-3,
         )
         # Assertions for the second unbatched output
-        assert unbatched_outputs[1]["tags"] == [
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-            "B-head",
-        ]
-        assert np.all(
-            unbatched_outputs[1]["probabilities"]
-            == np.array(
+        assert unbatched_outputs[1]["tag_ids"].tolist() == [1, 1, 1, 1, 1, 1, 1, 1]
+        np.testing.assert_allclose(
+            unbatched_outputs[1]["tag_probabilities"],
+            np.array(
                 [
                     [0.29714355, 0.41776344, 0.28509298],
                     [0.26629514, 0.4108816, 0.3228233],
@@ -790,24 +750,16 @@ def test_unbatch_output(unbatched_outputs, config):
                     [0.24946368, 0.39914045, 0.35139585],
                 ],
                 dtype=np.float32,
-            )
+            ).max(axis=-1),
+            rtol=1e-3,
         )
 
     elif config == {"max_window": 8}:
         # Assertions for the first unbatched output
-        assert unbatched_outputs[0]["tags"] == [
-            "I-head",
-            "I-head",
-            "I-head",
-            "I-head",
-            "I-head",
-            "I-head",
-            "B-head",
-            "B-head",
-        ]
-        assert np.all(
-            unbatched_outputs[0]["probabilities"]
-            == np.array(
+        assert unbatched_outputs[0]["tag_ids"].tolist() == [2, 2, 2, 2, 2, 2, 1, 1]
+        np.testing.assert_allclose(
+            unbatched_outputs[0]["tag_probabilities"],
+            np.array(
                 [
                     [0.23163259, 0.37968898, 0.38867846],
                     [0.25297666, 0.33737573, 0.4096476],
@@ -819,23 +771,15 @@ def test_unbatch_output(unbatched_outputs, config):
                     [0.27994624, 0.39710376, 0.32295004],
                 ],
                 dtype=np.float32,
-            )
+            ).max(axis=-1),
+            rtol=1e-3,
         )
 
         # Assertions for the second unbatched output
-        assert unbatched_outputs[1]["tags"] == [
-            "I-head",
-            "I-head",
-            "I-head",
-            "I-head",
-            "I-head",
-            "B-head",
-            "I-head",
-            "B-head",
-        ]
-        assert np.all(
-            unbatched_outputs[1]["probabilities"]
-            == np.array(
+        assert unbatched_outputs[1]["tag_ids"].tolist() == [2, 2, 2, 2, 2, 1, 2, 1]
+        np.testing.assert_allclose(
+            unbatched_outputs[1]["tag_probabilities"],
+            np.array(
                 [
                     [0.2381951, 0.37423733, 0.38756755],
                     [0.25990984, 0.336849, 0.40324116],
@@ -847,23 +791,16 @@ def test_unbatch_output(unbatched_outputs, config):
                     [0.29481572, 0.35650578, 0.34867856],
                 ],
                 dtype=np.float32,
-            )
+            ).max(axis=-1),
+            rtol=1e-3,
         )
 
     elif config == {"partition_annotation": "sentences"}:
         # Assertions for the first unbatched output
-        assert unbatched_outputs[0]["tags"] == [
-            "O",
-            "B-head",
-            "O",
-            "O",
-            "O",
-            "I-head",
-            "B-head",
-        ]
-        assert np.all(
-            unbatched_outputs[0]["probabilities"]
-            == np.array(
+        assert unbatched_outputs[0]["tag_ids"].tolist() == [0, 1, 0, 0, 0, 2, 1]
+        np.testing.assert_allclose(
+            unbatched_outputs[0]["tag_probabilities"],
+            np.array(
                 [
                     [0.4243444, 0.30739865, 0.26825696],
                     [0.3272056, 0.35420957, 0.31858483],
@@ -874,22 +811,15 @@ def test_unbatch_output(unbatched_outputs, config):
                     [0.33785096, 0.36719933, 0.29494968],
                 ],
                 dtype=np.float32,
-            )
+            ).max(axis=-1),
+            rtol=1e-3,
         )
 
         # Assertions for the second unbatched output
-        assert unbatched_outputs[1]["tags"] == [
-            "O",
-            "B-head",
-            "O",
-            "O",
-            "O",
-            "I-head",
-            "B-head",
-        ]
-        assert np.all(
-            unbatched_outputs[1]["probabilities"]
-            == np.array(
+        assert unbatched_outputs[1]["tag_ids"].tolist() == [0, 1, 0, 0, 0, 2, 1]
+        np.testing.assert_allclose(
+            unbatched_outputs[1]["tag_probabilities"],
+            np.array(
                 [
                     [0.4243444, 0.30739865, 0.26825696],
                     [0.3272056, 0.35420957, 0.31858483],
@@ -900,7 +830,8 @@ def test_unbatch_output(unbatched_outputs, config):
                     [0.33785096, 0.36719933, 0.29494968],
                 ],
                 dtype=np.float32,
-            )
+            ).max(axis=-1),
+            rtol=1e-3,
         )
 
     else:
@@ -1040,3 +971,158 @@ def test_annotations_from_output(annotations_from_output, config):
 
     else:
         raise ValueError(f"unknown config: {config}")
+
+
+def test_unbatch_output_top_k_and_full_probabilities(documents):
+    taskmodule = TransformerTokenClassificationTaskModule(
+        tokenizer_name_or_path="bert-base-uncased",
+        entity_annotation="entities",
+        top_k=2,
+        return_full_probabilities=True,
+    )
+    taskmodule.prepare(documents)
+    logits = torch.tensor(
+        [[[0.1, 0.5, -0.2], [1.0, -1.0, 0.0]], [[0.0, 0.0, 2.0], [0.3, 0.2, 0.1]]]
+    )
+    probabilities = torch.softmax(logits, dim=-1).numpy()
+
+    unbatched_outputs = taskmodule.unbatch_output({"logits": logits})
+    assert len(unbatched_outputs) == 2
+    output = unbatched_outputs[0]
+    assert output["tag_ids"].dtype == np.int16
+    assert output["tag_probabilities"].dtype == np.float16
+    assert output["tag_ids"].tolist() == [1, 0]
+    assert output["top_k_tag_ids"].tolist() == [[1, 0], [0, 2]]
+    np.testing.assert_allclose(
+        output["top_k_probabilities"],
+        np.sort(probabilities[0], axis=-1)[:, ::-1][:, :2],
+        rtol=1e-3,
+    )
+    np.testing.assert_array_equal(output["probabilities"], probabilities[0])
+    assert unbatched_outputs[1]["tag_ids"].tolist() == [2, 0]
+
+
+def test_pack_partitions():
+    doc = ExampleDocument(text="Alice loves reading books. Bob enjoys playing soccer. Hello.")
+    doc.sentences.extend([Span(start=0, end=26), Span(start=27, end=53), Span(start=54, end=60)])
+    doc.entities.extend(
+        [LabeledSpan(start=0, end=5, label="head"), LabeledSpan(start=27, end=30, label="head")]
+    )
+    taskmodule = TransformerTokenClassificationTaskModule(
+        tokenizer_name_or_path="bert-base-uncased",
+        entity_annotation="entities",
+        partition_annotation="sentences",
+        pack_partitions=True,
+        max_length=16,
+        block_diagonal_attention=True,
+    )
+    taskmodule.prepare([doc])
+
+    task_encodings = taskmodule.encode([doc], encode_target=True)
+    # the first two sentences fit into one sequence of max_length, the last one does not
+    assert len(task_encodings) == 2
+    tokens = taskmodule.tokenizer.convert_ids_to_tokens(task_encodings[0].inputs["input_ids"])
+    assert tokens == [
+        "[CLS]",
+        "alice",
+        "loves",
+        "reading",
+        "books",
+        ".",
+        "[SEP]",
+        "[CLS]",
+        "bob",
+        "enjoys",
+        "playing",
+        "soccer",
+        ".",
+        "[SEP]",
+    ]
+    assert task_encodings[0].metadata["segments"] == [(0, 0, 7), (1, 7, 14)]
+    assert task_encodings[1].metadata["segments"] == [(2, 0, 4)]
+    labels = [
+        taskmodule.id_to_label[x] if x != -100 else "<pad>" for x in task_encodings[0].targets
+    ]
+    assert labels == ["<pad>", "B-head", "O", "O", "O", "O", "<pad>"] * 2
+
+    inputs, targets = taskmodule.collate(task_encodings)
+    assert inputs["attention_mask"].shape == (2, 14, 14)
+    # tokens of different segments do not attend to each other
+    assert inputs["attention_mask"][0, 0].tolist() == [1] * 7 + [0] * 7
+    assert inputs["attention_mask"][0, 7].tolist() == [0] * 7 + [1] * 7
+    # padding
+    assert inputs["attention_mask"][1, 0].tolist() == [1] * 4 + [0] * 10
+    assert inputs["position_ids"][0].tolist() == list(range(7)) * 2
+    assert targets.shape == (2, 14)
+
+    # predict the gold labels and check that the annotations are split at the segment boundaries
+    logits = torch.nn.functional.one_hot(
+        torch.tensor(task_encodings[0].targets).clamp(min=0), num_classes=3
+    ).float()
+    task_output = taskmodule.unbatch_output({"logits": logits.unsqueeze(0)})[0]
+    annotations = list(taskmodule.create_annotations_from_output(task_encodings[0], task_output))
+    assert sorted(annotations, key=lambda x: x[1].start) == [
+        ("entities", LabeledSpan(start=0, end=5, label="head")),
+        ("entities", LabeledSpan(start=27, end=30, label="head")),
+    ]
+
+
+@pytest.mark.parametrize("position_ids_start", [None, 2])
+def test_pack_partitions_position_ids_start(position_ids_start):
+    doc = ExampleDocument(text="Alice loves reading books. Bob enjoys playing soccer. Hello.")
+    doc.sentences.extend([Span(start=0, end=26), Span(start=27, end=53), Span(start=54, end=60)])
+    taskmodule = TransformerTokenClassificationTaskModule(
+        tokenizer_name_or_path="bert-base-uncased",
+        entity_annotation="entities",
+        partition_annotation="sentences",
+        pack_partitions=True,
+        max_length=16,
+        block_diagonal_attention=True,
+        position_ids_start=position_ids_start,
+    )
+    taskmodule.prepare([doc])
+
+    inputs, _ = taskmodule.collate(taskmodule.encode([doc]))
+    assert inputs["attention_mask"].shape == (2, 14, 14)
+    if position_ids_start is None:
+        assert "position_ids" not in inputs
+    else:
+        # e.g. RoBERTa-like models expect the positions to start at padding_idx + 1
+        assert inputs["position_ids"][0].tolist() == list(range(2, 9)) * 2
+        assert inputs["position_ids"][1].tolist() == list(range(2, 6)) + [2] * 10
+
+
+@pytest.mark.parametrize("model_type", ["bert", "roberta", "distilbert"])
+def test_pack_partitions_default_position_ids_start(monkeypatch, model_type):
+    class MockConfig:
+        def __init__(self, model_type):
+            self.model_type = model_type
+
+    monkeypatch.setattr(
+        transformers.AutoConfig,
+        "from_pretrained",
+        lambda pretrained_model_name_or_path: MockConfig(model_type),
+    )
+    kwargs = dict(
+        tokenizer_name_or_path="bert-base-uncased",
+        entity_annotation="entities",
+        partition_annotation="sentences",
+        pack_partitions=True,
+        max_length=16,
+        block_diagonal_attention=True,
+    )
+    if model_type == "distilbert":
+        # the position ids can not be derived
+        with pytest.raises(ValueError, match="can not derive position_ids_start"):
+            TransformerTokenClassificationTaskModule(**kwargs)
+        # but they can be disabled explicitly
+        taskmodule = TransformerTokenClassificationTaskModule(position_ids_start=None, **kwargs)
+        assert taskmodule.position_ids_start is None
+        return
+
+    taskmodule = TransformerTokenClassificationTaskModule(**kwargs)
+    if model_type == "bert":
+        assert taskmodule.position_ids_start == 0
+    else:
+        # RoBERTa-like models start after the padding index
+        assert taskmodule.position_ids_start == taskmodule.tokenizer.pad_token_id + 1
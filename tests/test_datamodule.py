@@ -0,0 +1,383 @@
+import os
+
+import pytest
+import torch
+from pie_core import TaskEncoding
+
+from pytorch_ie import DocumentGroupedSampler, LazyTaskEncodingDataset, PieDataModule
+from pytorch_ie.taskmodules import (
+    TransformerRETextClassificationTaskModule,
+    TransformerTokenClassificationTaskModule,
+)
+from pytorch_ie.utils.compact_encoding import CompactTaskEncoding
+from pytorch_ie.utils.encoding_cache import (
+    CachedTaskEncodingSequence,
+    is_cached,
+    save_task_encodings,
+)
+from pytorch_ie.utils.parallel_encoding import AnnotationReference
+from tests.conftest import _assert_equal_batches
+
+
+def test_datamodule_with_cache(taskmodule, document_dataset, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    datamodule = PieDataModule(
+        taskmodule=taskmodule,
+        dataset=document_dataset,
+        val_split="val",
+        cache_dir=cache_dir,
+        batch_size=4,
+    )
+    datamodule.prepare_data()
+    cache_path = datamodule.get_cache_path("train")
+    assert is_cached(cache_path)
+    assert sorted(os.listdir(cache_dir)) == sorted(
+        os.path.basename(datamodule.get_cache_path(split)) for split in ["train", "val", "test"]
+    )
+
+    # a new datamodule (e.g. on another rank or in another run) does not encode the documents
+    # again, but loads the cached encodings
+    datamodule = PieDataModule(
+        taskmodule=taskmodule,
+        dataset=document_dataset,
+        val_split="val",
+        cache_dir=cache_dir,
+        batch_size=4,
+    )
+
+    def encode(*args, **kwargs):
+        raise AssertionError("the documents should not be encoded")
+
+    with monkeypatch.context() as m:
+        m.setattr(taskmodule, "encode", encode)
+        datamodule.prepare_data()
+        datamodule.setup(stage="fit")
+
+    expected_encodings = taskmodule.encode(document_dataset["train"], encode_target=True)
+    assert datamodule.num_train == len(expected_encodings)
+    cached_encodings = datamodule.data_split("train")
+    for encoding, expected_encoding in zip(cached_encodings, expected_encodings):
+        assert encoding.inputs == expected_encoding.inputs
+        assert encoding.targets == expected_encoding.targets
+        assert set(encoding.metadata) == set(expected_encoding.metadata)
+        assert encoding.document is expected_encoding.document
+        # the char_to_token_mapper is rebuilt from the offsets
+        mapper = encoding.metadata["char_to_token_mapper"]
+        expected_mapper = expected_encoding.metadata["char_to_token_mapper"]
+        assert [mapper(idx) for idx in range(len(encoding.document.text))] == [
+            expected_mapper(idx) for idx in range(len(encoding.document.text))
+        ]
+    assert {"metadata/offset_mapping", "metadata/special_tokens_mask"} <= set(
+        cached_encodings._encodings.manifest["fields"]
+    )
+    _assert_equal_batches(
+        taskmodule.collate(cached_encodings[:4]), taskmodule.collate(expected_encodings[:4])
+    )
+    # the dataloaders work with the cached encodings
+    assert len(list(datamodule.val_dataloader())) == 1
+
+    # the cache is not used if the taskmodule config changes
+    other_taskmodule = TransformerTokenClassificationTaskModule(
+        tokenizer_name_or_path="bert-base-cased", entity_annotation="entities", max_length=8
+    )
+    other_taskmodule.prepare(document_dataset["train"])
+    datamodule = PieDataModule(
+        taskmodule=other_taskmodule,
+        dataset=document_dataset,
+        val_split="val",
+        cache_dir=cache_dir,
+    )
+    assert datamodule.get_cache_path("train") != cache_path
+    assert not is_cached(datamodule.get_cache_path("train"))
+
+
+def test_datamodule_with_cache_on_other_rank(taskmodule, document_dataset, tmp_path, monkeypatch):
+    datamodule = PieDataModule(
+        taskmodule=taskmodule, dataset=document_dataset, val_split="val", cache_dir=str(tmp_path)
+    )
+    datamodule.prepare_data()
+    fingerprints = {split: datamodule.get_fingerprint(split) for split in ["train", "val"]}
+
+    # the other ranks get the fingerprints from rank 0 instead of hashing the documents
+    def broadcast_object_list(objects, src):
+        assert src == 0
+        objects[0] = dict(fingerprints)
+
+    monkeypatch.setattr(torch.distributed, "is_initialized", lambda: True)
+    monkeypatch.setattr(torch.distributed, "get_rank", lambda: 1)
+    monkeypatch.setattr(torch.distributed, "broadcast_object_list", broadcast_object_list)
+    datamodule = PieDataModule(
+        taskmodule=taskmodule, dataset=document_dataset, val_split="val", cache_dir=str(tmp_path)
+    )
+    monkeypatch.setattr(
+        "pytorch_ie.datamodule.get_encoding_fingerprint",
+        lambda *args, **kwargs: pytest.fail("the documents should not be hashed"),
+    )
+    datamodule.setup(stage="fit")
+    assert isinstance(datamodule.data_split("train")._encodings, CachedTaskEncodingSequence)
+
+
+def test_save_and_load_task_encodings(documents, tmp_path):
+    task_encodings = []
+    for idx, document in enumerate(documents):
+        inputs = {
+            "input_ids": list(range(idx)),
+            "tensor": torch.arange(idx),
+            "matrix": torch.ones(idx, 2, dtype=torch.float32),
+            # nested lists are not stored as arrays
+            "nested": [[idx]],
+        }
+        task_encodings.append(
+            TaskEncoding(document=document, inputs=inputs, targets=idx % 2, metadata={"idx": idx})
+        )
+    path = str(tmp_path / "encodings")
+    save_task_encodings(task_encodings, path=path, documents=documents)
+
+    loaded = CachedTaskEncodingSequence(path, documents=documents)
+    assert set(loaded.manifest["fields"]) == {"inputs/input_ids", "inputs/tensor", "inputs/matrix"}
+    assert len(loaded) == len(task_encodings)
+    for encoding, expected_encoding in zip(loaded, task_encodings):
+        assert list(encoding.inputs) == list(expected_encoding.inputs)
+        assert encoding.inputs["input_ids"] == expected_encoding.inputs["input_ids"]
+        torch.testing.assert_close(encoding.inputs["tensor"], expected_encoding.inputs["tensor"])
+        torch.testing.assert_close(encoding.inputs["matrix"], expected_encoding.inputs["matrix"])
+        assert encoding.inputs["nested"] == expected_encoding.inputs["nested"]
+        assert encoding.targets == expected_encoding.targets
+        assert encoding.metadata == expected_encoding.metadata
+        assert encoding.document is expected_encoding.document
+    assert [encoding.metadata["idx"] for encoding in loaded[1:3]] == [1, 2]
+
+    # without documents, the encodings have no document
+    loaded = CachedTaskEncodingSequence(path)
+    assert not loaded[0].has_document
+
+
+def test_save_and_load_task_encodings_with_annotations(documents, tmp_path):
+    taskmodule = TransformerRETextClassificationTaskModule(
+        tokenizer_name_or_path="bert-base-cased",
+        relation_annotation="relations",
+        create_relation_candidates=True,
+    )
+    taskmodule.prepare(documents)
+    task_encodings = taskmodule.encode(documents, encode_target=True)
+    path = str(tmp_path / "encodings")
+    save_task_encodings(task_encodings, path=path, documents=documents)
+
+    loaded = CachedTaskEncodingSequence(path, documents=documents)
+    # the annotations are stored as references to the documents, so the documents are not pickled
+    pickled_candidates = [obj["metadata"]["candidate_annotation"] for obj in loaded._objects]
+    # relations of the documents are replaced completely
+    assert isinstance(pickled_candidates[0], AnnotationReference)
+    # new candidate relations keep only references to their arguments
+    new_candidates = [
+        candidate
+        for candidate in pickled_candidates
+        if not isinstance(candidate, AnnotationReference)
+    ]
+    assert len(new_candidates) > 0
+    for candidate in new_candidates:
+        assert isinstance(candidate.head, AnnotationReference)
+        assert isinstance(candidate.tail, AnnotationReference)
+    for encoding, expected_encoding in zip(loaded, task_encodings):
+        candidate = encoding.metadata["candidate_annotation"]
+        expected_candidate = expected_encoding.metadata["candidate_annotation"]
+        assert candidate == expected_candidate
+        assert candidate.head is expected_candidate.head
+        assert candidate.tail is expected_candidate.tail
+
+
+def test_datamodule_with_encode_workers(taskmodule, document_dataset):
+    datamodule = PieDataModule(
+        taskmodule=taskmodule,
+        dataset=document_dataset,
+        val_split="val",
+        num_encode_workers=2,
+    )
+    datamodule.setup(stage="fit")
+    expected_encodings = taskmodule.encode(document_dataset["train"], encode_target=True)
+    encodings = datamodule.data_split("train")
+    assert len(encodings) == len(expected_encodings)
+    for encoding, expected_encoding in zip(encodings, expected_encodings):
+        assert encoding.document is expected_encoding.document
+        assert encoding.inputs == expected_encoding.inputs
+        assert encoding.targets == expected_encoding.targets
+
+
+class ReIterableDocuments:
+    """Documents that are not a sequence, but can be iterated multiple times (e.g. a streamed
+    dataset)."""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __iter__(self):
+        return iter(self.documents)
+
+
+def test_datamodule_with_iterable_dataset(taskmodule, document_dataset):
+    expected_encodings = taskmodule.encode(document_dataset["train"], encode_target=True)
+    dataset = {"train": ReIterableDocuments(document_dataset["train"])}
+    datamodule = PieDataModule(taskmodule=taskmodule, dataset=dataset, batch_size=1, num_workers=2)
+    datamodule.setup(stage="fit")
+    for _ in range(2):
+        batches = list(datamodule.train_dataloader())
+        # each dataloader worker encodes its own documents, so there are no duplicates
+        assert len(batches) == len(expected_encodings)
+        assert sorted(batch[0]["input_ids"].tolist() for batch in batches) == sorted(
+            [encoding.inputs["input_ids"]] for encoding in expected_encodings
+        )
+
+
+def test_datamodule_with_iterable_dataset_and_equalize_shards(
+    taskmodule, document_dataset, monkeypatch
+):
+    monkeypatch.setattr(torch.distributed, "is_initialized", lambda: True)
+    monkeypatch.setattr(torch.distributed, "get_world_size", lambda: 2)
+    expected_encodings = taskmodule.encode(document_dataset["train"], encode_target=True)
+    dataset = {"train": ReIterableDocuments(document_dataset["train"])}
+    num_batches_per_rank = []
+    for rank in range(2):
+        monkeypatch.setattr(torch.distributed, "get_rank", lambda: rank)
+        datamodule = PieDataModule(
+            taskmodule=taskmodule, dataset=dataset, batch_size=1, equalize_shards=True
+        )
+        datamodule.setup(stage="fit")
+        num_batches_per_rank.append(len(list(datamodule.train_dataloader())))
+    # all ranks get the same number of batches
+    assert num_batches_per_rank == [len(expected_encodings) // 2] * 2
+
+
+def test_datamodule_with_iterable_dataset_shuffle_and_bucketing(taskmodule, document_dataset):
+    expected_encodings = taskmodule.encode(document_dataset["train"], encode_target=True)
+    dataset = {"train": ReIterableDocuments(document_dataset["train"])}
+    datamodule = PieDataModule(
+        taskmodule=taskmodule,
+        dataset=dataset,
+        shuffle_buffer_size=4,
+        bucket_buffer_size=4,
+        seed=42,
+        batch_size=2,
+    )
+    datamodule.setup(stage="fit")
+    batches = list(datamodule.train_dataloader())
+    lengths = [
+        length for inputs, _ in batches for length in inputs["attention_mask"].sum(1).tolist()
+    ]
+    expected_lengths = [len(encoding.inputs["input_ids"]) for encoding in expected_encodings]
+    # all encodings are yielded, but not in the original order
+    assert sorted(lengths) == sorted(expected_lengths)
+    assert lengths != expected_lengths
+
+
+@pytest.mark.parametrize("persistent_workers", [False, True])
+def test_datamodule_with_iterable_dataset_shuffle_per_epoch(
+    taskmodule, document_dataset, persistent_workers
+):
+    dataset = {"train": ReIterableDocuments(document_dataset["train"])}
+    datamodule = PieDataModule(
+        taskmodule=taskmodule,
+        dataset=dataset,
+        shuffle_buffer_size=8,
+        seed=42,
+        batch_size=1,
+        num_workers=1,
+        persistent_workers=persistent_workers,
+    )
+    datamodule.setup(stage="fit")
+    dataloader = datamodule.train_dataloader()
+    epochs = [[batch[0]["input_ids"].tolist() for batch in dataloader] for _ in range(2)]
+    # the epoch reaches the dataset in the dataloader worker, so the order differs per epoch
+    assert sorted(epochs[0]) == sorted(epochs[1])
+    assert epochs[0] != epochs[1]
+
+    # the order of each epoch is deterministic
+    other_epochs = [
+        [batch[0]["input_ids"].tolist() for batch in datamodule.train_dataloader()]
+        for _ in range(2)
+    ]
+    assert other_epochs[0] == epochs[0]
+
+
+def test_datamodule_with_compact_encodings(taskmodule, document_dataset):
+    datamodule = PieDataModule(
+        taskmodule=taskmodule,
+        dataset=document_dataset,
+        val_split="val",
+        compact_encodings=True,
+        batch_size=4,
+    )
+    datamodule.setup(stage="fit")
+    expected_encodings = taskmodule.encode(document_dataset["train"], encode_target=True)
+    encodings = datamodule.data_split("train")
+    assert all(isinstance(encoding, CompactTaskEncoding) for encoding in encodings)
+    for encoding, expected_encoding in zip(encodings, expected_encodings):
+        assert encoding.document is expected_encoding.document
+        assert encoding.inputs["input_ids"].tolist() == expected_encoding.inputs["input_ids"]
+    _assert_equal_batches(
+        taskmodule.collate(encodings[:4]), taskmodule.collate(expected_encodings[:4])
+    )
+    # the dataloaders work with the compact encodings
+    assert len(list(datamodule.val_dataloader())) == 1
+
+
+def test_datamodule_with_lazy_encoding(taskmodule, document_dataset):
+    datamodule = PieDataModule(
+        taskmodule=taskmodule,
+        dataset=document_dataset,
+        val_split="val",
+        lazy_encoding=True,
+        batch_size=4,
+        num_workers=2,
+    )
+    datamodule.setup(stage="fit")
+    expected_encodings = taskmodule.encode(document_dataset["train"], encode_target=True)
+    assert isinstance(datamodule.data_split("train"), LazyTaskEncodingDataset)
+    assert datamodule.num_train == len(expected_encodings)
+    train_dataloader = datamodule.train_dataloader()
+    # the encodings of a document are kept together, see DocumentGroupedSampler
+    assert isinstance(train_dataloader.sampler, DocumentGroupedSampler)
+    batches = list(train_dataloader)
+    lengths = [
+        length for inputs, _ in batches for length in inputs["attention_mask"].sum(1).tolist()
+    ]
+    assert sorted(lengths) == sorted(
+        len(encoding.inputs["input_ids"]) for encoding in expected_encodings
+    )
+
+
+def test_datamodule_with_lazy_encoding_and_cache(
+    taskmodule, document_dataset, tmp_path, monkeypatch
+):
+    cache_dir = str(tmp_path / "cache")
+    kwargs = dict(
+        taskmodule=taskmodule,
+        dataset=document_dataset,
+        val_split="val",
+        lazy_encoding=True,
+        cache_dir=cache_dir,
+        batch_size=4,
+    )
+    datamodule = PieDataModule(**kwargs)
+    datamodule.prepare_data()
+    # only the index of the task encodings is cached
+    assert sorted(os.listdir(cache_dir)) == sorted(
+        os.path.basename(datamodule.get_index_path(split)) for split in ["train", "val", "test"]
+    )
+
+    # setup (e.g. on another rank) loads the index instead of encoding all documents
+    datamodule = PieDataModule(**kwargs)
+
+    def encode_inputs(*args, **kwargs):
+        raise AssertionError("the documents should not be encoded")
+
+    with monkeypatch.context() as m:
+        m.setattr(taskmodule, "encode_inputs", encode_inputs)
+        datamodule.prepare_data()
+        datamodule.setup(stage="fit")
+
+    expected_encodings = taskmodule.encode(document_dataset["train"], encode_target=True)
+    dataset = datamodule.data_split("train")
+    assert isinstance(dataset, LazyTaskEncodingDataset)
+    assert len(dataset) == len(expected_encodings)
+    for encoding, expected_encoding in zip(dataset, expected_encodings):
+        assert encoding.inputs == expected_encoding.inputs
@@ -0,0 +1,242 @@
+import itertools
+
+import pytest
+import torch
+from pie_core import TaskEncoding
+from torch.utils.data import DataLoader
+
+from pytorch_ie import (
+    DocumentGroupedSampler,
+    IterableTaskEncodingDataset,
+    LazyTaskEncodingDataset,
+)
+from pytorch_ie.dataset import build_encoding_index
+from pytorch_ie.taskmodules import TransformerRETextClassificationTaskModule
+
+
+def create_encodings(num: int = 10):
+    return (TaskEncoding(inputs=idx) for idx in range(num))
+
+
+def collate(task_encodings):
+    return [task_encoding.inputs for task_encoding in task_encodings]
+
+
+def get_inputs(dataloader):
+    return sorted(idx for batch in dataloader for idx in batch)
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_iterable_task_encoding_dataset(num_workers):
+    dataset = IterableTaskEncodingDataset(create_encodings)
+    dataloader = DataLoader(dataset, batch_size=3, num_workers=num_workers, collate_fn=collate)
+    # each encoding is yielded exactly once, also for multiple epochs
+    assert get_inputs(dataloader) == list(range(10))
+    assert get_inputs(dataloader) == list(range(10))
+
+
+def test_iterable_task_encoding_dataset_from_iterator():
+    dataset = IterableTaskEncodingDataset(create_encodings())
+    dataloader = DataLoader(dataset, batch_size=3, num_workers=2, collate_fn=collate)
+    assert get_inputs(dataloader) == list(range(10))
+
+
+def test_iterable_task_encoding_dataset_distributed(monkeypatch):
+    monkeypatch.setattr(torch.distributed, "is_initialized", lambda: True)
+    monkeypatch.setattr(torch.distributed, "get_world_size", lambda: 2)
+    inputs_per_rank = []
+    for rank in range(2):
+        monkeypatch.setattr(torch.distributed, "get_rank", lambda: rank)
+        dataset = IterableTaskEncodingDataset(create_encodings)
+        dataloader = DataLoader(dataset, batch_size=3, num_workers=2, collate_fn=collate)
+        inputs_per_rank.append(get_inputs(dataloader))
+    # four shards: two ranks with two workers each
+    assert inputs_per_rank == [[0, 1, 4, 5, 8, 9], [2, 3, 6, 7]]
+
+    # with equalize_shards, an incomplete last round of encodings is dropped
+    inputs_per_rank = []
+    for rank in range(2):
+        monkeypatch.setattr(torch.distributed, "get_rank", lambda: rank)
+        dataset = IterableTaskEncodingDataset(create_encodings, equalize_shards=True)
+        dataloader = DataLoader(dataset, batch_size=3, num_workers=2, collate_fn=collate)
+        inputs_per_rank.append(get_inputs(dataloader))
+    assert inputs_per_rank == [[0, 1, 4, 5], [2, 3, 6, 7]]
+
+    # without sharding, each rank gets all encodings
+    dataset = IterableTaskEncodingDataset(create_encodings, shard=False)
+    assert get_inputs(DataLoader(dataset, batch_size=3, collate_fn=collate)) == list(range(10))
+
+
+def create_encodings_with_lengths():
+    lengths = [7, 1, 9, 3, 2, 8, 5, 4, 6, 10, 12, 11]
+    return (TaskEncoding(inputs={"input_ids": list(range(length))}) for length in lengths)
+
+
+def test_iterable_task_encoding_dataset_shuffle_buffer():
+    dataset = IterableTaskEncodingDataset(create_encodings, shuffle_buffer_size=4, seed=42)
+    inputs = [task_encoding.inputs for task_encoding in dataset]
+    assert sorted(inputs) == list(range(10))
+    assert inputs != list(range(10))
+    # the order is deterministic for the same seed and epoch
+    assert [task_encoding.inputs for task_encoding in dataset] == inputs
+    dataset.set_epoch(1)
+    assert [task_encoding.inputs for task_encoding in dataset] != inputs
+
+    # a buffer of size 1 does not shuffle
+    dataset = IterableTaskEncodingDataset(create_encodings, shuffle_buffer_size=1)
+    assert [task_encoding.inputs for task_encoding in dataset] == list(range(10))
+
+
+def test_iterable_task_encoding_dataset_bucketing():
+    dataset = IterableTaskEncodingDataset(
+        create_encodings_with_lengths, bucket_buffer_size=6, bucket_batch_size=2, seed=42
+    )
+    dataloader = DataLoader(dataset, batch_size=2, collate_fn=collate)
+    batch_lengths = [[len(inputs["input_ids"]) for inputs in batch] for batch in dataloader]
+    # each batch contains encodings of similar length (neighbours after sorting each buffer)
+    assert sorted(sorted(lengths) for lengths in batch_lengths) == [
+        [1, 2],
+        [3, 7],
+        [4, 5],
+        [6, 10],
+        [8, 9],
+        [11, 12],
+    ]
+
+
+@pytest.fixture
+def re_taskmodule(documents):
+    taskmodule = TransformerRETextClassificationTaskModule(
+        tokenizer_name_or_path="bert-base-cased",
+        relation_annotation="relations",
+        create_relation_candidates=True,
+    )
+    taskmodule.prepare(documents)
+    return taskmodule
+
+
+@pytest.mark.parametrize("encode_target", [False, True])
+def test_lazy_task_encoding_dataset(re_taskmodule, documents, encode_target):
+    expected_encodings = re_taskmodule.encode(documents, encode_target=encode_target)
+    dataset = LazyTaskEncodingDataset(re_taskmodule, documents, encode_target=encode_target)
+    assert len(dataset) == len(expected_encodings)
+    # some documents have multiple encodings, others have none
+    document_indices = dataset.index[:, 0].tolist()
+    assert len(set(document_indices)) < len(document_indices)
+    assert len(set(document_indices)) < len(documents)
+    for encoding, expected_encoding in zip(dataset, expected_encodings):
+        assert encoding.document is expected_encoding.document
+        assert encoding.inputs == expected_encoding.inputs
+        assert encoding.metadata["candidate_annotation"] == (
+            expected_encoding.metadata["candidate_annotation"]
+        )
+        if encode_target:
+            assert encoding.targets == expected_encoding.targets
+        else:
+            assert not encoding.has_targets
+    assert [encoding.inputs for encoding in dataset[1:3]] == [
+        encoding.inputs for encoding in expected_encodings[1:3]
+    ]
+
+
+def test_lazy_task_encoding_dataset_with_dataloader(re_taskmodule, documents):
+    expected_encodings = re_taskmodule.encode(documents, encode_target=True)
+    dataset = LazyTaskEncodingDataset(re_taskmodule, documents, encode_target=True)
+    # the documents are encoded in the worker processes
+    dataloader = DataLoader(dataset, batch_size=2, num_workers=2, collate_fn=re_taskmodule.collate)
+    expected_dataloader = DataLoader(
+        expected_encodings, batch_size=2, collate_fn=re_taskmodule.collate
+    )
+    batches = list(dataloader)
+    expected_batches = list(expected_dataloader)
+    assert len(batches) == len(expected_batches)
+    for (inputs, targets), (expected_inputs, expected_targets) in zip(batches, expected_batches):
+        torch.testing.assert_close(inputs["input_ids"], expected_inputs["input_ids"])
+        torch.testing.assert_close(targets, expected_targets)
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_build_encoding_index(re_taskmodule, documents, num_workers):
+    expected_encodings = re_taskmodule.encode(documents, encode_target=True)
+    index = build_encoding_index(
+        re_taskmodule, documents, encode_target=True, num_workers=num_workers
+    )
+    document_indices = [documents.index(encoding.document) for encoding in expected_encodings]
+    assert index[:, 0].tolist() == document_indices
+    expected_encoding_indices = [
+        document_indices[:idx].count(document_idx)
+        for idx, document_idx in enumerate(document_indices)
+    ]
+    assert index[:, 1].tolist() == expected_encoding_indices
+
+
+def test_lazy_task_encoding_dataset_with_wrong_index(re_taskmodule, documents):
+    dataset = LazyTaskEncodingDataset(re_taskmodule, documents, index=[(0, 5)])
+    assert len(dataset) == 1
+    with pytest.raises(ValueError, match="the index refers to encoding 5"):
+        dataset[0]
+
+
+def test_document_grouped_sampler(re_taskmodule, documents, monkeypatch):
+    dataset = LazyTaskEncodingDataset(re_taskmodule, documents, encode_target=True)
+    encoded_documents = []
+    original_encode_inputs = re_taskmodule.encode_inputs
+
+    def encode_inputs(documents, *args, **kwargs):
+        encoded_documents.extend(documents)
+        return original_encode_inputs(documents, *args, **kwargs)
+
+    monkeypatch.setattr(re_taskmodule, "encode_inputs", encode_inputs)
+
+    sampler = DocumentGroupedSampler(dataset, seed=1)
+    orders = []
+    for epoch in range(2):
+        sampler.set_epoch(epoch)
+        order = list(sampler)
+        assert sorted(order) == list(range(len(dataset)))
+        # the encodings of each document are yielded one after another
+        document_indices = [int(dataset.index[idx, 0]) for idx in order]
+        assert len(set(document_indices)) == len(
+            [idx for idx, _ in itertools.groupby(document_indices)]
+        )
+        encoded_documents.clear()
+        encodings = [dataset[idx] for idx in order]
+        # each document is encoded only once
+        assert len(encoded_documents) == len(set(document_indices))
+        assert [encoding.document for encoding in encodings] == [
+            documents[idx] for idx in document_indices
+        ]
+        orders.append(order)
+    # the order depends on the epoch, but not on the sampler instance
+    assert orders[0] != orders[1]
+    other_sampler = DocumentGroupedSampler(dataset, seed=1)
+    other_sampler.set_epoch(1)
+    assert list(other_sampler) == orders[1]
+
+    sampler = DocumentGroupedSampler(dataset, shuffle=False)
+    assert list(sampler) == list(range(len(dataset)))
+
+
+@pytest.mark.parametrize("drop_last", [False, True])
+def test_document_grouped_sampler_distributed(re_taskmodule, documents, drop_last):
+    dataset = LazyTaskEncodingDataset(re_taskmodule, documents, encode_target=True)
+    full_order = list(DocumentGroupedSampler(dataset, num_replicas=1, rank=0))
+    num_replicas = 3
+    rank_orders = [
+        list(
+            DocumentGroupedSampler(
+                dataset, num_replicas=num_replicas, rank=rank, drop_last=drop_last
+            )
+        )
+        for rank in range(num_replicas)
+    ]
+    # all ranks get the same number of encodings
+    assert len({len(order) for order in rank_orders}) == 1
+    # in contiguous blocks of the shuffled order
+    concatenated = [idx for order in rank_orders for idx in order]
+    if drop_last:
+        assert concatenated == full_order[: len(concatenated)]
+        assert len(full_order) - len(concatenated) < num_replicas
+    else:
+        assert concatenated[: len(full_order)] == full_order
+        assert concatenated[len(full_order) :] == full_order[: len(concatenated) - len(full_order)]
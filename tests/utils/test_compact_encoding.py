@@ -0,0 +1,159 @@
+import pickle
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from pytorch_ie.annotations import LabeledSpan
+from pytorch_ie.documents import TextDocumentWithLabeledSpans
+from pytorch_ie.taskmodules import (
+    TransformerRETextClassificationTaskModule,
+    TransformerTokenClassificationTaskModule,
+)
+from pytorch_ie.utils.compact_encoding import (
+    CompactTaskEncoding,
+    compact_task_encodings,
+    to_int32_array,
+)
+from pytorch_ie.utils.parallel_encoding import AnnotationReference
+from tests.conftest import _assert_equal_batches
+
+
+def test_to_int32_array():
+    array = to_int32_array([1, 2, 3])
+    assert array.dtype == np.int32
+    assert array.tolist() == [1, 2, 3]
+    assert to_int32_array([(0, 1), (1, 3)]).shape == (2, 2)
+    assert to_int32_array(np.arange(3, dtype=np.int64)).dtype == np.int32
+    # values that can not be stored as int32 arrays are not converted
+    for value in [[], [[1], [2, 3]], [0.5], [True], [2**40], "text", 3]:
+        assert to_int32_array(value) is value
+
+
+def test_compact_task_encodings(taskmodule, documents):
+    task_encodings = taskmodule.encode(documents, encode_target=True)
+    compact_encodings = compact_task_encodings(task_encodings, documents=documents)
+    assert len(compact_encodings) == len(task_encodings)
+    for compact_encoding, task_encoding in zip(compact_encodings, task_encodings):
+        assert isinstance(compact_encoding, CompactTaskEncoding)
+        assert not hasattr(compact_encoding, "__dict__")
+        assert compact_encoding.document is task_encoding.document
+        assert set(compact_encoding.inputs) == set(task_encoding.inputs)
+        for key, value in compact_encoding.inputs.items():
+            assert value.dtype == np.int32
+            assert value.tolist() == list(task_encoding.inputs[key])
+        assert compact_encoding.targets.dtype == np.int32
+        assert compact_encoding.targets.tolist() == task_encoding.targets
+        metadata = compact_encoding.metadata
+        assert metadata["offset_mapping"].dtype == np.int32
+        assert metadata["offset_mapping"].tolist() == [
+            list(offsets) for offsets in task_encoding.metadata["offset_mapping"]
+        ]
+        # the char to token mapper does not reference the tokenizer output anymore, but gives
+        # the same result
+        document = task_encoding.document
+        char_to_token = task_encoding.metadata["char_to_token_mapper"]
+        assert [metadata["char_to_token_mapper"](idx) for idx in range(len(document.text))] == [
+            char_to_token(idx) for idx in range(len(document.text))
+        ]
+
+    _assert_equal_batches(
+        taskmodule.collate(compact_encodings[:4]), taskmodule.collate(task_encodings[:4])
+    )
+
+    # the targets can also be encoded from the compact encodings
+    compact_encodings = compact_task_encodings(taskmodule.encode(documents, encode_target=False))
+    for compact_encoding, task_encoding in zip(compact_encodings, task_encodings):
+        assert taskmodule.encode_target(compact_encoding) == task_encoding.targets
+
+
+def test_compact_task_encodings_pickle(taskmodule, documents):
+    task_encodings = taskmodule.encode(documents, encode_target=True)
+    compact_encodings = compact_task_encodings(task_encodings)
+    # the document is not pickled
+    assert documents[0].text.encode() in pickle.dumps(task_encodings[0])
+    assert documents[0].text.encode() not in pickle.dumps(compact_encodings[0])
+
+    loaded = pickle.loads(pickle.dumps(compact_encodings[0]))
+    assert loaded.inputs["input_ids"].tolist() == task_encodings[0].inputs["input_ids"]
+    assert not loaded.has_document
+    with pytest.raises(ValueError, match="document table"):
+        loaded.document
+    loaded.attach_document_table(documents)
+    assert loaded.document is documents[0]
+
+
+def test_compact_task_encodings_memory():
+    text = " ".join(f"Person{idx} works at Company{idx}." for idx in range(50))
+    document = TextDocumentWithLabeledSpans(text=text)
+    document.labeled_spans.append(LabeledSpan(start=0, end=7, label="PER"))
+    taskmodule = TransformerTokenClassificationTaskModule(
+        tokenizer_name_or_path="bert-base-cased", entity_annotation="labeled_spans"
+    )
+    taskmodule.prepare([document])
+    # warm up the tokenizer
+    taskmodule.encode([document], encode_target=True)
+
+    tracemalloc.start()
+    try:
+        task_encodings = taskmodule.encode([document], encode_target=True)
+        size = tracemalloc.get_traced_memory()[0]
+        compact_encodings = compact_task_encodings(task_encodings)
+        compact_size = tracemalloc.get_traced_memory()[0] - size
+    finally:
+        tracemalloc.stop()
+    assert len(compact_encodings) == 1
+    # this does not even include the memory of the tokenizer output (allocated by the Rust
+    # tokenizers library) that is released with the compact encodings
+    assert compact_size * 2 < size
+
+
+def test_compact_task_encodings_re(documents):
+    taskmodule = TransformerRETextClassificationTaskModule(
+        tokenizer_name_or_path="bert-base-cased", relation_annotation="relations"
+    )
+    taskmodule.prepare(documents)
+    task_encodings = taskmodule.encode(documents, encode_target=True)
+    compact_encodings = compact_task_encodings(task_encodings)
+    # the documents are collected in the order of the encodings
+    document_table = []
+    for task_encoding in task_encodings:
+        if not any(document is task_encoding.document for document in document_table):
+            document_table.append(task_encoding.document)
+    for compact_encoding, task_encoding in zip(compact_encodings, task_encodings):
+        assert compact_encoding.document is document_table[compact_encoding.document_index]
+    _assert_equal_batches(
+        taskmodule.collate(compact_encodings[:4]), taskmodule.collate(task_encodings[:4])
+    )
+
+
+def test_compact_task_encodings_re_pickle(documents):
+    taskmodule = TransformerRETextClassificationTaskModule(
+        tokenizer_name_or_path="bert-base-cased",
+        relation_annotation="relations",
+        create_relation_candidates=True,
+    )
+    taskmodule.prepare(documents)
+    task_encodings = taskmodule.encode(documents, encode_target=True)
+    compact_encodings = compact_task_encodings(task_encodings, documents=documents)
+    for compact_encoding, task_encoding in zip(compact_encodings, task_encodings):
+        candidate = compact_encoding.metadata["candidate_annotation"]
+        expected_candidate = task_encoding.metadata["candidate_annotation"]
+        assert candidate == expected_candidate
+        assert candidate.head is expected_candidate.head
+
+    # the candidate annotations are pickled as references, so the document is not pickled
+    compact_encoding = compact_encodings[0]
+    assert compact_encoding.document.text.encode() not in pickle.dumps(compact_encoding)
+    loaded = pickle.loads(pickle.dumps(compact_encoding))
+    assert isinstance(loaded.metadata["candidate_annotation"], AnnotationReference)
+    loaded.attach_document_table(documents)
+    assert loaded.metadata["candidate_annotation"] is (
+        compact_encoding.metadata["candidate_annotation"]
+    )
+
+
+def test_compact_task_encodings_unknown_document(taskmodule, documents):
+    task_encodings = taskmodule.encode(documents, encode_target=True)
+    with pytest.raises(ValueError, match="not contained in the documents"):
+        compact_task_encodings(task_encodings, documents=documents[1:])
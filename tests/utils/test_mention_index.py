@@ -0,0 +1,32 @@
+from pytorch_ie.utils.mention_index import MentionIndex, normalize_text
+
+TEXT = "Po Bronson, general partner at SOSV and  managing director of IndieBio (SOSV)."
+
+
+def test_normalize_text():
+    normalized, positions = normalize_text("A  b\nC")
+    assert normalized == "a b c"
+    assert positions == [0, 1, 3, 4, 5]
+
+
+def test_mention_index():
+    mention_index = MentionIndex(
+        text=TEXT, mentions=["sosv", "IndieBio", "(SOSV)", "Managing Director", "missing", ""]
+    )
+    assert mention_index.find_all("SOSV") == [(31, 35), (72, 76)]
+    assert mention_index.find_first("SOSV") == (31, 35)
+    # mentions are matched literally
+    assert mention_index.find_first("(SOSV)") == (71, 77)
+    # whitespace is normalized
+    start, end = mention_index.find_first("managing director")
+    assert TEXT[start:end] == "managing director"
+    assert mention_index.find_first("missing") is None
+    # mentions that were not indexed are not found
+    assert mention_index.find_first("Bronson") is None
+    assert mention_index.find_first("") is None
+
+
+def test_mention_index_find_closest_pair():
+    mention_index = MentionIndex(text=TEXT, mentions=["SOSV", "IndieBio"])
+    assert mention_index.find_closest_pair("SOSV", "IndieBio") == ((72, 76), (62, 70))
+    assert mention_index.find_closest_pair("SOSV", "missing") is None
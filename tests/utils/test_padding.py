@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+import torch
+from transformers import AutoTokenizer
+
+from pytorch_ie.utils.padding import (
+    get_padded_length,
+    pad_sequences,
+    pad_with_tokenizer_config,
+)
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    return AutoTokenizer.from_pretrained("bert-base-cased")
+
+
+@pytest.fixture(scope="module")
+def features(tokenizer):
+    texts = ["A short text.", "A somewhat longer text with more tokens.", "Medium length text."]
+    return [
+        dict(tokenizer(text, return_special_tokens_mask=True, return_token_type_ids=True))
+        for text in texts
+    ]
+
+
+def test_get_padded_length():
+    assert get_padded_length([3, 5, 2]) == 5
+    assert get_padded_length([3, 5, 2], padding="longest", max_length=10) == 5
+    assert get_padded_length([3, 5, 2], padding="max_length", max_length=10) == 10
+    assert get_padded_length([3, 5, 2], pad_to_multiple_of=4) == 8
+    assert get_padded_length([3, 3], padding=False, pad_to_multiple_of=4) == 3
+    with pytest.raises(ValueError, match="same length"):
+        get_padded_length([3, 5], padding=False)
+    with pytest.raises(ValueError, match="max_length is required"):
+        get_padded_length([3, 5], padding="max_length")
+
+
+@pytest.mark.parametrize("padding_side", ["right", "left"])
+def test_pad_sequences(padding_side):
+    sequences = [[1, 2], np.array([3, 4, 5], dtype=np.int32), []]
+    padded = pad_sequences(sequences, pad_value=-100, padding_side=padding_side)
+    assert padded.dtype == torch.int64
+    if padding_side == "right":
+        assert padded.tolist() == [[1, 2, -100], [3, 4, 5], [-100, -100, -100]]
+    else:
+        assert padded.tolist() == [[-100, 1, 2], [3, 4, 5], [-100, -100, -100]]
+    assert pad_sequences(sequences, pad_value=0, length=4).shape == (3, 4)
+    with pytest.raises(ValueError, match="can not pad sequences of length 3 to length 2"):
+        pad_sequences(sequences, pad_value=0, length=2)
+
+
+@pytest.mark.parametrize(
+    "padding,max_length,pad_to_multiple_of",
+    [(True, None, None), ("max_length", 32, None), ("longest", None, 8)],
+)
+@pytest.mark.parametrize("padding_side", ["right", "left"])
+@pytest.mark.parametrize("as_arrays", [False, True])
+def test_pad_with_tokenizer_config(
+    tokenizer, features, padding, max_length, pad_to_multiple_of, padding_side, as_arrays
+):
+    if as_arrays:
+        features = [
+            {key: np.asarray(value, dtype=np.int32) for key, value in feature.items()}
+            for feature in features
+        ]
+    tokenizer.padding_side = padding_side
+    try:
+        padded = pad_with_tokenizer_config(
+            tokenizer,
+            features,
+            padding=padding,
+            max_length=max_length,
+            pad_to_multiple_of=pad_to_multiple_of,
+        )
+        expected = tokenizer.pad(
+            features,
+            padding=padding,
+            max_length=max_length,
+            pad_to_multiple_of=pad_to_multiple_of,
+            return_tensors="pt",
+        )
+    finally:
+        tokenizer.padding_side = "right"
+    assert list(padded) == list(expected)
+    for key in expected:
+        torch.testing.assert_close(padded[key], expected[key])
+
+
+def test_pad_with_tokenizer_config_creates_attention_mask(tokenizer, features):
+    features = [{"input_ids": feature["input_ids"]} for feature in features]
+    padded = pad_with_tokenizer_config(tokenizer, features)
+    expected = tokenizer.pad(features, return_tensors="pt")
+    assert list(padded) == list(expected)
+    torch.testing.assert_close(padded["attention_mask"], expected["attention_mask"])
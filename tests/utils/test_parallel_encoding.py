@@ -0,0 +1,48 @@
+import pytest
+
+from pytorch_ie.taskmodules import TransformerRETextClassificationTaskModule
+from pytorch_ie.utils.parallel_encoding import encode_in_parallel
+
+
+@pytest.fixture
+def taskmodule(documents):
+    taskmodule = TransformerRETextClassificationTaskModule(
+        tokenizer_name_or_path="bert-base-cased",
+        relation_annotation="relations",
+        create_relation_candidates=True,
+    )
+    taskmodule.prepare(documents)
+    return taskmodule
+
+
+@pytest.mark.parametrize("encode_target", [False, True])
+def test_encode_in_parallel(taskmodule, documents, encode_target):
+    expected_encodings, expected_documents_in_order = taskmodule.batch_encode(
+        documents, encode_target=encode_target
+    )
+    task_encodings, documents_in_order = encode_in_parallel(
+        taskmodule, documents, num_workers=2, encode_target=encode_target, num_shards=3
+    )
+    assert documents_in_order == expected_documents_in_order
+    assert len(task_encodings) == len(expected_encodings)
+    for task_encoding, expected_encoding in zip(task_encodings, expected_encodings):
+        # the task encodings reference the original documents
+        assert task_encoding.document is expected_encoding.document
+        assert task_encoding.inputs == expected_encoding.inputs
+        if encode_target:
+            assert task_encoding.targets == expected_encoding.targets
+        else:
+            assert not task_encoding.has_targets
+        # the candidate relations are created in the worker processes, but their arguments are
+        # the entities of the original documents
+        candidate = task_encoding.metadata["candidate_annotation"]
+        expected_candidate = expected_encoding.metadata["candidate_annotation"]
+        assert candidate == expected_candidate
+        assert candidate.head is expected_candidate.head
+        assert candidate.tail is expected_candidate.tail
+
+    # the decoded annotations can be added to the original documents
+    candidate = task_encodings[0].metadata["candidate_annotation"]
+    task_encodings[0].document.relations.predictions.append(candidate.copy())
+    assert len(task_encodings[0].document.relations.predictions) == 1
+    task_encodings[0].document.relations.predictions.clear()
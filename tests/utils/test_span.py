@@ -1,3 +1,119 @@
+import numpy as np
+import pytest
+
+from pytorch_ie.utils.span import (
+    TagIdMapping,
+    bio_tags_to_spans,
+    get_char_to_token_mapper,
+    get_char_to_token_mapper_from_offsets,
+    io_tags_to_spans,
+    tag_ids_to_spans,
+    token_spans_to_tag_ids,
+)
+
+
+def test_get_char_to_token_mapper_from_offsets():
+    # "Jane lives in Berlin." tokenized as: Jane, lives, in, Ber, ##lin, .
+    offsets = [(0, 4), (5, 10), (11, 13), (14, 17), (17, 20), (20, 21)]
+    token_starts = np.array([start for start, _ in offsets])
+    token_ends = np.array([end for _, end in offsets])
+
+    mapper = get_char_to_token_mapper_from_offsets(
+        token_starts=token_starts, token_ends=token_ends
+    )
+    char_to_token_mapping = {
+        char_idx: token_idx
+        for token_idx, (start, end) in enumerate(offsets)
+        for char_idx in range(start, end)
+    }
+    dict_mapper = get_char_to_token_mapper(char_to_token_mapping=char_to_token_mapping)
+    for char_idx in range(25):
+        assert mapper(char_idx) == dict_mapper(char_idx)
+    # whitespace is not part of any token
+    assert mapper(4) is None
+    assert mapper(16) == 3
+    assert mapper(17) == 4
+
+    # window over the tokens "in Ber ##lin" with a leading special token, e.g. [CLS]
+    window_mapper = get_char_to_token_mapper_from_offsets(
+        token_starts=token_starts,
+        token_ends=token_ends,
+        token_slice=(2, 5),
+        token_positions=np.array([1, 2, 3]),
+        char_start=11,
+        char_end=20,
+    )
+    assert window_mapper(5) == -1
+    assert window_mapper(11) == 1
+    assert window_mapper(18) == 3
+    assert window_mapper(20) == -2
+
+
+BIO_LABEL_TO_ID = {"O": 0, "B-PER": 1, "I-PER": 2, "B-LOC": 3, "I-LOC": 4}
+
+
+def test_tag_id_mapping():
+    mapping = TagIdMapping.from_label_to_id(BIO_LABEL_TO_ID)
+    assert mapping.labels == ["PER", "LOC"]
+    assert mapping.tag_id_to_label_index.tolist() == [-1, 0, 0, 1, 1]
+    assert mapping.label_index_to_begin_tag_id.tolist() == [1, 3]
+    assert mapping.label_index_to_inside_tag_id.tolist() == [2, 4]
+    assert mapping.outside_tag_id == 0
+
+
+def test_token_spans_to_tag_ids():
+    mapping = TagIdMapping.from_label_to_id(BIO_LABEL_TO_ID)
+    tag_ids = token_spans_to_tag_ids(
+        starts=np.array([1, 4]),
+        ends=np.array([2, 4]),
+        label_indices=np.array([0, 1]),
+        tag_id_mapping=mapping,
+        length=6,
+    )
+    assert tag_ids.tolist() == [0, 1, 2, 0, 3, 0]
+
+    # overlapping spans
+    tag_ids = token_spans_to_tag_ids(
+        starts=np.array([1, 2]),
+        ends=np.array([2, 4]),
+        label_indices=np.array([0, 1]),
+        tag_id_mapping=mapping,
+        length=6,
+    )
+    assert tag_ids is None
+
+
+@pytest.mark.parametrize("include_ill_formed", [True, False])
+def test_tag_ids_to_spans(include_ill_formed):
+    mapping = TagIdMapping.from_label_to_id(BIO_LABEL_TO_ID)
+    id_to_label = {v: k for k, v in BIO_LABEL_TO_ID.items()}
+    batch = np.array([[1, 2, 0, 2, 2, 3, 4, 1], [4, 3, 3, 0, 1, 2, 2, 4]])
+    spans = tag_ids_to_spans(batch, tag_id_mapping=mapping, include_ill_formed=include_ill_formed)
+    for batch_idx, tag_ids in enumerate(batch):
+        expected = bio_tags_to_spans(
+            [id_to_label[tag_id] for tag_id in tag_ids], include_ill_formed=include_ill_formed
+        )
+        assert sorted(
+            (mapping.labels[label_index], (start, end))
+            for b, label_index, start, end in spans.tolist()
+            if b == batch_idx
+        ) == sorted(expected)
+
+    # special tokens are masked out
+    spans = tag_ids_to_spans(np.array([1, 2, 2]), tag_id_mapping=mapping, mask=np.array([0, 0, 1]))
+    assert spans.tolist() == [[0, 0, 1]]
+
+
+def test_tag_ids_to_spans_io_encoding():
+    label_to_id = {"O": 0, "PER": 1, "LOC": 2}
+    mapping = TagIdMapping.from_label_to_id(label_to_id)
+    tags = ["PER", "PER", "O", "LOC", "PER"]
+    spans = tag_ids_to_spans(np.array([label_to_id[tag] for tag in tags]), tag_id_mapping=mapping)
+    assert sorted(
+        (mapping.labels[label_index], (start, end)) for label_index, start, end in spans.tolist()
+    ) == sorted(io_tags_to_spans(tags))
+
+
 # import pytest
 
 # from pytorch_ie.utils.span import (
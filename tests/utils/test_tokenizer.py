@@ -0,0 +1,134 @@
+import copy
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pytorch_ie.utils import tokenizer as tokenizer_utils
+from pytorch_ie.utils.tokenizer import (
+    clear_tokenizer_cache,
+    detach_tokenizer,
+    get_tokenizer,
+    is_shared_tokenizer,
+)
+
+TOKENIZER_NAME = "bert-base-cased"
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_tokenizer_cache()
+    yield
+    clear_tokenizer_cache()
+
+
+def test_get_tokenizer():
+    tokenizer1 = get_tokenizer(TOKENIZER_NAME)
+    tokenizer2 = get_tokenizer(TOKENIZER_NAME)
+    assert tokenizer1 is not tokenizer2
+    assert is_shared_tokenizer(tokenizer1)
+    assert is_shared_tokenizer(tokenizer2)
+    # the backend is shared
+    assert tokenizer1._tokenizer is tokenizer2._tokenizer
+    assert len(tokenizer_utils._TOKENIZER_CACHE) == 1
+
+    # per-copy attributes are not shared
+    tokenizer1.padding_side = "left"
+    assert tokenizer2.padding_side == "right"
+
+    # different kwargs result in a different cache entry
+    get_tokenizer(TOKENIZER_NAME, model_max_length=16)
+    assert len(tokenizer_utils._TOKENIZER_CACHE) == 2
+
+
+def test_detach_tokenizer():
+    tokenizer1 = get_tokenizer(TOKENIZER_NAME)
+    tokenizer2 = get_tokenizer(TOKENIZER_NAME)
+    vocab_size = len(tokenizer2)
+
+    assert detach_tokenizer(tokenizer1) is tokenizer1
+    assert not is_shared_tokenizer(tokenizer1)
+    tokenizer1.add_tokens(["[H]", "[/H]"], special_tokens=True)
+
+    assert len(tokenizer1) == vocab_size + 2
+    assert len(tokenizer2) == vocab_size
+    assert len(get_tokenizer(TOKENIZER_NAME)) == vocab_size
+    assert tokenizer1.tokenize("[H] Jane") == ["[H]", "Jane"]
+    assert tokenizer2.tokenize("[H] Jane") != ["[H]", "Jane"]
+
+
+@pytest.mark.parametrize("use_fast", [True, False])
+def test_add_tokens_detaches_tokenizer(use_fast):
+    tokenizer1 = get_tokenizer(TOKENIZER_NAME, use_fast=use_fast)
+    tokenizer2 = get_tokenizer(TOKENIZER_NAME, use_fast=use_fast)
+    vocab_size = len(tokenizer2)
+
+    # adding tokens without calling detach_tokenizer() does not affect the other copies
+    tokenizer1.add_special_tokens({"additional_special_tokens": ["[H]", "[/H]"]})
+    assert not is_shared_tokenizer(tokenizer1)
+    assert type(tokenizer1).__name__ == type(tokenizer2).__name__
+    assert len(tokenizer1) == vocab_size + 2
+    assert len(tokenizer2) == vocab_size
+    assert len(get_tokenizer(TOKENIZER_NAME, use_fast=use_fast)) == vocab_size
+    assert tokenizer1.tokenize("[H] Jane") == ["[H]", "Jane"]
+    assert tokenizer2.tokenize("[H] Jane") != ["[H]", "Jane"]
+
+    tokenizer2.add_tokens(["[T]"])
+    assert not is_shared_tokenizer(tokenizer2)
+    assert len(tokenizer2) == vocab_size + 1
+    assert len(tokenizer1) == vocab_size + 2
+
+
+def test_copy_and_pickle_shared_tokenizer():
+    tokenizer = get_tokenizer(TOKENIZER_NAME)
+
+    # a shallow copy is another shared copy
+    shallow_copy = copy.copy(tokenizer)
+    assert is_shared_tokenizer(shallow_copy)
+    assert shallow_copy._tokenizer is tokenizer._tokenizer
+
+    # deep copied and unpickled tokenizers do not share any state
+    for other in [copy.deepcopy(tokenizer), pickle.loads(pickle.dumps(tokenizer))]:
+        assert not is_shared_tokenizer(other)
+        assert type(other) is tokenizer._base_class
+        assert other._tokenizer is not tokenizer._tokenizer
+        assert other.tokenize("Jane Doe") == tokenizer.tokenize("Jane Doe")
+
+
+def test_get_tokenizer_multiple_threads(monkeypatch):
+    calls = []
+    original_from_pretrained = tokenizer_utils.AutoTokenizer.from_pretrained
+
+    def from_pretrained(*args, **kwargs):
+        calls.append(args)
+        return original_from_pretrained(*args, **kwargs)
+
+    monkeypatch.setattr(tokenizer_utils.AutoTokenizer, "from_pretrained", from_pretrained)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        tokenizers = list(executor.map(lambda _: get_tokenizer(TOKENIZER_NAME), range(8)))
+
+    assert len(calls) == 1
+    assert len({id(tokenizer) for tokenizer in tokenizers}) == 8
+
+
+def test_shared_tokenizers_with_different_truncation_in_threads():
+    text = "Jane Doe lives in Berlin and works for the Humboldt University"
+    tokenizers = [get_tokenizer(TOKENIZER_NAME) for _ in range(4)]
+    full_length = len(tokenizers[0](text)["input_ids"])
+
+    def encode(idx):
+        tokenizer = tokenizers[idx % len(tokenizers)]
+        max_length = 4 + idx % len(tokenizers)
+        lengths = set()
+        for _ in range(50):
+            lengths.add(len(tokenizer(text, truncation=True, max_length=max_length)["input_ids"]))
+            lengths.add(len(tokenizer(text)["input_ids"]) - full_length + max_length)
+        return lengths, max_length
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(encode, range(8)))
+
+    # the truncation settings of the other threads do not leak into the results
+    for lengths, max_length in results:
+        assert lengths == {max_length}